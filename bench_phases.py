@@ -0,0 +1,209 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+# ensure imports work regardless of working directory
+PROJECT_ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.lexer import tokenize
+from src.parser import Parser
+from src.semantic import SemanticAnalyzer
+from src.codegen import Compiler
+from src.vm import VM
+
+# Per-phase benchmark of the compiler on synthetic programs. Every phase
+# gets the previous phase's output, built once up front, so its time is
+# its own: tokenize(source) to a list, Parser(tokens).parse(), analyze, compile, run.
+# Times are the best of --rounds runs. Memory is measured in a separate
+# pass under tracemalloc (which slows everything down): the peak above the
+# phase's starting point and the blocks still alive when it returns.
+#
+#   python bench_phases.py --json out.json
+#   python bench_phases.py --compare out.json    # exit status 1 on regressions
+
+
+def deep_expressions(n):
+    # n lines of nested parentheses, 60 levels each
+    depth = 60
+    return ''.join(f'd{i} = ' + '(' * depth + str(i) + ''.join(f' - {j})' for j in range(depth)) + '\n'
+                   for i in range(n))
+
+
+def wide_sums(n):
+    # n terms in sums of 300: a sum is a left-leaning chain, and the analyzer
+    # and the compiler recurse down it
+    width = 300
+    lines = ['a = 3']
+    for start in range(0, n, width):
+        lines.append(f's{start} = ' + ' + '.join(f'a * {i}' for i in range(start, min(n, start + width))))
+    return '\n'.join(lines) + '\n'
+
+
+def many_functions(n):
+    src = 'k = 2\n'
+    src += ''.join(f'function f{i}(x, y) = x * {i} + y / k\n' for i in range(n))
+    src += ''.join(f'r{i} = f{i}({i}, k)\n' for i in range(n))
+    return src
+
+
+def call_chain(n):
+    # each call nests one VM frame, so n stays below the recursion limit
+    src = ''.join(f'function f{i}(x) = f{i + 1}(x + 1) * 1\n' for i in range(n))
+    return src + f'function f{n}(x) = x\nr = f0(0)\n'
+
+
+def large_file(n):
+    lines = ['x0 = 1', 'function step(a, b) = (a + b) / 2 + a * b ^ 0.5']
+    for i in range(1, n):
+        lines.append(f'x{i} = step(x{i - 1}, {i % 7}.5) - x{i - 1} * {i % 3}')
+    return '\n'.join(lines) + '\n'
+
+
+GENERATORS = {
+    'deep_expressions': (deep_expressions, 200),
+    'wide_sums': (wide_sums, 3000),
+    'many_functions': (many_functions, 2000),
+    'call_chain': (call_chain, 300),
+    'large_file': (large_file, 20000),
+}
+
+
+def phase_steps(source):
+    # (name, fn) pairs; each fn runs the phase on inputs prepared before it
+    tokens = list(tokenize(source))
+    program = Parser(tokens).parse()
+    analyzer = SemanticAnalyzer()
+    analyzer.analyze(program)
+    main, functions = Compiler().compile(program)
+    return [
+        ('tokenize', lambda: list(tokenize(source))),
+        ('parse', lambda: Parser(tokens).parse()),
+        ('analyze', lambda: SemanticAnalyzer().analyze(program)),
+        ('compile', lambda: Compiler().compile(program)),
+        ('run', lambda: VM(main, functions).run()),
+    ]
+
+
+def best_of(fn, rounds):
+    best = None
+    for _ in range(rounds):
+        t = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure_memory(fn):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = fn()
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        del result
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    return {'peak_kib': round((peak - start) / 1024, 1), 'retained_kib': round((current - start) / 1024, 1),
+            'retained_blocks': blocks}
+
+
+def run_benchmarks(names, scale, rounds, memory=True):
+    results = {}
+    for name in names:
+        generate, size = GENERATORS[name]
+        size = max(1, int(size * scale))
+        source = generate(size)
+        entry = {'size': size, 'source_bytes': len(source), 'phases': {}}
+        for phase, fn in phase_steps(source):
+            stats = {'seconds': best_of(fn, rounds)}
+            if memory:
+                stats.update(measure_memory(fn))
+            entry['phases'][phase] = stats
+        results[name] = entry
+    return {
+        'python': platform.python_version(),
+        'scale': scale,
+        'rounds': rounds,
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold, min_seconds):
+    # phases slower (or with a higher memory peak) than the baseline by more
+    # than threshold; differences under min_seconds are noise
+    regressions = []
+    for name, entry in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None or old['size'] != entry['size']:
+            continue
+        for phase, stats in entry['phases'].items():
+            before = old['phases'].get(phase)
+            if before is None:
+                continue
+            t0, t1 = before['seconds'], stats['seconds']
+            if t1 > t0 * (1 + threshold) and t1 - t0 > min_seconds:
+                regressions.append((name, phase, 'seconds', t0, t1))
+            if 'peak_kib' in stats and 'peak_kib' in before:
+                m0, m1 = before['peak_kib'], stats['peak_kib']
+                if m1 > m0 * (1 + threshold) and m1 - m0 > 64:
+                    regressions.append((name, phase, 'peak_kib', m0, m1))
+    return regressions
+
+
+def print_table(report, baseline=None):
+    for name, entry in report['results'].items():
+        print(f'{name} (size {entry["size"]}, {entry["source_bytes"]} bytes)')
+        old = baseline['results'].get(name) if baseline else None
+        for phase, stats in entry['phases'].items():
+            line = f'  {phase:9} {stats["seconds"] * 1000:10.2f} ms'
+            if 'peak_kib' in stats:
+                line += f'  peak {stats["peak_kib"]:10.1f} KiB  retained {stats["retained_blocks"]:8} blocks'
+            if old and old['size'] == entry['size'] and phase in old['phases']:
+                line += f'  x{stats["seconds"] / old["phases"][phase]["seconds"]:.2f} vs baseline'
+            print(line)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Time each compiler phase on synthetic programs.')
+    ap.add_argument('programs', nargs='*', help='generators to run: ' + ', '.join(GENERATORS) + ' (default: all)')
+    ap.add_argument('--scale', type=float, default=1.0, help='multiply every program size')
+    ap.add_argument('--rounds', type=int, default=5)
+    ap.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    ap.add_argument('--json', metavar='FILE', help='write the results as JSON')
+    ap.add_argument('--compare', metavar='BASELINE', help='flag regressions against a stored JSON result')
+    ap.add_argument('--threshold', type=float, default=0.10, help='allowed slowdown before flagging (default 10%%)')
+    ap.add_argument('--min-seconds', type=float, default=0.0005, help='ignore time differences below this')
+    args = ap.parse_args(argv)
+    for name in args.programs:
+        if name not in GENERATORS:
+            ap.error(f'unknown program {name!r}')
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    report = run_benchmarks(args.programs or list(GENERATORS), args.scale, args.rounds, not args.no_memory)
+    print_table(report, baseline)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+    if baseline is not None:
+        regressions = compare(report, baseline, args.threshold, args.min_seconds)
+        for name, phase, metric, old, new in regressions:
+            print(f'REGRESSION {name}/{phase} {metric}: {old:.6g} -> {new:.6g}')
+        if regressions:
+            return 1
+        print('no regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
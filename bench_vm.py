@@ -0,0 +1,128 @@
+import sys
+import time
+from pathlib import Path
+# ensure imports work regardless of working directory
+PROJECT_ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.parser import Parser
+from src.semantic import SemanticAnalyzer
+from src.codegen import Compiler
+from src.vm import VM, SlotVM, FrameStackVM
+from src.regvm import RegisterVM, count_instructions as count_register_instructions
+from src.server import count_instructions
+from src.closures import ClosureVM
+from src.transpiler import Transpiler
+from src.optimizer import Optimizer
+
+# A formula library of small helpers called from a hot top-level body.
+SOURCE = '''
+function sq(x) = x * x
+function lerp(a, b, t) = a + (b - a) * t
+function poly(x) = 3 * x ^ 2 + 2 * x + 1
+function norm(x, y) = (sq(x) + sq(y)) ^ 0.5
+function mix(x, y) = lerp(poly(x), poly(y), 0.25) / norm(x, y)
+scale = 1.5
+'''
+SOURCE += ''.join(f'r{i} = mix({i} * scale, {i + 1}) + sq({i})\n' for i in range(200))
+
+REPEAT = 50
+
+
+def best_of(fn, rounds=5):
+    best = None
+    for _ in range(rounds):
+        t = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_vm(program):
+    main, functions = Compiler().compile(program)
+    def run():
+        for _ in range(REPEAT):
+            VM(main, functions).run()
+    return run
+
+
+def bench_peephole_vm(program):
+    main, functions = Compiler(peephole=True).compile(program)
+    def run():
+        for _ in range(REPEAT):
+            VM(main, functions).run()
+    return run
+
+
+def bench_optimized_vm(program):
+    return bench_vm(Optimizer().optimize(program))
+
+
+def bench_slot_vm(program):
+    slots = Compiler().compile_slots(program)
+    def run():
+        for _ in range(REPEAT):
+            SlotVM(slots).run()
+    return run
+
+
+def bench_frame_stack_vm(program):
+    slots = Compiler().compile_slots(program)
+    def run():
+        for _ in range(REPEAT):
+            FrameStackVM(slots).run()
+    return run
+
+
+def bench_register_vm(program):
+    regs = Compiler().compile_registers(program)
+    def run():
+        for _ in range(REPEAT):
+            RegisterVM(regs).run()
+    return run
+
+
+def bench_closure_vm(program):
+    main, functions = Compiler().compile(program)
+    vm = ClosureVM(main, functions)
+    def run():
+        for _ in range(REPEAT):
+            vm.globals = {}
+            vm.run()
+    return run
+
+
+def bench_transpiled(program):
+    py = Transpiler().transpile(program)
+    def run():
+        for _ in range(REPEAT):
+            py.globals = {}
+            py.run()
+    return run
+
+
+BACKENDS = [
+    ('VM', bench_vm),
+    ('VM(peephole)', bench_peephole_vm),
+    ('VM+Optimizer', bench_optimized_vm),
+    ('SlotVM', bench_slot_vm),
+    ('FrameStackVM', bench_frame_stack_vm),
+    ('RegisterVM', bench_register_vm),
+    ('ClosureVM', bench_closure_vm),
+    ('Transpiler', bench_transpiled),
+]
+
+
+if __name__ == '__main__':
+    program = Parser(SOURCE).parse()
+    SemanticAnalyzer().analyze(program)
+    baseline = None
+    for name, setup in BACKENDS:
+        elapsed = best_of(setup(program))
+        baseline = baseline or elapsed
+        print(f'{name:12} {elapsed * 1000:9.2f} ms  x{baseline / elapsed:.2f}')
+    # instructions one run executes, stack vs register format
+    stack = count_instructions(*Compiler().compile(program))
+    registers = count_register_instructions(Compiler().compile_registers(program))
+    print(f'instructions per run: stack {stack}, register {registers} ({registers / stack:.0%})')
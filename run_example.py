@@ -7,31 +7,53 @@ sys.path.insert(0, str(PROJECT_ROOT))
 from src.lexer import tokenize
 from src.parser import Parser
 from src.semantic import SemanticAnalyzer
+from src.optimizer import Optimizer
 from src.codegen import Compiler
 from src.vm import VM
+from src.profiler import ProfilingVM
+from src.bytecache import BytecodeCache, compile_cached
 
 with open(PROJECT_ROOT / 'examples' / 'example.pcg', 'r', encoding='utf-8') as f:
     code = f.read()
 
 print('Source:\n', code)
 
-p = Parser(code)
-program = p.parse()
-
-sa = SemanticAnalyzer()
-try:
-    sa.analyze(program)
-except Exception as e:
-    print('Semantic error:', e)
-    raise
-
-compiler = Compiler()
-main, functions = compiler.compile(program)
+# pass --cache DIR to load the compiled program from (and store it in) an
+# on-disk bytecode cache
+optimize = '--no-optimize' not in sys.argv
+if '--cache' in sys.argv:
+    cache = BytecodeCache(sys.argv[sys.argv.index('--cache') + 1])
+    compiled = compile_cached(code, cache, optimize=optimize)
+    if cache.hits:
+        print('Loaded compiled program from cache')
+else:
+    p = Parser(code)
+    program = p.parse()
+
+    sa = SemanticAnalyzer()
+    try:
+        sa.analyze(program)
+    except Exception as e:
+        print('Semantic error:', e)
+        raise
+
+    # pass --no-optimize to compile the program exactly as parsed
+    optimizer = Optimizer(enabled=optimize)
+    program = optimizer.optimize(program)
+    print(optimizer.report())
+
+    compiler = Compiler()
+    compiled = compiler.compile(program)
+main, functions = compiled
 
 # The Compiler produced function codeobjects but without parameter name mapping.
 # For now we will attach functions as produced in compiler.functions
-vm = VM(main, functions)
+# pass --profile to count instructions and time each function
+profiling = '--profile' in sys.argv
+vm = ProfilingVM(main, functions) if profiling else VM(main, functions)
 res = vm.run()
+if profiling:
+    print(vm.profile.report())
 
 print('Execution finished. Globals:')
 for k,v in vm.globals.items():
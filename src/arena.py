@@ -0,0 +1,217 @@
+from array import array
+from .ast import *
+
+# Flat AST: every node is a row of parallel typed arrays instead of an
+# object. Rows are appended children first, so a node's index is always
+# greater than its children's.
+#   kind   NUMBER, VAR, BINOP, CALL, ASSIGN or FUNCDEF
+#   op     index into OPS (BINOP)
+#   left   left operand (BINOP), value (ASSIGN), body (FUNCDEF), or the
+#          callee expression of a CALL whose callee is not a name (else -1)
+#   right  right operand (BINOP), or offset into extra of a count followed
+#          by that many indices: argument rows (CALL), param names (FUNCDEF)
+#   value  index into values (NUMBER) or names (everything named)
+#
+# ArenaProgram is a Program whose statements attribute is a lazy sequence:
+# a statement is materialized into ordinary nodes when it is read, so
+# SemanticAnalyzer, Compiler, the optimizer and the test helpers walk an
+# arena exactly like a Program, while only one statement's nodes are alive
+# at a time.
+
+NUMBER, VAR, BINOP, CALL, ASSIGN, FUNCDEF = range(6)
+OPS = ['+', '-', '*', '/', '^']
+OP_CODES = {op: code for code, op in enumerate(OPS)}
+
+
+class Arena:
+    def __init__(self):
+        self.kind = array('B')
+        self.op = array('B')
+        self.left = array('i')
+        self.right = array('i')
+        self.value = array('i')
+        self.extra = array('i')
+        self.values = []
+        self.names = []
+        self.value_ids = {}
+        self.name_ids = {}
+
+    def __len__(self):
+        return len(self.kind)
+
+    def row(self, kind, op=0, left=-1, right=-1, value=-1):
+        self.kind.append(kind)
+        self.op.append(op)
+        self.left.append(left)
+        self.right.append(right)
+        self.value.append(value)
+        return len(self.kind) - 1
+
+    def name_id(self, name):
+        idx = self.name_ids.get(name)
+        if idx is None:
+            idx = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return idx
+
+    def value_id(self, value):
+        # 1 and 1.0 (and 0.0 and -0.0) are different constants
+        key = (value.__class__, repr(value))
+        idx = self.value_ids.get(key)
+        if idx is None:
+            idx = self.value_ids[key] = len(self.values)
+            self.values.append(value)
+        return idx
+
+    def add_list(self, items):
+        offset = len(self.extra)
+        self.extra.append(len(items))
+        self.extra.extend(items)
+        return offset
+
+    def read_list(self, offset):
+        n = self.extra[offset]
+        return self.extra[offset+1:offset+1+n]
+
+    def add(self, node):
+        # iterative post-order: generated expressions nest far deeper than
+        # the Python recursion limit
+        done = {}
+        todo = [(node, False)]
+        while todo:
+            n, expanded = todo.pop()
+            if id(n) in done:
+                continue
+            if not expanded:
+                todo.append((n, True))
+                for child in reversed(children(n)):
+                    todo.append((child, False))
+                continue
+            done[id(n)] = self.add_row(n, done)
+        return done[id(node)]
+
+    def add_row(self, n, done):
+        if isinstance(n, Number):
+            return self.row(NUMBER, value=self.value_id(n.value))
+        if isinstance(n, Var):
+            return self.row(VAR, value=self.name_id(n.name))
+        if isinstance(n, BinaryOp):
+            return self.row(BINOP, OP_CODES[n.op], done[id(n.left)], done[id(n.right)])
+        if isinstance(n, Call):
+            args = self.add_list([done[id(a)] for a in n.args])
+            if isinstance(n.name, str):
+                return self.row(CALL, right=args, value=self.name_id(n.name))
+            return self.row(CALL, left=done[id(n.name)], right=args)
+        if isinstance(n, Assign):
+            return self.row(ASSIGN, left=done[id(n.expr)], value=self.name_id(n.name))
+        if isinstance(n, FunctionDef):
+            params = self.add_list([self.name_id(p) for p in n.params])
+            return self.row(FUNCDEF, left=done[id(n.body)], right=params, value=self.name_id(n.name))
+        raise TypeError(f'Unsupported node type: {type(n)}')
+
+    def node(self, idx):
+        # materialize the subtree rooted at row idx; children have smaller
+        # indices, so one pass over the reachable rows in increasing order
+        # builds every child before its parent
+        rows = set()
+        todo = [idx]
+        while todo:
+            i = todo.pop()
+            if i in rows:
+                continue
+            rows.add(i)
+            todo.extend(self.child_rows(i))
+        built = {}
+        for i in sorted(rows):
+            built[i] = self.build(i, built)
+        return built[idx]
+
+    def child_rows(self, i):
+        kind = self.kind[i]
+        if kind == BINOP:
+            return (self.left[i], self.right[i])
+        if kind == CALL:
+            args = list(self.read_list(self.right[i]))
+            if self.left[i] >= 0:
+                args.append(self.left[i])
+            return args
+        if kind == ASSIGN or kind == FUNCDEF:
+            return (self.left[i],)
+        return ()
+
+    def build(self, i, built):
+        kind = self.kind[i]
+        if kind == NUMBER:
+            return Number(self.values[self.value[i]])
+        if kind == VAR:
+            return Var(self.names[self.value[i]])
+        if kind == BINOP:
+            return BinaryOp(OPS[self.op[i]], built[self.left[i]], built[self.right[i]])
+        if kind == CALL:
+            name = self.names[self.value[i]] if self.left[i] < 0 else built[self.left[i]]
+            return Call(name, [built[a] for a in self.read_list(self.right[i])])
+        if kind == ASSIGN:
+            return Assign(self.names[self.value[i]], built[self.left[i]])
+        params = [self.names[p] for p in self.read_list(self.right[i])]
+        return FunctionDef(self.names[self.value[i]], params, built[self.left[i]])
+
+
+def children(node):
+    if isinstance(node, BinaryOp):
+        return (node.left, node.right)
+    if isinstance(node, Call):
+        if isinstance(node.name, str):
+            return tuple(node.args)
+        return tuple(node.args) + (node.name,)
+    if isinstance(node, Assign):
+        return (node.expr,)
+    if isinstance(node, FunctionDef):
+        return (node.body,)
+    return ()
+
+
+class ArenaStatements:
+    # read-only sequence of statements, materialized on access
+    def __init__(self, arena, roots):
+        self.arena = arena
+        self.roots = roots
+
+    def __len__(self):
+        return len(self.roots)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.arena.node(r) for r in self.roots[i]]
+        return self.arena.node(self.roots[i])
+
+    def __iter__(self):
+        for r in self.roots:
+            yield self.arena.node(r)
+
+
+class ArenaProgram(Program):
+    # a Program whose statements live in an Arena
+    __slots__ = ('arena', 'roots')
+
+    def __init__(self, arena=None, roots=None):
+        self.arena = arena if arena is not None else Arena()
+        self.roots = roots if roots is not None else array('i')
+
+    @classmethod
+    def build(cls, statements):
+        # statements is any iterable, e.g. Parser(..., streaming=True)
+        # .parse_iter(), so each statement's nodes are dropped once stored
+        prog = cls()
+        for stmt in statements:
+            prog.append(stmt)
+        return prog
+
+    def append(self, stmt):
+        self.roots.append(self.arena.add(stmt))
+
+    @property
+    def statements(self):
+        return ArenaStatements(self.arena, self.roots)
+
+    def to_program(self):
+        return Program(list(self.statements))
@@ -1,36 +1,51 @@
 class Node:
-    pass
+    # no per-instance __dict__: generated programs build millions of nodes
+    __slots__ = ()
 
 class Number(Node):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
 class Var(Node):
+    __slots__ = ('name',)
+
     def __init__(self, name):
         self.name = name
 
 class BinaryOp(Node):
+    __slots__ = ('op', 'left', 'right')
+
     def __init__(self, op, left, right):
         self.op = op
         self.left = left
         self.right = right
 
 class Assign(Node):
+    __slots__ = ('name', 'expr')
+
     def __init__(self, name, expr):
         self.name = name
         self.expr = expr
 
 class FunctionDef(Node):
+    __slots__ = ('name', 'params', 'body')
+
     def __init__(self, name, params, body):
         self.name = name
         self.params = params
         self.body = body
 
 class Call(Node):
+    __slots__ = ('name', 'args')
+
     def __init__(self, name, args):
         self.name = name
         self.args = args
 
 class Program(Node):
+    __slots__ = ('statements',)
+
     def __init__(self, statements):
         self.statements = statements
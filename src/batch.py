@@ -0,0 +1,220 @@
+import math
+import operator
+from .vm import VMError
+from .codegen import materialize_all
+from .peephole import expand
+
+try:
+    import numpy
+except ImportError:  # optional: the pure-Python path covers everything
+    numpy = None
+
+# Batched evaluation of one compiled function over columns of arguments.
+# The instruction list is interpreted once per chunk of rows; every stack
+# value is either a scalar (constants, globals, anything derived only from
+# them) or a column holding one value per row, and each ADD/SUB/... runs
+# over the whole column at once.
+#
+# Results match VM row by row, types included. The NumPy path is used for
+# chunks whose columns are all-int or all-float; ints are kept within 2**53
+# so int64 arithmetic, int->float promotion and int/int division give the
+# same values as Python, and a chunk that could leave that range, divide by
+# zero or hit a mixed column is evaluated again on the pure-Python path,
+# which raises exactly what VM would. '^' always goes through math.pow.
+
+INT_LIMIT = 2 ** 53
+PY_OPS = {
+    'ADD': operator.add,
+    'SUB': operator.sub,
+    'MUL': operator.mul,
+    'DIV': operator.truediv,
+    'POW': math.pow,
+}
+
+
+class Fallback(Exception):
+    pass
+
+
+def column_values(column, start, stop):
+    chunk = column[start:stop]
+    if numpy is not None and isinstance(chunk, numpy.ndarray):
+        return chunk.tolist()
+    return list(chunk)
+
+
+class BatchEvaluator:
+    def __init__(self, functions, globals_=None, use_numpy=None):
+        self.functions = materialize_all(functions)
+        self.globals = globals_ if globals_ is not None else {}
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        if use_numpy and numpy is None:
+            raise ImportError('numpy is not installed')
+        self.use_numpy = use_numpy
+        self.chunk_size = 65536 if use_numpy else 4096
+        self.numpy_chunks = 0
+        self.python_chunks = 0
+
+    def evaluate(self, fname, columns, chunk_size=None):
+        if fname not in self.functions:
+            raise VMError(f'Call to undefined function {fname}')
+        co = self.functions[fname]
+        if len(columns) != len(co.params):
+            raise VMError(f'Function {fname} expects {len(co.params)} args, got {len(columns)}')
+        rows = len(columns[0]) if columns else 0
+        for c in columns:
+            if len(c) != rows:
+                raise ValueError('argument columns must have the same length')
+        chunk_size = chunk_size or self.chunk_size
+        results = []
+        for start in range(0, rows, chunk_size):
+            stop = min(start + chunk_size, rows)
+            values = [column_values(c, start, stop) for c in columns]
+            results.extend(self.evaluate_chunk(co, values, stop - start))
+        return results
+
+    def evaluate_chunk(self, co, values, n):
+        if self.use_numpy:
+            args = self.to_arrays(values)
+            if args is not None:
+                try:
+                    # Python float arithmetic overflows to inf/nan silently
+                    with numpy.errstate(over='ignore', invalid='ignore'):
+                        result = self.run(co, args, n, NumpyOps)
+                    self.numpy_chunks += 1
+                    if isinstance(result, numpy.ndarray):
+                        return result.tolist()
+                    return [result] * n
+                except Fallback:
+                    pass
+        result = self.run(co, values, n, PythonOps)
+        self.python_chunks += 1
+        if isinstance(result, list):
+            return result
+        return [result] * n
+
+    def to_arrays(self, values):
+        arrays = []
+        for col in values:
+            kinds = {type(v) for v in col}
+            if kinds == {int}:
+                if max(col) > INT_LIMIT or min(col) < -INT_LIMIT:
+                    return None
+                arrays.append(numpy.array(col, dtype=numpy.int64))
+            elif kinds == {float}:
+                arrays.append(numpy.array(col, dtype=numpy.float64))
+            else:
+                return None
+        return arrays
+
+    def run(self, co, args, n, ops):
+        co = expand(co)
+        params = co.params
+        consts = co.consts
+        temps = [None] * co.ntemps
+        stack = []
+        for ins in co.instructions:
+            op = ins[0]
+            if op == 'LOAD_LOCAL':
+                if ins[1] not in params:
+                    raise VMError(f'Undefined local {ins[1]}')
+                stack.append(args[params.index(ins[1])])
+            elif op == 'PUSH_CONST':
+                stack.append(consts[ins[1]])
+            elif op in PY_OPS:
+                b = stack.pop(); a = stack.pop()
+                stack.append(ops.binary(op, a, b, n))
+            elif op == 'LOAD_VAR':
+                name = ins[1]
+                if name in params:
+                    stack.append(args[params.index(name)])
+                elif name in self.globals:
+                    stack.append(self.globals[name])
+                else:
+                    raise VMError(f'Undefined variable {name}')
+            elif op == 'CALL':
+                fname = ins[1]; argc = ins[2]
+                call_args = stack[len(stack)-argc:]
+                del stack[len(stack)-argc:]
+                if fname not in self.functions:
+                    raise VMError(f'Call to undefined function {fname}')
+                stack.append(self.run(self.functions[fname], call_args, n, ops))
+            elif op == 'DUP':
+                stack.append(stack[-1])
+            elif op == 'STORE_TEMP':
+                temps[ins[1]] = stack.pop()
+            elif op == 'LOAD_TEMP':
+                stack.append(temps[ins[1]])
+            elif op == 'POP':
+                stack.pop()
+            elif op == 'RET':
+                return stack.pop() if stack else None
+            else:
+                raise VMError('Batch evaluation does not support instruction '+op)
+        return None
+
+
+class PythonOps:
+    @staticmethod
+    def binary(op, a, b, n):
+        fn = PY_OPS[op]
+        if type(a) is list:
+            if type(b) is list:
+                return list(map(fn, a, b))
+            return [fn(x, b) for x in a]
+        if type(b) is list:
+            return [fn(a, y) for y in b]
+        return fn(a, b)
+
+
+class NumpyOps:
+    @staticmethod
+    def binary(op, a, b, n):
+        a_vec = isinstance(a, numpy.ndarray)
+        b_vec = isinstance(b, numpy.ndarray)
+        if not a_vec and not b_vec:
+            # scalar op scalar: the same Python operation VM performs
+            return PY_OPS[op](a, b)
+        if op == 'POW':
+            left = a.tolist() if a_vec else [a] * n
+            right = b.tolist() if b_vec else [b] * n
+            return numpy.array(list(map(math.pow, left, right)), dtype=numpy.float64)
+        a_int = NumpyOps.is_int(a)
+        b_int = NumpyOps.is_int(b)
+        if a_int and b_int and op != 'DIV':
+            ma = NumpyOps.magnitude(a)
+            mb = NumpyOps.magnitude(b)
+            bound = ma * mb if op == 'MUL' else ma + mb
+            if bound > INT_LIMIT:
+                raise Fallback()
+        else:
+            # int -> float promotion is exact only below 2**53
+            for v, is_int in ((a, a_int), (b, b_int)):
+                if is_int and NumpyOps.magnitude(v) > INT_LIMIT:
+                    raise Fallback()
+            if op == 'DIV' and (numpy.any(b == 0) if b_vec else b == 0):
+                raise Fallback()
+            if not a_vec:
+                a = float(a)
+            if not b_vec:
+                b = float(b)
+        if op == 'ADD':
+            return numpy.add(a, b)
+        if op == 'SUB':
+            return numpy.subtract(a, b)
+        if op == 'MUL':
+            return numpy.multiply(a, b)
+        return numpy.true_divide(a, b, dtype=numpy.float64)
+
+    @staticmethod
+    def is_int(v):
+        if isinstance(v, numpy.ndarray):
+            return v.dtype.kind == 'i'
+        return type(v) is int
+
+    @staticmethod
+    def magnitude(v):
+        if isinstance(v, numpy.ndarray):
+            return int(numpy.abs(v).max()) if v.size and v.dtype.kind == 'i' else 0
+        return abs(v) if type(v) is int else 0
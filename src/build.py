@@ -0,0 +1,206 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .parser import Parser
+from .semantic import SemanticAnalyzer
+from .optimizer import Optimizer
+from .codegen import Compiler
+from .bytecache import dump_code, load_code
+
+# Parallel build of a directory of .pcg sources into serialized code objects
+# (bytecache.dump_code), one .pcgc file per source under the output
+# directory. manifest.json maps every built source to the sha256 of its
+# content and the build options; a source whose hash and options match the
+# manifest, and whose output still exists, is skipped. Workers get a path,
+# run the whole front end plus Compiler, and send back the serialized code
+# or the error; the parent writes outputs and the manifest atomically.
+# A source that fails to compile loses its previous output, and outputs
+# whose source is gone are removed, so the output directory never holds
+# code that no longer matches a valid source.
+#
+#   python -m src.build SRC_DIR OUT_DIR [-j N] [--optimize] [--cse] [--force]
+
+MANIFEST = 'manifest.json'
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def compile_file(path, optimize=False, cse=False):
+    start = time.perf_counter()
+    result = {'path': path}
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        result['hash'] = content_hash(data)
+        program = Parser(data.decode('utf-8')).parse()
+        SemanticAnalyzer().analyze(program)
+        if optimize:
+            program = Optimizer().optimize(program)
+        main, functions = Compiler(cse=cse).compile(program)
+        result['code'] = dump_code(main, functions)
+    except Exception as e:
+        result['error'] = (type(e).__name__, str(e))
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def compile_task(task):
+    return compile_file(*task)
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def find_sources(source_dir):
+    sources = []
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.pcg'):
+                sources.append(os.path.relpath(os.path.join(root, name), source_dir))
+    return sources
+
+
+def output_name(rel):
+    return rel[:-len('.pcg')] + '.pcgc'
+
+
+def load_output(out_dir, rel):
+    # (main, functions) built for the source rel
+    with open(os.path.join(out_dir, output_name(rel)), 'rb') as f:
+        return load_code(f.read())
+
+
+class BuildReport:
+    def __init__(self):
+        self.compiled = []
+        self.skipped = []
+        self.failed = []
+        self.removed = []
+        self.timings = {}
+        self.seconds = 0.0
+
+    def errors_by_type(self):
+        groups = {}
+        for rel, (kind, message) in self.failed:
+            groups.setdefault(kind, []).append((rel, message))
+        return groups
+
+    def summary(self):
+        lines = [f'{len(self.compiled)} compiled, {len(self.skipped)} unchanged, '
+                 f'{len(self.failed)} failed' + (f', {len(self.removed)} removed' if self.removed else '') +
+                 f' in {self.seconds:.3f}s']
+        for kind, items in sorted(self.errors_by_type().items()):
+            lines.append(f'{kind}: {len(items)}')
+            for rel, message in items:
+                lines.append(f'  {rel}: {message}')
+        return '\n'.join(lines)
+
+
+def build(source_dir, out_dir, workers=None, optimize=False, cse=False, force=False, verbose=False):
+    # workers=0 compiles in this process
+    start = time.perf_counter()
+    report = BuildReport()
+    options = {'optimize': optimize, 'cse': cse}
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+
+    sources = find_sources(source_dir)
+    todo = []
+    for rel in sources:
+        entry = manifest.get(rel)
+        if entry and not force and entry['options'] == options and os.path.exists(os.path.join(out_dir, output_name(rel))):
+            with open(os.path.join(source_dir, rel), 'rb') as f:
+                if content_hash(f.read()) == entry['hash']:
+                    report.skipped.append(rel)
+                    continue
+        todo.append(rel)
+
+    tasks = [(os.path.join(source_dir, rel), optimize, cse) for rel in todo]
+    if workers == 0 or len(tasks) <= 1:
+        results = map(compile_task, tasks)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        nworkers = workers or os.cpu_count() or 1
+        # batches of files per task keep the pool's overhead per file low
+        results = pool.map(compile_task, tasks, chunksize=max(1, len(tasks) // (nworkers * 4)))
+    try:
+        for rel, result in zip(todo, results):
+            report.timings[rel] = result['seconds']
+            if 'error' in result:
+                report.failed.append((rel, result['error']))
+                manifest.pop(rel, None)
+                remove_file(os.path.join(out_dir, output_name(rel)))
+                status = 'FAILED'
+            else:
+                write_atomic(os.path.join(out_dir, output_name(rel)), result['code'])
+                manifest[rel] = {'hash': result['hash'], 'options': options}
+                report.compiled.append(rel)
+                status = 'ok'
+            if verbose:
+                print(f'  {status:6} {result["seconds"]:.4f}s {rel}')
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    # sources that disappeared are dropped from the manifest, with their outputs
+    expected = {output_name(rel) for rel in sources}
+    for root, dirs, files in os.walk(out_dir):
+        for name in files:
+            rel = os.path.relpath(os.path.join(root, name), out_dir)
+            if name.endswith('.pcgc') and rel not in expected and remove_file(os.path.join(root, name)):
+                report.removed.append(rel)
+    present = set(report.compiled) | set(report.skipped)
+    manifest = {rel: entry for rel, entry in manifest.items() if rel in present}
+    write_atomic(manifest_path, json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog='python -m src.build', description='Compile a directory of .pcg files in parallel.')
+    ap.add_argument('source_dir')
+    ap.add_argument('out_dir')
+    ap.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: one per core, 0: no pool)')
+    ap.add_argument('--optimize', action='store_true')
+    ap.add_argument('--cse', action='store_true')
+    ap.add_argument('--force', action='store_true', help='rebuild unchanged files too')
+    ap.add_argument('-q', '--quiet', action='store_true', help='no per-file timing')
+    args = ap.parse_args(argv)
+    report = build(args.source_dir, args.out_dir, workers=args.jobs, optimize=args.optimize,
+                   cse=args.cse, force=args.force, verbose=not args.quiet)
+    print(report.summary())
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+from .codegen import CodeObject, Compiler, materialize_all
+from .parser import Parser
+from .semantic import SemanticAnalyzer
+from .optimizer import Optimizer
+
+# On-disk cache of compiled programs. An entry is the (main, functions) pair
+# from Compiler.compile serialized with marshal, stored under a sha256 of
+# the format version, the marshal format and Python version (marshal data
+# is only read back by the version that wrote it), the compile options and
+# the source, so a warm start loads it without lexing, parsing or analyzing
+# anything.
+#
+# Entries are written to a temporary file in the cache directory and moved
+# into place with os.replace, so workers sharing the directory only ever
+# see complete files. An entry that fails to load (truncated, another
+# format) counts as a miss and is removed. Reads refresh the entry's mtime;
+# when the directory grows past max_bytes the oldest entries are evicted.
+# The directory is only scanned when this instance's running estimate of
+# its size (the last scan plus what it wrote since) crosses max_bytes.
+
+FORMAT_VERSION = 1
+SUFFIX = '.pcgc'
+
+
+def dump_code(main, functions):
+    def pack(co):
+        return (co.instructions, co.consts, co.params, co.ntemps)
+    materialize_all(functions)
+    return marshal.dumps((FORMAT_VERSION, pack(main), [(name, pack(co)) for name, co in functions.items()]))
+
+
+def load_code(data):
+    version, main, functions = marshal.loads(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f'bytecode format {version}, expected {FORMAT_VERSION}')
+    def unpack(packed):
+        instructions, consts, params, ntemps = packed
+        return CodeObject(instructions, consts, params=params, ntemps=ntemps)
+    return unpack(main), {name: unpack(co) for name, co in functions}
+
+
+class BytecodeCache:
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.corrupt = 0
+        self.size = None
+
+    def key(self, source, options=()):
+        h = hashlib.sha256()
+        h.update(f'{FORMAT_VERSION}\0{marshal.version}\0{sys.version_info[:2]}\0{options!r}\0'.encode())
+        h.update(source.encode('utf-8'))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, source, options=()):
+        path = self.path(self.key(source, options))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        try:
+            code = load_code(data)
+        except (EOFError, ValueError, TypeError):
+            self.corrupt += 1
+            self.misses += 1
+            self.remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return code
+
+    def put(self, source, code, options=()):
+        main, functions = code
+        data = dump_code(main, functions)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self.path(self.key(source, options)))
+        except BaseException:
+            self.remove(tmp)
+            raise
+        self.writes += 1
+        if self.size is None or self.size + len(data) > self.max_bytes:
+            self.evict()
+        else:
+            self.size += len(data)
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(SUFFIX):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                # removed by another worker
+                continue
+            entries.append((st.st_mtime, entry.path, st.st_size))
+            total += st.st_size
+        entries.sort()
+        for _, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            if self.remove(path):
+                self.evictions += 1
+            total -= size
+        self.size = total
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(SUFFIX):
+                self.remove(entry.path)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'evictions': self.evictions,
+            'corrupt': self.corrupt,
+        }
+
+
+def compile_cached(source, cache, optimize=False, cse=False):
+    # (main, functions) for source, from the cache when possible
+    options = ('optimize', optimize, 'cse', cse)
+    code = cache.get(source, options)
+    if code is not None:
+        return code
+    program = Parser(source).parse()
+    SemanticAnalyzer().analyze(program)
+    if optimize:
+        program = Optimizer().optimize(program)
+    code = Compiler(cse=cse).compile(program)
+    cache.put(source, code, options)
+    return code
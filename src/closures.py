@@ -0,0 +1,261 @@
+import math
+from .ast import *
+from .vm import VMError
+from .codegen import materialize_all
+from .peephole import expand
+
+# Closure-compiling backend: every CodeObject (or AST) is turned into a
+# tree of pre-bound Python closures that evaluate their operands directly.
+# Expression trees are built first as tuples:
+#   ('const', value) ('local', index) ('global', name)
+#   ('binop', op, left, right) ('call', fname, [args])
+#   ('store_local', index, expr)  evaluates expr into a CSE temporary slot
+# and each statement of main becomes ('store', name, expr) or ('pop', expr).
+# A closure takes the argument list of its frame (env) and returns a value.
+# Calls go through a one-element box per function filled in at link time.
+
+BINOPS = ('+', '-', '*', '/', '^')
+INSTR_OPS = {'ADD': '+', 'SUB': '-', 'MUL': '*', 'DIV': '/', 'POW': '^'}
+
+
+def decode(co):
+    # symbolically execute a CodeObject, returning (statements, result)
+    co = expand(co)
+    params = list(co.params)
+    stack = []
+    stmts = []
+    for ins in co.instructions:
+        op = ins[0]
+        if op == 'PUSH_CONST':
+            stack.append(('const', co.consts[ins[1]]))
+        elif op == 'LOAD_LOCAL':
+            if ins[1] not in params:
+                raise VMError(f'Undefined local {ins[1]}')
+            stack.append(('local', params.index(ins[1])))
+        elif op == 'DUP':
+            stack.append(stack[-1])
+        elif op == 'STORE_TEMP':
+            # Compiler(cse=True) emits DUP, STORE_TEMP: keep one copy of the
+            # value on the stack and store it as a side effect
+            tree = stack.pop()
+            if not stack or stack[-1] is not tree:
+                raise VMError('Unsupported instruction sequence for closure backend')
+            stack[-1] = ('store_local', len(params) + ins[1], tree)
+        elif op == 'LOAD_TEMP':
+            stack.append(('local', len(params) + ins[1]))
+        elif op == 'LOAD_VAR':
+            if ins[1] in params:
+                stack.append(('local', params.index(ins[1])))
+            else:
+                stack.append(('global', ins[1]))
+        elif op in INSTR_OPS:
+            right = stack.pop(); left = stack.pop()
+            stack.append(('binop', INSTR_OPS[op], left, right))
+        elif op == 'CALL':
+            argc = ins[2]
+            args = stack[len(stack)-argc:]
+            del stack[len(stack)-argc:]
+            stack.append(('call', ins[1], args))
+        elif op in ('STORE_VAR', 'POP'):
+            if len(stack) != 1:
+                raise VMError('Unsupported instruction sequence for closure backend')
+            if op == 'STORE_VAR':
+                stmts.append(('store', ins[1], stack.pop()))
+            else:
+                stmts.append(('pop', stack.pop()))
+        elif op == 'RET':
+            return stmts, (stack.pop() if stack else None)
+        else:
+            raise VMError('Unknown instruction '+op)
+    return stmts, None
+
+
+def expr_tree(expr, params):
+    if isinstance(expr, Number):
+        return ('const', expr.value)
+    if isinstance(expr, Var):
+        if params and expr.name in params:
+            return ('local', params.index(expr.name))
+        return ('global', expr.name)
+    if isinstance(expr, BinaryOp):
+        if expr.op not in BINOPS:
+            raise Exception('Unknown op '+expr.op)
+        return ('binop', expr.op, expr_tree(expr.left, params), expr_tree(expr.right, params))
+    if isinstance(expr, Call):
+        fname = expr.name if isinstance(expr.name, str) else (expr.name.name if isinstance(expr.name, Var) else None)
+        if fname is None:
+            raise Exception('Unsupported call target')
+        return ('call', fname, [expr_tree(a, params) for a in expr.args])
+    raise Exception('Unsupported expr in closure backend: '+str(type(expr)))
+
+
+class ClosureCompiler:
+    def __init__(self, globals_):
+        self.globals = globals_
+        self.boxes = {}
+        self.arity = {}
+
+    def link(self, main_tree, function_trees, main_temps=0):
+        # function_trees: name -> (nparams, result tree[, ntemps])
+        for name, entry in function_trees.items():
+            self.boxes[name] = [None]
+            self.arity[name] = entry[0]
+        for name, entry in function_trees.items():
+            body = self.build(entry[1])
+            if len(entry) > 2 and entry[2]:
+                body = self.with_temps(body, entry[2])
+            self.boxes[name][0] = body
+        stmts = [self.build_statement(s) for s in main_tree]
+        def main(env):
+            env.extend([None] * main_temps)
+            for s in stmts:
+                s(env)
+        return main, {name: box[0] for name, box in self.boxes.items()}
+
+    def with_temps(self, body, ntemps):
+        pad = [None] * ntemps
+        def fn(env):
+            env.extend(pad)
+            return body(env)
+        return fn
+
+    def build_statement(self, stmt):
+        if stmt[0] == 'store':
+            name = stmt[1]
+            expr = self.build(stmt[2])
+            g = self.globals
+            def store(env):
+                g[name] = expr(env)
+            return store
+        return self.build(stmt[1])
+
+    def build(self, tree):
+        kind = tree[0]
+        if kind == 'const':
+            value = tree[1]
+            return lambda env: value
+        if kind == 'local':
+            i = tree[1]
+            return lambda env: env[i]
+        if kind == 'global':
+            name = tree[1]
+            g = self.globals
+            def load(env):
+                try:
+                    return g[name]
+                except KeyError:
+                    raise VMError(f'Undefined variable {name}') from None
+            return load
+        if kind == 'store_local':
+            i = tree[1]
+            expr = self.build(tree[2])
+            def store_local(env):
+                env[i] = value = expr(env)
+                return value
+            return store_local
+        if kind == 'binop':
+            return self.build_binop(tree[1], tree[2], tree[3])
+        if kind == 'call':
+            return self.build_call(tree[1], tree[2])
+        raise VMError(f'Unknown tree node {kind}')
+
+    def build_binop(self, op, ltree, rtree):
+        # specialise the common operand shapes so a node does a single call
+        # per operand instead of calling generic child closures
+        if op == '^':
+            left = self.build(ltree); right = self.build(rtree)
+            pow_ = math.pow
+            return lambda env: pow_(left(env), right(env))
+        if ltree[0] == 'local' and rtree[0] == 'local':
+            i, j = ltree[1], rtree[1]
+            if op == '+': return lambda env: env[i] + env[j]
+            if op == '-': return lambda env: env[i] - env[j]
+            if op == '*': return lambda env: env[i] * env[j]
+            return lambda env: env[i] / env[j]
+        if rtree[0] == 'const':
+            left = self.build(ltree); c = rtree[1]
+            if op == '+': return lambda env: left(env) + c
+            if op == '-': return lambda env: left(env) - c
+            if op == '*': return lambda env: left(env) * c
+            return lambda env: left(env) / c
+        if ltree[0] == 'const':
+            c = ltree[1]; right = self.build(rtree)
+            if op == '+': return lambda env: c + right(env)
+            if op == '-': return lambda env: c - right(env)
+            if op == '*': return lambda env: c * right(env)
+            return lambda env: c / right(env)
+        left = self.build(ltree); right = self.build(rtree)
+        if op == '+': return lambda env: left(env) + right(env)
+        if op == '-': return lambda env: left(env) - right(env)
+        if op == '*': return lambda env: left(env) * right(env)
+        return lambda env: left(env) / right(env)
+
+    def build_call(self, fname, arg_trees):
+        args = [self.build(a) for a in arg_trees]
+        if fname not in self.boxes:
+            def undefined(env):
+                for a in args:
+                    a(env)
+                raise VMError(f'Call to undefined function {fname}')
+            return undefined
+        box = self.boxes[fname]
+        if len(args) != self.arity[fname]:
+            expected = self.arity[fname]
+            def bad_arity(env):
+                for a in args:
+                    a(env)
+                raise VMError(f'Function {fname} expects {expected} args, got {len(args)}')
+            return bad_arity
+        if len(args) == 0:
+            return lambda env: box[0]([])
+        if len(args) == 1:
+            a0 = args[0]
+            return lambda env: box[0]([a0(env)])
+        if len(args) == 2:
+            a0, a1 = args
+            return lambda env: box[0]([a0(env), a1(env)])
+        return lambda env: box[0]([a(env) for a in args])
+
+
+class ClosureVM:
+    # Drop-in alternative to VM: same constructor, run() and globals.
+    def __init__(self, main_code, functions):
+        stmts, _ = decode(main_code)
+        trees = {}
+        materialize_all(functions)
+        for name, co in functions.items():
+            _, result = decode(co)
+            trees[name] = (len(co.params), result, co.ntemps)
+        self._link(stmts, trees, main_code.ntemps)
+
+    def _link(self, stmts, trees, main_temps=0):
+        # closures capture this dict; run() syncs it with self.globals so
+        # callers may seed or replace vm.globals as they would with VM
+        self.globals = self._globals = {}
+        self.main, self.functions = ClosureCompiler(self._globals).link(stmts, trees, main_temps)
+
+    @classmethod
+    def from_program(cls, program: Program):
+        vm = cls.__new__(cls)
+        stmts = []
+        trees = {}
+        for stmt in program.statements:
+            if isinstance(stmt, FunctionDef):
+                trees[stmt.name] = (len(stmt.params), expr_tree(stmt.body, list(stmt.params)))
+            elif isinstance(stmt, Assign):
+                stmts.append(('store', stmt.name, expr_tree(stmt.expr, None)))
+            else:
+                stmts.append(('pop', expr_tree(stmt, None)))
+        vm._link(stmts, trees)
+        return vm
+
+    def run(self):
+        g = self._globals
+        if self.globals is g:
+            return self.main([])
+        g.clear()
+        g.update(self.globals)
+        try:
+            return self.main([])
+        finally:
+            self.globals.update(g)
@@ -1,4 +1,7 @@
 from .ast import *
+from . import opcodes
+from .optimizer import cse_candidates
+from .peephole import fuse, expand
 
 # Simple bytecode instructions
 # PUSH_CONST idx
@@ -7,44 +10,161 @@ from .ast import *
 # CALL name, argc
 # RET
 # ADD, SUB, MUL, DIV, POW
+# DUP, STORE_TEMP idx, LOAD_TEMP idx (common subexpressions, see cse)
+# superinstructions from Compiler(peephole=True), see peephole.py
 
 class CodeObject:
-    def __init__(self, instructions, consts, params=None):
+    def __init__(self, instructions, consts, params=None, ntemps=0):
         self.instructions = instructions
         self.consts = consts
         self.params = params or []
+        self.ntemps = ntemps
+
+class LazyFunction:
+    # Stand-in for a function's CodeObject in a lazily compiled functions
+    # table. VM compiles it on the first CALL through a LazyTable (running
+    # the deferred semantic check first, when an analyzer is attached) and
+    # replaces the table entry with the result.
+    def __init__(self, fdef, compiler, analyzer=None):
+        self.fdef = fdef
+        self.params = list(fdef.params)
+        self.compiler = compiler
+        self.analyzer = analyzer
+        self.code = None
+
+    def materialize(self):
+        if self.code is None:
+            if self.analyzer is not None:
+                self.analyzer.check_function(self.fdef.name)
+            self.code = self.compiler.compile_function(self.fdef)
+            self.compiler.compiled_lazily += 1
+        return self.code
+
+def materialize_all(functions):
+    # compile every stub left in a functions table, in place
+    for name, co in functions.items():
+        if isinstance(co, LazyFunction):
+            functions[name] = co.materialize()
+    return functions
+
+def never_compiled(functions):
+    return [name for name, co in functions.items() if isinstance(co, LazyFunction)]
+
+class LazyTable(dict):
+    # Call table over a functions table that still holds stubs. A name is
+    # resolved on its first lookup, compiling a stub and writing the
+    # result back to the functions table, and served from here after
+    # that, so VM's CALL never tests for stubs.
+    def __init__(self, functions):
+        super().__init__()
+        self.functions = functions
+
+    def __contains__(self, name):
+        return name in self.functions
+
+    def __missing__(self, name):
+        co = self.functions[name]
+        if isinstance(co, LazyFunction):
+            co = self.functions[name] = co.materialize()
+        self[name] = co
+        return co
+
+def call_table(functions):
+    # what VM looks calls up in: the table itself unless it holds stubs
+    return LazyTable(functions) if never_compiled(functions) else functions
 
 class Compiler:
-    def __init__(self):
+    def __init__(self, cse=False, lazy=False, analyzer=None, peephole=False):
         self.consts = []
+        self.const_index = {}
         self.instructions = []
         self.functions = {}
         self.current_params = None
+        # common-subexpression elimination: shared values are computed once
+        # into a temporary slot of the frame
+        self.cse = cse
+        self.shared = {}
+        self.temps = {}
+        self.ntemps = 0
+        self.cse_removed = 0
+        # lazy: the functions table holds LazyFunction stubs, compiled on
+        # first call; analyzer is the SemanticAnalyzer(lazy_functions=True)
+        # that deferred their bodies
+        self.lazy = lazy
+        self.analyzer = analyzer
+        self.compiled_lazily = 0
+        # fuse common instruction sequences into superinstructions
+        self.peephole = peephole
 
     def compile(self, program: Program):
         # compile function bodies first to code objects
         for stmt in program.statements:
             if isinstance(stmt, FunctionDef):
+                if self.lazy:
+                    self.functions[stmt.name] = LazyFunction(stmt, self, self.analyzer)
+                    continue
                 co = self.compile_function(stmt)
                 self.functions[stmt.name] = co
         # compile top-level statements into a main code object
         self.consts = []
+        self.const_index = {}
         self.instructions = []
+        self.ntemps = 0
         for stmt in program.statements:
             if not isinstance(stmt, FunctionDef):
+                # globals may change between statements, so subexpressions
+                # are only shared within one statement
+                self.begin_cse(stmt.expr if isinstance(stmt, Assign) else stmt)
                 self.emit_statement(stmt)
         self.instructions.append(('RET',))
-        main = CodeObject(self.instructions, self.consts)
+        main = CodeObject(self.instructions, self.consts, ntemps=self.ntemps)
+        if self.peephole:
+            main = fuse(main, in_main=True)
         return main, self.functions
 
+    def compile_statement(self, stmt):
+        # one top-level statement as its own main chunk; functions compile
+        # through compile_function
+        self.consts = []
+        self.const_index = {}
+        self.instructions = []
+        self.ntemps = 0
+        self.begin_cse(stmt.expr if isinstance(stmt, Assign) else stmt)
+        self.emit_statement(stmt)
+        self.instructions.append(('RET',))
+        main = CodeObject(self.instructions, self.consts, ntemps=self.ntemps)
+        return fuse(main, in_main=True) if self.peephole else main
+
+    def compile_slots(self, program: Program):
+        main, functions = self.compile(program)
+        return lower(main, functions)
+
+    def compile_registers(self, program: Program):
+        # register-based bytecode for regvm.RegisterVM, which has its own
+        # code generator: none of the stack-code options carry over
+        unsupported = [name for name in ('cse', 'lazy', 'peephole') if getattr(self, name)]
+        if unsupported:
+            raise Exception('compile_registers does not support ' + ', '.join(unsupported))
+        from .regvm import RegisterCompiler
+        return RegisterCompiler().compile(program)
+
     def compile_function(self, fdef: FunctionDef):
-        c = Compiler()
+        c = Compiler(cse=self.cse)
         c.current_params = list(fdef.params)
         c.consts = []
+        c.const_index = {}
         c.instructions = []
+        c.begin_cse(fdef.body)
         c.emit_expression(fdef.body)
         c.instructions.append(('RET',))
-        return CodeObject(c.instructions, c.consts, params=list(fdef.params))
+        self.cse_removed += c.cse_removed
+        co = CodeObject(c.instructions, c.consts, params=list(fdef.params), ntemps=c.ntemps)
+        return fuse(co) if self.peephole else co
+
+    def begin_cse(self, expr):
+        if self.cse:
+            self.shared = cse_candidates(expr)
+            self.temps = {}
 
     def emit_statement(self, stmt):
         if isinstance(stmt, Assign):
@@ -57,6 +177,21 @@ class Compiler:
             self.instructions.append(('POP',))
 
     def emit_expression(self, expr):
+        key = self.shared.get(id(expr)) if self.shared else None
+        if key is None:
+            return self.emit_value(expr)
+        if key in self.temps:
+            self.instructions.append(('LOAD_TEMP', self.temps[key]))
+            self.cse_removed += 1
+            return
+        self.emit_value(expr)
+        slot = len(self.temps)
+        self.temps[key] = slot
+        self.ntemps = max(self.ntemps, slot + 1)
+        self.instructions.append(('DUP',))
+        self.instructions.append(('STORE_TEMP', slot))
+
+    def emit_value(self, expr):
         if isinstance(expr, Number):
             idx = self._add_const(expr.value)
             self.instructions.append(('PUSH_CONST', idx))
@@ -93,8 +228,85 @@ class Compiler:
         raise Exception('Unsupported expr in codegen: '+str(type(expr)))
 
     def _add_const(self, v):
-        try:
-            return self.consts.index(v)
-        except ValueError:
+        # keyed on type and repr: list.index would merge 0 with 0.0 (and
+        # 0.0 with -0.0), turning float literals into ints
+        key = (type(v), repr(v))
+        if key not in self.const_index:
+            self.const_index[key] = len(self.consts)
             self.consts.append(v)
-            return len(self.consts)-1
+        return self.const_index[key]
+
+
+# Slot-indexed bytecode: integer opcodes (see opcodes.py) in a flat list,
+# parameters addressed by position and globals by index into a slot array.
+
+class SlotCode:
+    def __init__(self, name, code, consts, nparams=0, nlocals=None):
+        self.name = name
+        self.code = code
+        self.consts = consts
+        self.nparams = nparams
+        self.nlocals = nparams if nlocals is None else nlocals
+
+class SlotProgram:
+    def __init__(self, main, functions, function_names, global_names):
+        self.main = main
+        self.functions = functions
+        self.function_names = function_names
+        self.global_names = global_names
+
+def lower(main, functions):
+    materialize_all(functions)
+    main = expand(main)
+    functions = {name: expand(co) for name, co in functions.items()}
+    function_names = list(functions)
+    findex = {name: i for i, name in enumerate(function_names)}
+    # number globals in the order main first stores them, so the globals
+    # dict rebuilt after a run keeps the insertion order VM would produce
+    gindex = {}
+    for ins in main.instructions:
+        if ins[0] == 'STORE_VAR' and ins[1] not in gindex:
+            gindex[ins[1]] = len(gindex)
+    for co in [main] + list(functions.values()):
+        for ins in co.instructions:
+            if ins[0] in ('LOAD_VAR', 'STORE_VAR') and ins[1] not in gindex:
+                gindex[ins[1]] = len(gindex)
+
+    def lower_code(name, co):
+        params = list(co.params)
+        code = []
+        for ins in co.instructions:
+            op = ins[0]
+            if op == 'PUSH_CONST':
+                arg = ins[1]
+            elif op == 'LOAD_LOCAL':
+                if ins[1] not in params:
+                    raise Exception(f'Unknown local {ins[1]} in {name}')
+                arg = params.index(ins[1])
+            elif op in ('LOAD_TEMP', 'STORE_TEMP'):
+                # temporaries live in the local slots after the arguments
+                arg = len(params) + ins[1]
+                op = 'LOAD_LOCAL' if op == 'LOAD_TEMP' else 'STORE_LOCAL'
+            elif op in ('LOAD_VAR', 'STORE_VAR'):
+                arg = gindex[ins[1]]
+            elif op == 'CALL':
+                fname, argc = ins[1], ins[2]
+                if fname not in findex:
+                    raise Exception(f'Call to undefined function {fname}')
+                if argc != len(functions[fname].params):
+                    raise Exception(f'Function {fname} expects {len(functions[fname].params)} args, got {argc}')
+                arg = findex[fname]
+            else:
+                arg = 0
+            if op not in opcodes.OPCODES:
+                raise Exception('Unknown instruction '+op)
+            code.append(opcodes.OPCODES[op])
+            code.append(arg)
+        return SlotCode(name, code, list(co.consts), len(params), len(params) + co.ntemps)
+
+    return SlotProgram(
+        lower_code('<main>', main),
+        [lower_code(name, functions[name]) for name in function_names],
+        function_names,
+        list(gindex),
+    )
@@ -0,0 +1,302 @@
+from collections import Counter, OrderedDict
+from .ast import *
+from .parser import Parser
+from .semantic import SemanticAnalyzer, SemanticError
+from .codegen import CodeObject, Compiler
+from .pipeline import free_names
+
+# Incremental compilation of a program that is edited line by line.
+# Statements never span lines, so each source line is one Entry holding
+# the statements parsed from it (usually one), its compiled code and the
+# facts the rest of the program depends on: functions it defines, globals
+# it assigns, names it reads and functions it calls. Parsing and code
+# generation depend only on the line's text and are cached by it: texts on
+# a current line stay cached, and the last `keep` texts that left the
+# document are kept in an LRU so an undone edit is not parsed again.
+#
+# Whether a statement checks depends on two program-wide facts: the known
+# function signatures and, for every global it reads, whether an earlier
+# line assigns it. An edit re-parses the replaced lines, then re-checks
+# them plus every line that reads or calls a name whose signature or first
+# assignment the edit changed. Nothing else is touched. Errors are kept per
+# line; check() raises the one the batch pipeline would raise first.
+#
+# The main code object is linked from the per-line chunks only when
+# compile() asks for it after main statements changed.
+
+
+class Entry:
+    __slots__ = ('text', 'index', 'statements', 'syntax_error', 'error',
+                 'defines', 'assigns', 'reads', 'calls', 'functions', 'chunks')
+
+    def __init__(self, text):
+        self.text = text
+        self.index = 0
+        self.error = None
+
+
+class Parsed:
+    # everything derived from a line's text alone
+    __slots__ = ('statements', 'syntax_error', 'defines', 'assigns', 'reads', 'calls', 'functions', 'chunks')
+
+
+class GlobalsBefore:
+    # the analyzer's globals table as seen from one line: names assigned by
+    # an earlier line, or earlier on the same line
+    def __init__(self, session, entry):
+        self.session = session
+        self.entry = entry
+        self.local = set()
+
+    def __contains__(self, name):
+        if name in self.local:
+            return True
+        first = self.session.first_assign.get(name)
+        return first is not None and first.index < self.entry.index
+
+    def __setitem__(self, name, value):
+        self.local.add(name)
+
+
+class IncrementalSession:
+    def __init__(self, source='', cse=False, keep=64):
+        self.cse = cse
+        self.keep = keep
+        self.parsed = {}
+        self.uses = Counter()
+        self.recent = OrderedDict()
+        self.entries = []
+        self.signatures = {}
+        self.definers = {}
+        self.assigners = {}
+        self.first_assign = {}
+        self.readers = {}
+        self.callers = {}
+        self.main = None
+        self.stats = {'parsed': 0, 'checked': 0, 'compiled': 0}
+        self.edit(0, 0, source.split('\n') if source else [])
+
+    @property
+    def source(self):
+        return '\n'.join(e.text for e in self.entries)
+
+    def update(self, source):
+        # replace the whole text, re-processing only the lines that changed
+        new = source.split('\n')
+        old = self.entries
+        start = 0
+        limit = min(len(old), len(new))
+        while start < limit and old[start].text == new[start]:
+            start += 1
+        end_old = len(old)
+        end_new = len(new)
+        while end_old > start and end_new > start and old[end_old-1].text == new[end_new-1]:
+            end_old -= 1
+            end_new -= 1
+        self.edit(start, end_old, new[start:end_new])
+
+    def edit_line(self, lineno, text):
+        # lineno is 1-based, like error positions
+        self.edit(lineno - 1, lineno, text.split('\n'))
+
+    def edit(self, start, end, lines):
+        # replace lines start..end-1 (0-based) with lines
+        self.stats = {'parsed': 0, 'checked': 0, 'compiled': 0}
+        removed = self.entries[start:end]
+        added = [Entry(text) for text in lines]
+        # names whose meaning for other lines may change
+        functions = set()
+        globals_ = set()
+        for e in removed:
+            functions.update(e.defines)
+            globals_.update(e.assigns)
+            self.unindex(e)
+            self.release(e.text)
+        self.entries[start:end] = added
+        if len(added) != len(removed):
+            for i in range(start, len(self.entries)):
+                self.entries[i].index = i
+        else:
+            for i, e in enumerate(added, start):
+                e.index = i
+        for e in added:
+            self.load(e)
+            self.index(e)
+            functions.update(e.defines)
+            globals_.update(e.assigns)
+        dirty = set(added)
+        for name in functions:
+            old = self.signatures.pop(name, None)
+            definers = self.definers.get(name)
+            if definers:
+                self.signatures[name] = len(min(definers, key=self.position).defines[name])
+            if self.signatures.get(name) != old:
+                dirty.update(self.callers.get(name, ()))
+                dirty.update(self.readers.get(name, ()))
+        gone = set(removed)
+        region = (start, start + len(added))
+        for name in globals_:
+            old = self.first_assign.pop(name, None)
+            assigners = self.assigners.get(name)
+            new = min(assigners, key=self.position) if assigners else None
+            if new is not None:
+                self.first_assign[name] = new
+            if old is new:
+                continue
+            if old is None or new is None:
+                dirty.update(self.readers.get(name, ()))
+                continue
+            # only readers between the old and the new first assignment
+            # see a different answer; a removed line sat at the edit point
+            lo, hi = sorted((start if old in gone else old.index, new.index))
+            if region[0] <= lo and hi < region[1]:
+                continue
+            dirty.update(r for r in self.readers.get(name, ()) if lo <= r.index <= hi)
+        for e in dirty:
+            self.check_entry(e)
+        if any(e.chunks for e in removed + added):
+            self.main = None
+
+    def position(self, entry):
+        return entry.index
+
+    def load(self, entry):
+        p = self.parsed.get(entry.text)
+        if p is None:
+            p = self.recent.pop(entry.text, None)
+            if p is None:
+                p = self.parse(entry.text)
+            self.parsed[entry.text] = p
+        self.uses[entry.text] += 1
+        for name in Parsed.__slots__:
+            setattr(entry, name, getattr(p, name))
+
+    def release(self, text):
+        self.uses[text] -= 1
+        if self.uses[text]:
+            return
+        del self.uses[text]
+        self.recent[text] = self.parsed.pop(text)
+        if len(self.recent) > self.keep:
+            self.recent.popitem(last=False)
+
+    def parse(self, text):
+        p = Parsed()
+        p.syntax_error = None
+        p.defines = {}
+        p.assigns = set()
+        p.reads = set()
+        p.calls = set()
+        p.functions = {}
+        p.chunks = []
+        try:
+            p.statements = Parser(text + '\n').parse().statements
+        except SyntaxError as e:
+            p.statements = []
+            p.syntax_error = str(e)
+        self.stats['parsed'] += 1
+        compiler = Compiler(cse=self.cse)
+        for stmt in p.statements:
+            calls, names = free_names(stmt)
+            p.calls |= calls
+            p.reads |= names
+            if isinstance(stmt, FunctionDef):
+                p.defines[stmt.name] = stmt.params
+                p.functions[stmt.name] = compiler.compile_function(stmt)
+            else:
+                if isinstance(stmt, Assign):
+                    p.assigns.add(stmt.name)
+                p.chunks.append(compiler.compile_statement(stmt))
+            self.stats['compiled'] += 1
+        return p
+
+    def index(self, entry):
+        for name in entry.defines:
+            self.definers.setdefault(name, set()).add(entry)
+        for name in entry.assigns:
+            self.assigners.setdefault(name, set()).add(entry)
+        for name in entry.reads:
+            self.readers.setdefault(name, set()).add(entry)
+        for name in entry.calls:
+            self.callers.setdefault(name, set()).add(entry)
+
+    def unindex(self, entry):
+        for table, names in ((self.definers, entry.defines), (self.assigners, entry.assigns),
+                             (self.readers, entry.reads), (self.callers, entry.calls)):
+            for name in names:
+                users = table[name]
+                users.discard(entry)
+                if not users:
+                    del table[name]
+
+    def check_entry(self, entry):
+        self.stats['checked'] += 1
+        entry.error = None
+        analyzer = SemanticAnalyzer()
+        analyzer.functions = self.signatures
+        analyzer.globals = GlobalsBefore(self, entry)
+        try:
+            for stmt in entry.statements:
+                analyzer.check_statement(stmt, local_params=None)
+        except SemanticError as e:
+            entry.error = str(e)
+
+    def syntax_message(self, entry):
+        # the line was parsed on its own, so it reports itself as line 1
+        return entry.syntax_error.replace('line 1:', f'line {entry.index + 1}:')
+
+    def duplicates(self, entry):
+        return [name for name in entry.defines if min(self.definers[name], key=self.position) is not entry]
+
+    def errors(self):
+        # (line, message) for every problem, in line order
+        out = []
+        for e in self.entries:
+            if e.syntax_error:
+                out.append((e.index + 1, self.syntax_message(e)))
+            for name in self.duplicates(e):
+                out.append((e.index + 1, f"Function {name} already defined"))
+            if e.error:
+                out.append((e.index + 1, e.error))
+        return out
+
+    def check(self):
+        # raise what Parser + SemanticAnalyzer would raise on the whole text:
+        # syntax errors first, then duplicate functions, then the first
+        # failing statement
+        for e in self.entries:
+            if e.syntax_error:
+                raise SyntaxError(self.syntax_message(e))
+        for e in self.entries:
+            for name in self.duplicates(e):
+                raise SemanticError(f"Function {name} already defined")
+        for e in self.entries:
+            if e.error:
+                raise SemanticError(e.error)
+
+    def compile(self):
+        self.check()
+        functions = {}
+        for name, definers in self.definers.items():
+            (entry,) = definers
+            functions[name] = entry.functions[name]
+        if self.main is None:
+            self.main = self.link()
+        return self.main, functions
+
+    def link(self):
+        # concatenate the per-statement chunks into one main code object
+        instructions = []
+        consts = []
+        ntemps = 0
+        for e in self.entries:
+            for chunk in e.chunks:
+                offset = len(consts)
+                consts.extend(chunk.consts)
+                for ins in chunk.instructions[:-1]:
+                    if ins[0] == 'PUSH_CONST':
+                        ins = ('PUSH_CONST', ins[1] + offset)
+                    instructions.append(ins)
+                ntemps = max(ntemps, chunk.ntemps)
+        instructions.append(('RET',))
+        return CodeObject(instructions, consts, ntemps=ntemps)
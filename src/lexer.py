@@ -1,4 +1,8 @@
+import mmap
 import re
+import sys
+from array import array
+from bisect import bisect_right
 
 TOKEN_SPEC = [
     ('NUMBER',   r'\d+(?:\.\d+)?'),
@@ -17,6 +21,8 @@ MASTER_RE = re.compile('|'.join('(?P<%s>%s)' % pair for pair in TOKEN_SPEC))
 KEYWORDS = {'function'}
 
 class Token:
+    __slots__ = ('type', 'value', 'pos')
+
     def __init__(self, type_, value, pos):
         self.type = type_
         self.value = value
@@ -51,6 +57,212 @@ def tokenize(code):
         elif kind == 'SKIP':
             pass
         elif kind == 'MISMATCH':
-            raise SyntaxError(f'Unexpected char {value!r} at pos {pos}')
+            raise SyntaxError(f'Unexpected char {value!r} at {LineIndex.from_text(code).describe(pos)}')
         pos = mo.end()
     yield Token('EOF', '', pos)
+
+
+class LineIndex:
+    # Offsets of every newline; line:col is found by bisecting them, so
+    # nothing is paid until a message needs a position.
+    def __init__(self, newlines):
+        self.newlines = newlines
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(array('q', (mo.start() for mo in re.finditer('\n', text))))
+
+    @classmethod
+    def from_bytes(cls, data):
+        # data is bytes or any buffer, such as an mmap
+        newlines = array('q')
+        pos = data.find(b'\n')
+        while pos != -1:
+            newlines.append(pos)
+            pos = data.find(b'\n', pos + 1)
+        return cls(newlines)
+
+    def position(self, offset):
+        # 1-based line and column of a character offset
+        line = bisect_right(self.newlines, offset - 1)
+        start = self.newlines[line-1] + 1 if line else 0
+        return line + 1, offset - start + 1
+
+    def describe(self, offset):
+        line, col = self.position(offset)
+        return f'line {line}:{col}'
+
+
+# Compact token stream: parallel typed arrays instead of one Token object
+# per token. kinds holds an index into KINDS, starts/ends the character
+# span and aux an index into the values table (NUMBER) or the interned
+# names table (ID); it is -1 for everything else. Token objects are only
+# built one at a time while a Parser walks the stream.
+KINDS = ['NUMBER', 'ID', 'FUNCTION', 'ASSIGN', 'COMMA', 'LPAREN', 'RPAREN', 'OP', 'NEWLINE', 'EOF']
+KIND_CODES = {name: code for code, name in enumerate(KINDS)}
+NEWLINE_KIND = KIND_CODES['NEWLINE']
+
+
+class TokenArray:
+    def __init__(self, source):
+        self.source = source
+        self.kinds = array('B')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.aux = array('i')
+        self.values = []
+        self.names = []
+        self.index = None
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __iter__(self):
+        return self.tokens()
+
+    def tokens(self):
+        kinds = self.kinds
+        starts = self.starts
+        ends = self.ends
+        aux = self.aux
+        source = self.source
+        for i in range(len(kinds)):
+            kind = KINDS[kinds[i]]
+            a = aux[i]
+            if kind == 'NUMBER':
+                value = self.values[a]
+            elif kind == 'ID':
+                value = self.names[a]
+            else:
+                value = source[starts[i]:ends[i]]
+            yield Token(kind, value, starts[i])
+
+    def lines(self):
+        # the NEWLINE tokens already give every newline offset
+        if self.index is None:
+            self.index = LineIndex(array('q', (self.starts[i] for i in range(len(self.kinds)) if self.kinds[i] == NEWLINE_KIND)))
+        return self.index
+
+
+def tokenize_compact(code):
+    out = TokenArray(code)
+    kinds = out.kinds
+    starts = out.starts
+    ends = out.ends
+    aux = out.aux
+    values = out.values
+    names = out.names
+    name_ids = {}
+    number_ids = {}
+    codes = KIND_CODES
+    for mo in MASTER_RE.finditer(code):
+        kind = mo.lastgroup
+        if kind == 'SKIP':
+            continue
+        a = -1
+        if kind == 'NUMBER':
+            text = mo.group()
+            # one table entry per distinct literal
+            a = number_ids.get(text)
+            if a is None:
+                a = number_ids[text] = len(values)
+                values.append(float(text) if '.' in text else int(text))
+        elif kind == 'ID':
+            text = mo.group()
+            if text in KEYWORDS:
+                kind = text.upper()
+            else:
+                a = name_ids.get(text)
+                if a is None:
+                    a = name_ids[text] = len(names)
+                    names.append(sys.intern(text))
+        elif kind == 'MISMATCH':
+            raise SyntaxError(f'Unexpected char {mo.group()!r} at {LineIndex.from_text(code).describe(mo.start())}')
+        kinds.append(codes[kind])
+        starts.append(mo.start())
+        ends.append(mo.end())
+        aux.append(a)
+    kinds.append(codes['EOF'])
+    starts.append(len(code))
+    ends.append(len(code))
+    aux.append(-1)
+    return out
+
+
+# Lexing straight from a memory-mapped file, for sources too large to read
+# into one str. MASTER_RE_BYTES is MASTER_RE over bytes ([0-9] instead of
+# \d, so only ASCII digits); it runs over the mapping itself, and only the
+# slices that become NUMBER and ID values are copied out. Positions are byte
+# offsets, which are the character offsets for ASCII sources; any other
+# byte is a MISMATCH, as it would be for tokenize (up to Unicode digits).
+MASTER_RE_BYTES = re.compile(b'|'.join(b'(?P<%s>%s)' % (name.encode(), pattern.replace(r'\d', '[0-9]').encode())
+                                       for name, pattern in TOKEN_SPEC))
+PUNCT_VALUES = {'ASSIGN': '=', 'COMMA': ',', 'LPAREN': '(', 'RPAREN': ')', 'NEWLINE': '\n'}
+OP_VALUES = {op.encode(): op for op in '+-*/^'}
+
+
+def map_file(path):
+    # None for an empty file, which cannot be mapped
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def tokenize_file(path):
+    data = map_file(path)
+    if data is None:
+        yield Token('EOF', '', 0)
+        return
+    scanner = MASTER_RE_BYTES.finditer(data)
+    try:
+        for mo in scanner:
+            kind = mo.lastgroup
+            if kind == 'SKIP':
+                continue
+            if kind == 'ID':
+                value = mo.group().decode('ascii')
+                if value in KEYWORDS:
+                    yield Token(value.upper(), value, mo.start())
+                else:
+                    yield Token('ID', value, mo.start())
+            elif kind == 'NUMBER':
+                text = mo.group()
+                yield Token('NUMBER', float(text) if b'.' in text else int(text), mo.start())
+            elif kind == 'OP':
+                yield Token('OP', OP_VALUES[mo.group()], mo.start())
+            elif kind == 'MISMATCH':
+                pos = mo.start()
+                char = data[pos:pos + 4].decode('utf-8', 'replace')[0]
+                raise SyntaxError(f'Unexpected char {char!r} at {LineIndex.from_bytes(data).describe(pos)}')
+            else:
+                yield Token(kind, PUNCT_VALUES[kind], mo.start())
+        yield Token('EOF', '', len(data))
+    finally:
+        # the scanner holds a buffer export that would keep close() from working
+        scanner = mo = None
+        data.close()
+
+
+class MappedSource:
+    # A source file for Parser: iterating lexes it with tokenize_file, and
+    # lines() maps it again to find newlines only when a message needs a
+    # line:col. Like a TokenArray it is always parsed lazily.
+    def __init__(self, path):
+        self.path = path
+        self.index = None
+
+    def __iter__(self):
+        return tokenize_file(self.path)
+
+    def lines(self):
+        if self.index is None:
+            data = map_file(self.path)
+            if data is None:
+                self.index = LineIndex(array('q'))
+            else:
+                try:
+                    self.index = LineIndex.from_bytes(data)
+                finally:
+                    data.close()
+        return self.index
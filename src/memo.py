@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from .optimizer import strongly_connected
+
+# Function-result cache for VM(memo=ResultCache(...)). User functions are
+# pure: the result depends only on the arguments and on the globals the
+# function (or anything it calls) reads. A key is the function's code
+# object, the typed arguments and the version of every global in that read
+# set. VM gives a global a new version whenever it is stored; versions come
+# from the cache's clock, so VMs sharing one cache never reuse a version
+# for a different value.
+
+MISSING = object()
+
+
+def read_sets(functions):
+    # transitive set of globals read by each function, from its LOAD_VAR
+    # instructions and those of its callees
+    graph = {}
+    direct = {}
+    for name, co in functions.items():
+        graph[name] = {ins[1] for ins in co.instructions if ins[0] == 'CALL'}
+        direct[name] = {ins[1] for ins in co.instructions if ins[0] == 'LOAD_VAR'}
+    reads = {}
+    for component in strongly_connected(graph):
+        names = set()
+        for name in component:
+            names |= direct[name]
+            for callee in graph[name]:
+                if callee in reads:
+                    names.update(reads[callee])
+        for name in component:
+            reads[name] = tuple(sorted(names))
+    return reads
+
+
+def arg_key(args):
+    # 1, 1.0 and True hash alike and 0.0 == -0.0, so keep type and sign
+    return tuple((a.__class__, a) if a or a.__class__ is not float else (float, a, str(a)) for a in args)
+
+
+class ResultCache:
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.clock = 0
+
+    def tick(self):
+        self.clock += 1
+        return self.clock
+
+    def get(self, key):
+        value = self.entries.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
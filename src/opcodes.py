@@ -0,0 +1,36 @@
+# Integer opcodes for the slot-indexed bytecode produced by codegen.lower.
+# Every instruction takes two entries of a flat list: opcode, operand.
+# PUSH_CONST idx    -> consts[idx]
+# LOAD_LOCAL slot   -> local slot of the current frame: arguments first,
+#                      then the CSE temporaries
+# STORE_LOCAL slot  -> local slot (STORE_TEMP in the string format)
+# LOAD_VAR slot     -> global slot
+# STORE_VAR slot    -> global slot
+# CALL fn           -> index into the program function table
+# POP, RET, DUP, ADD, SUB, MUL, DIV, POW take an unused operand (0)
+#
+# The numbering is part of the format: SlotVM dispatches on these literal
+# values, so keep both in sync when adding an opcode.
+
+PUSH_CONST = 0
+LOAD_LOCAL = 1
+LOAD_VAR = 2
+STORE_VAR = 3
+ADD = 4
+SUB = 5
+MUL = 6
+DIV = 7
+POW = 8
+CALL = 9
+POP = 10
+RET = 11
+DUP = 12
+STORE_LOCAL = 13
+
+OPNAMES = [
+    'PUSH_CONST', 'LOAD_LOCAL', 'LOAD_VAR', 'STORE_VAR',
+    'ADD', 'SUB', 'MUL', 'DIV', 'POW',
+    'CALL', 'POP', 'RET', 'DUP', 'STORE_LOCAL',
+]
+
+OPCODES = {name: code for code, name in enumerate(OPNAMES)}
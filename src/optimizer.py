@@ -0,0 +1,377 @@
+import math
+from .ast import *
+
+# AST optimizer, run after SemanticAnalyzer.analyze and before
+# Compiler.compile. Passes never change a program's observable result:
+# values keep their int/float type, and an expression that raises at
+# run time (division by zero, math.pow domain/range errors) is left alone.
+#
+# - folding: BinaryOp over Number operands becomes a Number
+# - propagation: a global assigned exactly once at top level to a constant
+#   replaces reads that are guaranteed to run after that assignment
+# - simplification: x*1, 1*x, x-0 always; x+0 and 0+x when x is known to
+#   be int; x*1.0, x-0.0, x/1, x^1 when x is known to be float
+#   (x+0 is not applied to floats because -0.0 + 0 is 0.0)
+# - common subexpressions (cse_candidates): structurally identical
+#   BinaryOp/Call subtrees of one expression, used by Compiler(cse=True)
+# - inlining (Inliner): calls to small non-recursive functions are replaced
+#   by the callee body with arguments substituted for parameters
+
+ARITH = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': lambda a, b: a / b,
+    '^': math.pow,
+}
+
+
+def count_nodes(node):
+    if isinstance(node, Program):
+        return 1 + sum(count_nodes(s) for s in node.statements)
+    if isinstance(node, FunctionDef):
+        return 1 + count_nodes(node.body)
+    if isinstance(node, Assign):
+        return 1 + count_nodes(node.expr)
+    if isinstance(node, BinaryOp):
+        return 1 + count_nodes(node.left) + count_nodes(node.right)
+    if isinstance(node, Call):
+        return 1 + sum(count_nodes(a) for a in node.args)
+    return 1
+
+
+def contains_call(node):
+    if isinstance(node, Call):
+        return True
+    if isinstance(node, BinaryOp):
+        return contains_call(node.left) or contains_call(node.right)
+    if isinstance(node, Assign):
+        return contains_call(node.expr)
+    return False
+
+
+def call_names(expr, out):
+    if isinstance(expr, Call):
+        out.add(expr.name if isinstance(expr.name, str) else getattr(expr.name, 'name', None))
+        for a in expr.args:
+            call_names(a, out)
+    elif isinstance(expr, BinaryOp):
+        call_names(expr.left, out)
+        call_names(expr.right, out)
+    return out
+
+
+def var_uses(expr, out):
+    if isinstance(expr, Var):
+        out[expr.name] = out.get(expr.name, 0) + 1
+    elif isinstance(expr, BinaryOp):
+        var_uses(expr.left, out)
+        var_uses(expr.right, out)
+    elif isinstance(expr, Call):
+        for a in expr.args:
+            var_uses(a, out)
+    return out
+
+
+def call_graph(program: Program):
+    graph = {}
+    for stmt in program.statements:
+        if isinstance(stmt, FunctionDef):
+            graph[stmt.name] = call_names(stmt.body, set())
+    return graph
+
+
+def strongly_connected(graph):
+    # iterative Tarjan; components come out callees first
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    components = []
+    for root in graph:
+        if root in index:
+            continue
+        work = [(root, iter(sorted(graph[root])))]
+        index[root] = low[root] = len(index)
+        stack.append(root); on_stack.add(root)
+        while work:
+            node, edges = work[-1]
+            advanced = False
+            for callee in edges:
+                if callee not in graph:
+                    continue
+                if callee not in index:
+                    index[callee] = low[callee] = len(index)
+                    stack.append(callee); on_stack.add(callee)
+                    work.append((callee, iter(sorted(graph[callee]))))
+                    advanced = True
+                    break
+                if callee in on_stack:
+                    low[node] = min(low[node], index[callee])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop(); on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+    return components
+
+
+def substitute(expr, mapping):
+    if isinstance(expr, Var):
+        return mapping.get(expr.name, expr)
+    if isinstance(expr, BinaryOp):
+        return BinaryOp(expr.op, substitute(expr.left, mapping), substitute(expr.right, mapping))
+    if isinstance(expr, Call):
+        return Call(expr.name, [substitute(a, mapping) for a in expr.args])
+    return expr
+
+
+def cse_candidates(expr):
+    # Maps id(node) -> structural key for every BinaryOp/Call subtree that
+    # is evaluated more than once in expr. Operators and user functions are
+    # pure, so each repeated value can be computed once; the first
+    # occurrence in pre-order is also the first one evaluated.
+    table = {}
+    keys = {}
+    def key_of(node):
+        if isinstance(node, Number):
+            k = ('n', type(node.value), repr(node.value))
+        elif isinstance(node, Var):
+            k = ('v', node.name)
+        elif isinstance(node, BinaryOp):
+            k = (node.op, key_of(node.left), key_of(node.right))
+        elif isinstance(node, Call):
+            name = node.name if isinstance(node.name, str) else getattr(node.name, 'name', None)
+            k = ('c', name) + tuple(key_of(a) for a in node.args)
+        else:
+            k = ('?', id(node))
+        # hash-cons keys to small ints so comparisons stay O(1)
+        keys[id(node)] = table.setdefault(k, len(table))
+        return keys[id(node)]
+    key_of(expr)
+
+    counts = {}
+    def count(node):
+        if not isinstance(node, (BinaryOp, Call)):
+            return
+        k = keys[id(node)]
+        counts[k] = counts.get(k, 0) + 1
+        if counts[k] > 1:
+            # later occurrences reuse the value; their operands never run
+            return
+        if isinstance(node, BinaryOp):
+            count(node.left); count(node.right)
+        else:
+            for a in node.args:
+                count(a)
+    count(expr)
+    return {i: k for i, k in keys.items() if counts.get(k, 0) > 1}
+
+
+def static_type(expr):
+    # 'int', 'float' or None when it depends on run-time values
+    if isinstance(expr, Number):
+        return type(expr.value).__name__
+    if isinstance(expr, BinaryOp):
+        if expr.op in ('/', '^'):
+            return 'float'
+        left = static_type(expr.left)
+        right = static_type(expr.right)
+        if left == 'float' or right == 'float':
+            return 'float'
+        if left == 'int' and right == 'int':
+            return 'int'
+    return None
+
+
+def is_const(expr, value):
+    # repr tells 0.0 from -0.0
+    return isinstance(expr, Number) and type(expr.value) is type(value) and repr(expr.value) == repr(value)
+
+
+class Inliner:
+    # Only calls whose arguments are safe to move are inlined: a Number or
+    # a parameter of the caller may be used any number of times, a global
+    # read at least once, and any other argument exactly once, so no
+    # argument is evaluated more often or dropped.
+    def __init__(self, budget=12):
+        self.budget = budget
+        self.inlined = 0
+        self.signatures = {}
+
+    def inline(self, program: Program):
+        graph = call_graph(program)
+        defs = {s.name: s for s in program.statements if isinstance(s, FunctionDef)}
+        self.signatures = {name: list(d.params) for name, d in defs.items()}
+        recursive = set()
+        bodies = {}
+        for component in strongly_connected(graph):
+            if len(component) > 1 or component[0] in graph[component[0]]:
+                recursive.update(component)
+            for name in component:
+                bodies[name] = self.rewrite(defs[name].body, defs[name].params, bodies, recursive)
+        out = []
+        for stmt in program.statements:
+            if isinstance(stmt, FunctionDef):
+                out.append(FunctionDef(stmt.name, list(stmt.params), bodies[stmt.name]))
+            elif isinstance(stmt, Assign):
+                out.append(Assign(stmt.name, self.rewrite(stmt.expr, None, bodies, recursive)))
+            else:
+                out.append(self.rewrite(stmt, None, bodies, recursive))
+        return Program(out)
+
+    def rewrite(self, expr, params, bodies, recursive):
+        if isinstance(expr, BinaryOp):
+            return BinaryOp(expr.op, self.rewrite(expr.left, params, bodies, recursive),
+                            self.rewrite(expr.right, params, bodies, recursive))
+        if not isinstance(expr, Call):
+            return expr
+        args = [self.rewrite(a, params, bodies, recursive) for a in expr.args]
+        call = Call(expr.name, args)
+        fname = expr.name if isinstance(expr.name, str) else getattr(expr.name, 'name', None)
+        if fname in recursive or fname not in bodies:
+            return call
+        body = bodies[fname]
+        if count_nodes(body) > self.budget:
+            return call
+        callee_params = self.signatures[fname]
+        if len(callee_params) != len(args):
+            return call
+        uses = var_uses(body, {})
+        for name in uses:
+            # a global read by the callee must not be captured by a
+            # parameter of the caller
+            if name not in callee_params and params and name in params:
+                return call
+        for p, a in zip(callee_params, args):
+            n = uses.get(p, 0)
+            if isinstance(a, Number) or (isinstance(a, Var) and params and a.name in params):
+                continue
+            if isinstance(a, Var) and n >= 1:
+                continue
+            if n != 1:
+                return call
+        self.inlined += 1
+        return substitute(body, dict(zip(callee_params, args)))
+
+
+class Optimizer:
+    def __init__(self, enabled=True, inline_budget=12):
+        self.enabled = enabled
+        self.inline_budget = inline_budget
+        self.stats = {'inlined': 0, 'folded': 0, 'propagated': 0, 'simplified': 0}
+        self.nodes_before = 0
+        self.nodes_after = 0
+
+    @property
+    def eliminated(self):
+        return self.nodes_before - self.nodes_after
+
+    def report(self):
+        parts = ', '.join(f'{k}={v}' for k, v in self.stats.items())
+        return f'optimizer: {self.nodes_before} -> {self.nodes_after} nodes ({self.eliminated} eliminated; {parts})'
+
+    def optimize(self, program: Program):
+        self.nodes_before = count_nodes(program)
+        if not self.enabled:
+            self.nodes_after = self.nodes_before
+            return program
+        if self.inline_budget:
+            inliner = Inliner(self.inline_budget)
+            program = inliner.inline(program)
+            self.stats['inlined'] += inliner.inlined
+        statements = program.statements
+        assigned = {}
+        for stmt in statements:
+            if isinstance(stmt, Assign):
+                assigned[stmt.name] = assigned.get(stmt.name, 0) + 1
+        first_call = len(statements)
+        for i, stmt in enumerate(statements):
+            if not isinstance(stmt, FunctionDef) and contains_call(stmt):
+                first_call = i
+                break
+
+        # main statements in order; constants become visible after their
+        # assignment. Function bodies only see constants assigned before
+        # the first top-level statement that can call a function.
+        out = list(statements)
+        consts = {}
+        early = {}
+        for i, stmt in enumerate(statements):
+            if isinstance(stmt, FunctionDef):
+                continue
+            if isinstance(stmt, Assign):
+                expr = self.fold(stmt.expr, consts, None)
+                out[i] = Assign(stmt.name, expr)
+                if assigned[stmt.name] == 1 and isinstance(expr, Number):
+                    consts[stmt.name] = expr.value
+                    if i < first_call:
+                        early[stmt.name] = expr.value
+            else:
+                out[i] = self.fold(stmt, consts, None)
+        for i, stmt in enumerate(statements):
+            if isinstance(stmt, FunctionDef):
+                out[i] = FunctionDef(stmt.name, list(stmt.params), self.fold(stmt.body, early, stmt.params))
+        result = Program(out)
+        self.nodes_after = count_nodes(result)
+        return result
+
+    def fold(self, expr, consts, params):
+        if isinstance(expr, Var):
+            if expr.name in consts and not (params and expr.name in params):
+                self.stats['propagated'] += 1
+                return Number(consts[expr.name])
+            return expr
+        if isinstance(expr, Call):
+            return Call(expr.name, [self.fold(a, consts, params) for a in expr.args])
+        if not isinstance(expr, BinaryOp):
+            return expr
+        left = self.fold(expr.left, consts, params)
+        right = self.fold(expr.right, consts, params)
+        op = expr.op
+        if isinstance(left, Number) and isinstance(right, Number) and op in ARITH:
+            try:
+                value = ARITH[op](left.value, right.value)
+            except (ZeroDivisionError, OverflowError, ValueError):
+                value = None
+            if value is not None:
+                self.stats['folded'] += 1
+                return Number(value)
+        simplified = self.simplify(op, left, right)
+        if simplified is not None:
+            self.stats['simplified'] += 1
+            return simplified
+        return BinaryOp(op, left, right)
+
+    def simplify(self, op, left, right):
+        if op == '*':
+            if is_const(right, 1):
+                return left
+            if is_const(left, 1):
+                return right
+        if op == '-' and is_const(right, 0):
+            return left
+        if op == '+':
+            if is_const(right, 0) and static_type(left) == 'int':
+                return left
+            if is_const(left, 0) and static_type(right) == 'int':
+                return right
+        if static_type(left) == 'float':
+            if op == '*' and is_const(right, 1.0):
+                return left
+            if op == '-' and is_const(right, 0.0):
+                return left
+            if op in ('/', '^') and (is_const(right, 1) or is_const(right, 1.0)):
+                return left
+        if op == '*' and is_const(left, 1.0) and static_type(right) == 'float':
+            return right
+        return None
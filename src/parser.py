@@ -1,18 +1,57 @@
-from .lexer import tokenize, Token
+from collections import deque
+from .lexer import tokenize, Token, TokenArray, MappedSource, LineIndex
 from .ast import *
 
 class Parser:
-    def __init__(self, code):
-        self.tokens = list(tokenize(code))
-        self.pos = 0
-        self.current = self.tokens[0]
+    # code is a source string, a TokenArray (lexer.tokenize_compact), a
+    # MappedSource (a file lexed from a memory map) or any iterable of
+    # Tokens. By default the whole token stream is lexed up front; with
+    # streaming=True tokens are pulled lazily through a small lookahead
+    # buffer, and parse_iter() yields statements as soon as they are
+    # complete. A TokenArray or MappedSource is always walked lazily.
+    LOOKAHEAD = 2
+
+    def __init__(self, code, streaming=False):
+        self.text = code if isinstance(code, str) else None
+        self.array = code if isinstance(code, (TokenArray, MappedSource)) else None
+        tokens = tokenize(code) if self.text is not None else iter(code)
+        if not streaming and self.array is None:
+            tokens = iter(list(tokens))
+        self.source = tokens
+        self.buffer = deque()
+        self.current = self.next_token(Token('EOF', '', 0))
+
+    def next_token(self, last):
+        # past the end of the stream every read yields EOF
+        tok = next(self.source, None)
+        if tok is None:
+            return last if last.type == 'EOF' else Token('EOF', '', last.pos)
+        return tok
+
+    def peek(self, k=1):
+        # token k positions after the current one
+        if k > self.LOOKAHEAD:
+            raise ValueError(f'lookahead is limited to {self.LOOKAHEAD} tokens')
+        while len(self.buffer) < k:
+            self.buffer.append(self.next_token(self.buffer[-1] if self.buffer else self.current))
+        return self.buffer[k-1]
 
     def advance(self):
-        self.pos += 1
-        if self.pos < len(self.tokens):
-            self.current = self.tokens[self.pos]
+        if self.buffer:
+            self.current = self.buffer.popleft()
+        else:
+            tok = next(self.source, None)
+            self.current = tok if tok is not None else self.next_token(self.current)
         return self.current
 
+    def where(self, tok):
+        # line:col only when the source text is known; computed on demand
+        if self.array is not None:
+            return self.array.lines().describe(tok.pos)
+        if self.text is not None:
+            return LineIndex.from_text(self.text).describe(tok.pos)
+        return f'pos {tok.pos}'
+
     def accept(self, ttype):
         if self.current.type == ttype:
             val = self.current.value
@@ -25,15 +64,16 @@ class Parser:
             val = self.current.value
             self.advance()
             return val
-        raise SyntaxError(f'Expected {ttype} at pos {self.current.pos}, got {self.current.type}')
+        raise SyntaxError(f'Expected {ttype} at {self.where(self.current)}, got {self.current.type}')
 
     def parse(self):
-        stmts = []
+        return Program(list(self.parse_iter()))
+
+    def parse_iter(self):
         while self.current.type != 'EOF':
             if self.current.type == 'NEWLINE':
                 self.advance(); continue
-            stmts.append(self.parse_statement())
-        return Program(stmts)
+            yield self.parse_statement()
 
     def parse_statement(self):
         if self.current.type == 'FUNCTION':
@@ -41,7 +81,7 @@ class Parser:
         elif self.current.type == 'ID':
             # could be assignment or expression
             # lookahead
-            if self.tokens[self.pos+1].type == 'ASSIGN':
+            if self.peek().type == 'ASSIGN':
                 name = self.expect('ID')
                 self.expect('ASSIGN')
                 expr = self.parse_expression()
@@ -137,4 +177,88 @@ class Parser:
             expr = self.parse_expression()
             self.expect('RPAREN')
             return expr
-        raise SyntaxError(f'Unexpected token {self.current}')
+        raise SyntaxError(f'Unexpected token {self.current} at {self.where(self.current)}')
+
+
+BINARY_PRECEDENCE = {'+': 1, '-': 1, '*': 2, '/': 2, '^': 3}
+
+
+class PrattParser(Parser):
+    # Same grammar and AST as Parser, but expressions are parsed by one
+    # loop with explicit operand/operator stacks instead of a recursive
+    # method per precedence level, so nesting depth is bounded only by
+    # memory. All binary operators are left-associative, '^' included, and
+    # calls bind tighter than any of them. ops holds binary operators, None
+    # for an open '(' group and [callee, args] for a call whose arguments
+    # are being parsed; precs holds the matching precedence, 0 for groups,
+    # which stops every reduction at a group boundary.
+    def parse_expression(self):
+        advance = self.advance
+        precedence = BINARY_PRECEDENCE
+        operands = []
+        push = operands.append
+        pop = operands.pop
+        ops = []
+        precs = [0]
+        tok = self.current
+        while True:
+            kind = tok.type
+            if kind == 'NUMBER':
+                push(Number(tok.value))
+            elif kind == 'ID':
+                push(Var(tok.value))
+            elif kind == 'LPAREN':
+                ops.append(None)
+                precs.append(0)
+                tok = advance()
+                continue
+            else:
+                raise SyntaxError(f'Unexpected token {tok} at {self.where(tok)}')
+            tok = advance()
+            # an operand is complete: apply calls, then look for an operator
+            # or the end of the enclosing group
+            while True:
+                kind = tok.type
+                if kind == 'OP':
+                    prec = precedence[tok.value]
+                    while precs[-1] >= prec:
+                        precs.pop()
+                        right = pop()
+                        operands[-1] = BinaryOp(ops.pop(), operands[-1], right)
+                    ops.append(tok.value)
+                    precs.append(prec)
+                    tok = advance()
+                    break
+                if kind == 'LPAREN':
+                    callee = pop()
+                    tok = advance()
+                    if tok.type == 'RPAREN':
+                        push(Call(callee.name if isinstance(callee, Var) else callee, []))
+                        tok = advance()
+                        continue
+                    ops.append([callee, []])
+                    precs.append(0)
+                    break
+                while precs[-1]:
+                    precs.pop()
+                    right = pop()
+                    operands[-1] = BinaryOp(ops.pop(), operands[-1], right)
+                if not ops:
+                    return pop()
+                group = ops[-1]
+                if group is None:
+                    self.expect('RPAREN')
+                    ops.pop()
+                    precs.pop()
+                    tok = self.current
+                    continue
+                group[1].append(pop())
+                if kind == 'COMMA':
+                    tok = advance()
+                    break
+                self.expect('RPAREN')
+                ops.pop()
+                precs.pop()
+                callee = group[0]
+                push(Call(callee.name if isinstance(callee, Var) else callee, group[1]))
+                tok = self.current
@@ -0,0 +1,169 @@
+import math
+import operator
+import sys
+from collections import Counter
+
+# Peephole pass over CodeObject.instructions that fuses common sequences
+# into superinstructions, so each runs as one trip through the VM's
+# dispatch loop (VM.run_fused_frame, which run_frame hands fused code to):
+#
+#   LOAD_LOCAL a, LOAD_LOCAL b, <op>  -> ('LOCAL_LOCAL_BINOP', op, a, b)
+#   LOAD_LOCAL a, PUSH_CONST k, <op>  -> ('LOCAL_CONST_BINOP', op, a, value, k)
+#   LOAD_LOCAL a, <op>                -> ('LOCAL_BINOP', op, a)
+#   PUSH_CONST k, <op>                -> ('BINOP_CONST', op, value, k)
+#   STORE_VAR x, LOAD_VAR x           -> ('STORE_LOAD_VAR', x)
+#
+# where <op> is ADD, SUB, MUL, DIV or POW and value is consts[k] carried as
+# an immediate operand (k is kept for expand). The set comes from opcode
+# pair and triple frequencies (pair_frequencies) on examples/, bench_vm.py
+# and the bench_phases.py generators, weighted by how often each code
+# object runs: in function bodies LOAD_LOCAL, LOAD_LOCAL and a local or
+# a constant feeding an operator lead, and in main the value just stored is
+# often the next one loaded.
+#
+# STORE_LOAD_VAR is only formed in main: LOAD_VAR looks at the frame's
+# locals first, and main has none. Backends that only know the basic
+# instructions (lower, ClosureVM, BatchEvaluator) call expand first.
+#
+#   python -m src.peephole FILE.pcg [--pairs]
+
+BINARY = {'ADD': operator.add, 'SUB': operator.sub, 'MUL': operator.mul, 'DIV': operator.truediv, 'POW': math.pow}
+
+FUSED = ('LOCAL_LOCAL_BINOP', 'LOCAL_CONST_BINOP', 'LOCAL_BINOP', 'BINOP_CONST', 'STORE_LOAD_VAR')
+
+
+def fuse_instructions(instructions, consts, in_main=False):
+    out = []
+    i = 0
+    n = len(instructions)
+    while i < n:
+        ins = instructions[i]
+        op = ins[0]
+        nxt = instructions[i + 1] if i + 1 < n else None
+        third = instructions[i + 2] if i + 2 < n else None
+        if op == 'LOAD_LOCAL' and nxt is not None:
+            if third is not None and third[0] in BINARY:
+                if nxt[0] == 'LOAD_LOCAL':
+                    out.append(('LOCAL_LOCAL_BINOP', third[0], ins[1], nxt[1]))
+                    i += 3
+                    continue
+                if nxt[0] == 'PUSH_CONST':
+                    out.append(('LOCAL_CONST_BINOP', third[0], ins[1], consts[nxt[1]], nxt[1]))
+                    i += 3
+                    continue
+            if nxt[0] in BINARY:
+                out.append(('LOCAL_BINOP', nxt[0], ins[1]))
+                i += 2
+                continue
+        elif op == 'PUSH_CONST' and nxt is not None and nxt[0] in BINARY:
+            out.append(('BINOP_CONST', nxt[0], consts[ins[1]], ins[1]))
+            i += 2
+            continue
+        elif op == 'STORE_VAR' and in_main and nxt is not None and nxt == ('LOAD_VAR', ins[1]):
+            out.append(('STORE_LOAD_VAR', ins[1]))
+            i += 2
+            continue
+        out.append(ins)
+        i += 1
+    return out
+
+
+def fuse(co, in_main=False):
+    return co.__class__(fuse_instructions(co.instructions, co.consts, in_main), co.consts,
+                        params=co.params, ntemps=co.ntemps)
+
+
+def expand_instructions(instructions):
+    out = []
+    for ins in instructions:
+        op = ins[0]
+        if op == 'LOCAL_LOCAL_BINOP':
+            out += [('LOAD_LOCAL', ins[2]), ('LOAD_LOCAL', ins[3]), (ins[1],)]
+        elif op == 'LOCAL_CONST_BINOP':
+            out += [('LOAD_LOCAL', ins[2]), ('PUSH_CONST', ins[4]), (ins[1],)]
+        elif op == 'LOCAL_BINOP':
+            out += [('LOAD_LOCAL', ins[2]), (ins[1],)]
+        elif op == 'BINOP_CONST':
+            out += [('PUSH_CONST', ins[3]), (ins[1],)]
+        elif op == 'STORE_LOAD_VAR':
+            out += [('STORE_VAR', ins[1]), ('LOAD_VAR', ins[1])]
+        else:
+            out.append(ins)
+    return out
+
+
+def expand(co):
+    # the same code with every superinstruction spelled out again
+    if not any(ins[0] in FUSED for ins in co.instructions):
+        return co
+    return co.__class__(expand_instructions(co.instructions), co.consts, params=co.params, ntemps=co.ntemps)
+
+
+def fuse_program(main, functions):
+    return fuse(main, in_main=True), {name: fuse(co) for name, co in functions.items()}
+
+
+def pair_frequencies(main, functions, length=2):
+    # opcode sequences of the given length, each counted once per execution
+    # of its code object (no branches, so a body runs once per call)
+    counts = Counter()
+
+    def visit(co, weight, path):
+        ops = [ins[0] for ins in co.instructions]
+        for seq in zip(*(ops[k:] for k in range(length))):
+            counts[seq] += weight
+        calls = Counter(ins[1] for ins in co.instructions if ins[0] == 'CALL')
+        for callee, times in calls.items():
+            # a recursive call never returns, count its body once
+            if callee not in path:
+                visit(functions[callee], weight * times, path | {callee})
+
+    visit(main, 1, frozenset())
+    return counts
+
+
+def disassemble(co, name='main'):
+    lines = [f'{name}({", ".join(co.params)}):' if co.params else f'{name}:']
+    for i, ins in enumerate(co.instructions):
+        operands = ' '.join(repr(v) for v in ins[1:])
+        lines.append(f'  {i:4} {ins[0]:18} {operands}'.rstrip())
+    return lines
+
+
+def before_after(before, after, name='main', width=48):
+    left = disassemble(before, name)
+    right = disassemble(after, name)
+    rows = [f'{"before":{width}} after']
+    for k in range(max(len(left), len(right))):
+        a = left[k] if k < len(left) else ''
+        b = right[k] if k < len(right) else ''
+        rows.append(f'{a:{width}} {b}')
+    return '\n'.join(rows)
+
+
+def main(argv=None):
+    from .parser import Parser
+    from .semantic import SemanticAnalyzer
+    from .codegen import Compiler
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print('usage: python -m src.peephole FILE.pcg [--pairs]')
+        return 2
+    with open(argv[0], 'r', encoding='utf-8') as f:
+        program = Parser(f.read()).parse()
+    SemanticAnalyzer().analyze(program)
+    main_co, functions = Compiler().compile(program)
+    if '--pairs' in argv:
+        for seq, count in pair_frequencies(main_co, functions).most_common(20):
+            print(f'{count:10} {" ".join(seq)}')
+        return 0
+    fused_main, fused_functions = fuse_program(main_co, functions)
+    for name, co in functions.items():
+        print(before_after(co, fused_functions[name], name))
+        print()
+    print(before_after(main_co, fused_main))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+from collections import deque
+from .ast import *
+from .parser import Parser
+from .semantic import SemanticAnalyzer, SemanticError
+from .codegen import Compiler
+from .vm import VM
+from .optimizer import call_names
+
+# Statement-at-a-time front end for large generated scripts. Statements come
+# from Parser(..., streaming=True).parse_iter() and are checked, compiled and
+# executed while the rest of the file is still being lexed.
+#
+# The batch analyzer collects every function signature before checking
+# anything, so a statement may call a function defined further down. Here a
+# statement is checked, in source order, once every name it needs is known;
+# until then it and everything after it wait (finish() flushes the rest and
+# reports what is still undefined). Top-level statements then run in order
+# as soon as all functions they reach are compiled. A program the batch
+# pipeline accepts gives the same globals; an invalid one raises the same
+# SemanticError, after the statements before it have run.
+
+
+def free_names(stmt):
+    # function names and globals a statement needs before it can be checked
+    if isinstance(stmt, FunctionDef):
+        expr, params = stmt.body, set(stmt.params)
+    elif isinstance(stmt, Assign):
+        expr, params = stmt.expr, set()
+    else:
+        expr, params = stmt, set()
+    calls = call_names(expr, set())
+    calls.discard(None)
+    names = set()
+    collect_vars(expr, params, names)
+    return calls, names
+
+
+def collect_vars(expr, params, out):
+    if isinstance(expr, Var):
+        if expr.name not in params:
+            out.add(expr.name)
+    elif isinstance(expr, BinaryOp):
+        collect_vars(expr.left, params, out)
+        collect_vars(expr.right, params, out)
+    elif isinstance(expr, Call):
+        for a in expr.args:
+            collect_vars(a, params, out)
+
+
+class StreamingPipeline:
+    # Each queued statement's free names are computed once, when it is fed.
+    # While the head of the unchecked queue waits, only a new function
+    # signature can unblock it (globals are only added by checking), so feed
+    # just strikes names off its missing set. The head of the unrun queue
+    # likewise keeps the set of reachable functions not compiled yet, and a
+    # function is marked complete once everything it reaches is compiled.
+    # The unchecked queue holds everything after the first statement that
+    # uses a name defined further down; max_waiting (None: no limit) caps it
+    # and raises SemanticError past that.
+    def __init__(self, cse=False, max_waiting=None):
+        self.analyzer = SemanticAnalyzer()
+        self.compiler = Compiler(cse=cse)
+        self.functions = {}
+        self.vm = VM(None, self.functions)
+        self.globals = self.vm.globals
+        self.unchecked = deque()
+        self.unrun = deque()
+        self.max_waiting = max_waiting
+        self.missing = None
+        self.pending = None
+        self.reached = None
+        self.complete = set()
+        self.statements = 0
+        self.executed = 0
+
+    def feed(self, stmt):
+        self.statements += 1
+        if isinstance(stmt, FunctionDef):
+            # signatures are visible to every statement, as in the batch
+            # analyzer's first pass
+            if stmt.name in self.analyzer.functions:
+                raise SemanticError(f"Function {stmt.name} already defined")
+            self.analyzer.functions[stmt.name] = len(stmt.params)
+            if self.missing:
+                self.missing.discard(stmt.name)
+        if self.max_waiting is not None and len(self.unchecked) >= self.max_waiting:
+            raise SemanticError(f'More than {self.max_waiting} statements waiting for definitions')
+        self.unchecked.append((stmt,) + free_names(stmt))
+        self.drain()
+
+    def feed_all(self, statements):
+        for stmt in statements:
+            self.feed(stmt)
+        return self.finish()
+
+    def finish(self):
+        # nothing else can be defined now: check what is left, which raises
+        # for names that never appeared
+        while self.unchecked:
+            self.check(*self.unchecked.popleft()[:2])
+        self.missing = None
+        self.drain()
+        if self.unrun:
+            raise SemanticError('Statements left unexecuted')
+        return self.globals
+
+    def drain(self):
+        while self.unchecked:
+            if self.missing is None:
+                self.missing = self.unknown(*self.unchecked[0][1:])
+            if self.missing:
+                break
+            self.missing = None
+            self.check(*self.unchecked.popleft()[:2])
+        while self.unrun:
+            if self.pending is None:
+                self.pending = set()
+                self.reached = set()
+                self.reach(self.unrun[0][1])
+            if self.pending:
+                break
+            self.complete |= self.reached
+            self.pending = self.reached = None
+            self.execute(self.unrun.popleft()[0])
+
+    def unknown(self, calls, names):
+        known = self.analyzer.functions
+        missing = {name for name in calls if name not in known}
+        # a name that is neither a global yet nor a function may still be a
+        # function defined later
+        for name in names:
+            if name not in self.analyzer.globals and name not in known:
+                missing.add(name)
+        return missing
+
+    def check(self, stmt, calls):
+        self.analyzer.check_statement(stmt, local_params=None)
+        if isinstance(stmt, FunctionDef):
+            co = self.functions[stmt.name] = self.compiler.compile_function(stmt)
+            if self.pending and stmt.name in self.pending:
+                self.pending.discard(stmt.name)
+                self.reach(callees(co))
+        else:
+            self.unrun.append((stmt, calls))
+
+    def reach(self, names):
+        # walk the compiled functions reachable from names, collecting the
+        # ones not compiled yet in pending
+        todo = list(names)
+        while todo:
+            name = todo.pop()
+            if name in self.reached or name in self.complete:
+                continue
+            self.reached.add(name)
+            co = self.functions.get(name)
+            if co is None:
+                self.pending.add(name)
+            else:
+                todo.extend(callees(co))
+
+    def execute(self, stmt):
+        self.vm.run_code(self.compiler.compile_statement(stmt))
+        self.executed += 1
+
+
+def callees(co):
+    return [ins[1] for ins in co.instructions if ins[0] == 'CALL']
+
+
+def run_stream(source, cse=False):
+    # source is a string or an iterable of Tokens
+    pipeline = StreamingPipeline(cse=cse)
+    parser = Parser(source, streaming=True)
+    return pipeline.feed_all(parser.parse_iter())
@@ -0,0 +1,211 @@
+import math
+import time
+from .memo import MISSING
+from .vm import VM, VMError, Frame
+from .peephole import BINARY
+
+# Instrumented VM. ProfilingVM has its own copy of the dispatch loop that
+# counts every executed instruction by opcode and times every call, so
+# VM.run_frame stays exactly as it is and pays nothing when profiling is
+# off. Timing is wall time from time.perf_counter: inclusive covers the
+# callee and everything it calls, exclusive only its own instructions.
+# Samples are kept per call stack ('<main>;f;g') as exclusive microseconds,
+# the collapsed-stack format read by flamegraph.pl and speedscope. The top
+# level is '<main>', as in codegen.lower, so a user function named main
+# keeps its own stats.
+#
+#   vm = ProfilingVM(main, functions)
+#   vm.run()
+#   print(vm.profile.report())
+#   open('out.folded', 'w').write(vm.profile.collapsed())
+
+
+class FunctionStats:
+    __slots__ = ('calls', 'cached', 'inclusive', 'exclusive')
+
+    def __init__(self):
+        self.calls = 0
+        self.cached = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+
+
+class Profile:
+    def __init__(self):
+        self.opcodes = {}
+        self.functions = {}
+        self.stacks = {}
+
+    def function(self, name):
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = FunctionStats()
+        return stats
+
+    def instructions(self):
+        return sum(self.opcodes.values())
+
+    def hot_functions(self, top=None):
+        ranked = sorted(self.functions.items(), key=lambda item: item[1].exclusive, reverse=True)
+        return ranked[:top] if top else ranked
+
+    def report(self, top=10):
+        total = self.instructions()
+        lines = [f'{total} instructions executed']
+        for op, count in sorted(self.opcodes.items(), key=lambda item: item[1], reverse=True):
+            lines.append(f'  {op:12} {count:10} {100 * count / total:5.1f}%')
+        lines.append(f'{"function":20} {"calls":>8} {"cached":>8} {"incl ms":>10} {"excl ms":>10}')
+        for name, s in self.hot_functions(top):
+            lines.append(f'{name:20} {s.calls:8} {s.cached:8} {s.inclusive * 1000:10.3f} {s.exclusive * 1000:10.3f}')
+        return '\n'.join(lines)
+
+    def collapsed(self):
+        return ''.join(f'{stack} {max(1, round(seconds * 1e6))}\n' for stack, seconds in sorted(self.stacks.items()))
+
+
+class ProfilingVM(VM):
+    def __init__(self, main_code, functions, memo=None):
+        super().__init__(main_code, functions, memo)
+        self.profile = Profile()
+        self.path = '<main>'
+        self.active = {}
+
+    def run(self):
+        # main counts as a function too, so its exclusive time is reported
+        self.path = '<main>'
+        start = time.perf_counter()
+        try:
+            return super().run()
+        finally:
+            stats = self.profile.function('<main>')
+            stats.calls += 1
+            stats.inclusive += time.perf_counter() - start
+
+    def run_frame(self, frame: Frame, fname='<main>'):
+        profile = self.profile
+        opcodes = profile.opcodes
+        instrs = frame.code.instructions
+        consts = frame.code.consts
+        stack = frame.stack
+        path = self.path
+        start = time.perf_counter()
+        children = 0.0
+        try:
+            while frame.ip < len(instrs):
+                ins = instrs[frame.ip]
+                frame.ip += 1
+                op = ins[0]
+                opcodes[op] = opcodes.get(op, 0) + 1
+                if op == 'PUSH_CONST':
+                    stack.append(consts[ins[1]])
+                elif op == 'LOAD_VAR':
+                    name = ins[1]
+                    if name in frame.locals:
+                        stack.append(frame.locals[name])
+                    elif name in frame.globals:
+                        stack.append(frame.globals[name])
+                    else:
+                        raise VMError(f'Undefined variable {name}')
+                elif op == 'STORE_VAR':
+                    name = ins[1]
+                    frame.globals[name] = stack.pop()
+                    if self.memo is not None:
+                        self.versions[name] = self.memo.tick()
+                elif op == 'LOAD_LOCAL':
+                    name = ins[1]
+                    if name in frame.locals:
+                        stack.append(frame.locals[name])
+                    else:
+                        raise VMError(f'Undefined local {name}')
+                elif op == 'POP':
+                    stack.pop()
+                elif op == 'ADD':
+                    b = stack.pop(); a = stack.pop(); stack.append(a+b)
+                elif op == 'SUB':
+                    b = stack.pop(); a = stack.pop(); stack.append(a-b)
+                elif op == 'MUL':
+                    b = stack.pop(); a = stack.pop(); stack.append(a*b)
+                elif op == 'DIV':
+                    b = stack.pop(); a = stack.pop(); stack.append(a/b)
+                elif op == 'POW':
+                    b = stack.pop(); a = stack.pop(); stack.append(math.pow(a,b))
+                elif op == 'CALL':
+                    callee = ins[1]; argc = ins[2]
+                    args = [stack.pop() for _ in range(argc)][::-1]
+                    if callee not in self.calls:
+                        raise VMError(f'Call to undefined function {callee}')
+                    co = self.calls[callee]
+                    stats = profile.function(callee)
+                    stats.calls += 1
+                    if self.memo is not None:
+                        key = self.memo_key(callee, co, args)
+                        res = self.memo.get(key)
+                        if res is not MISSING:
+                            stats.cached += 1
+                            stack.append(res)
+                            continue
+                    fframe = Frame(co, frame.globals, self.functions)
+                    for i, a in enumerate(args):
+                        if i < len(co.params):
+                            fframe.locals[co.params[i]] = a
+                        else:
+                            fframe.locals[f'arg{i}'] = a
+                    self.path = path + ';' + callee
+                    depth = self.active.get(callee, 0)
+                    self.active[callee] = depth + 1
+                    t = time.perf_counter()
+                    try:
+                        res = self.run_frame(fframe, callee)
+                    finally:
+                        elapsed = time.perf_counter() - t
+                        children += elapsed
+                        self.path = path
+                        self.active[callee] = depth
+                        # a recursive call is already inside the outer one's inclusive time
+                        if depth == 0:
+                            stats.inclusive += elapsed
+                    if self.memo is not None:
+                        self.memo.put(key, res)
+                    stack.append(res)
+                elif op == 'DUP':
+                    stack.append(stack[-1])
+                elif op == 'STORE_TEMP':
+                    frame.temps[ins[1]] = stack.pop()
+                elif op == 'LOAD_TEMP':
+                    stack.append(frame.temps[ins[1]])
+                elif op == 'RET':
+                    return stack.pop() if stack else None
+                elif op == 'LOCAL_LOCAL_BINOP':
+                    try:
+                        a = frame.locals[ins[2]]; b = frame.locals[ins[3]]
+                    except KeyError as e:
+                        raise VMError(f'Undefined local {e.args[0]}') from None
+                    stack.append(BINARY[ins[1]](a, b))
+                elif op == 'LOCAL_CONST_BINOP':
+                    try:
+                        a = frame.locals[ins[2]]
+                    except KeyError:
+                        raise VMError(f'Undefined local {ins[2]}') from None
+                    stack.append(BINARY[ins[1]](a, ins[3]))
+                elif op == 'BINOP_CONST':
+                    stack[-1] = BINARY[ins[1]](stack[-1], ins[2])
+                elif op == 'LOCAL_BINOP':
+                    try:
+                        b = frame.locals[ins[2]]
+                    except KeyError:
+                        raise VMError(f'Undefined local {ins[2]}') from None
+                    stack[-1] = BINARY[ins[1]](stack[-1], b)
+                elif op == 'STORE_LOAD_VAR':
+                    frame.globals[ins[1]] = stack[-1]
+                    if self.memo is not None:
+                        self.versions[ins[1]] = self.memo.tick()
+                else:
+                    raise VMError('Unknown instruction '+op)
+            return None
+        finally:
+            own = time.perf_counter() - start - children
+            profile.function(fname).exclusive += own
+            profile.stacks[path] = profile.stacks.get(path, 0.0) + own
+
+    # the loop above checks the result cache itself
+    run_memo_frame = run_frame
@@ -0,0 +1,283 @@
+import math
+from .ast import *
+from .vm import VMError
+
+# Register-based bytecode: three-address instructions over a per-frame
+# register file, as an alternative to the stack machine in codegen/vm.
+# Every instruction is a 4-tuple (op, dst, a, b):
+#
+#   ADD/SUB/MUL/DIV/POW d, a, b   regs[d] = regs[a] <op> regs[b]
+#   LOAD_GLOBAL d, slot           regs[d] = global slot
+#   STORE_GLOBAL s, slot          global slot = regs[s]
+#   CALL d, fn, (r1, r2, ...)     regs[d] = functions[fn](regs[r1], ...)
+#   RET s                         return regs[s] (s < 0: None)
+#
+# A frame's registers start as a copy of its code's template: the
+# parameters, then every constant (so constants and parameters never need
+# an instruction), then the temporaries. Temporaries are allocated over the
+# expression tree and reused as soon as their value is consumed. A global
+# read twice in one expression is loaded once: nothing can store a global
+# while an expression is being evaluated.
+#
+# Globals live in slots numbered like SlotVM's, so the globals dict after a
+# run has the same contents and order as VM's.
+
+ADD = 0
+SUB = 1
+MUL = 2
+DIV = 3
+POW = 4
+LOAD_GLOBAL = 5
+STORE_GLOBAL = 6
+CALL = 7
+RET = 8
+
+OPNAMES = ['ADD', 'SUB', 'MUL', 'DIV', 'POW', 'LOAD_GLOBAL', 'STORE_GLOBAL', 'CALL', 'RET']
+
+BINARY_OPS = {'+': ADD, '-': SUB, '*': MUL, '/': DIV, '^': POW}
+
+
+class RegCode:
+    def __init__(self, name, code, template, nparams):
+        self.name = name
+        self.code = code
+        self.template = template
+        self.nparams = nparams
+
+    @property
+    def nregs(self):
+        return len(self.template)
+
+
+class RegProgram:
+    def __init__(self, main, functions, function_names, global_names):
+        self.main = main
+        self.functions = functions
+        self.function_names = function_names
+        self.global_names = global_names
+
+
+class RegisterCompiler:
+    def compile(self, program: Program):
+        defs = [s for s in program.statements if isinstance(s, FunctionDef)]
+        body = [s for s in program.statements if not isinstance(s, FunctionDef)]
+        self.findex = {}
+        self.arity = {}
+        for fdef in defs:
+            if fdef.name not in self.findex:
+                self.findex[fdef.name] = len(self.findex)
+                self.arity[fdef.name] = len(fdef.params)
+        # globals numbered in the order main first stores them (see lower)
+        self.gindex = {}
+        for stmt in body:
+            if isinstance(stmt, Assign) and stmt.name not in self.gindex:
+                self.gindex[stmt.name] = len(self.gindex)
+        functions = [None] * len(self.findex)
+        for fdef in defs:
+            functions[self.findex[fdef.name]] = self.compile_code(fdef.name, fdef.params, [fdef.body], function=True)
+        main = self.compile_code('<main>', [], body)
+        return RegProgram(main, functions, list(self.findex), list(self.gindex))
+
+    def compile_code(self, name, params, statements, function=False):
+        self.params = {p: i for i, p in enumerate(params)}
+        self.consts = {}
+        self.const_values = []
+        self.code = []
+        # temporaries are numbered from 0 here and moved after the
+        # parameters and constants once their count is known
+        self.ntemps = 0
+        self.free = []
+        for stmt in statements:
+            self.cached = {}
+            if function:
+                self.code.append((RET, 0, self.compile_expr(stmt), 0))
+            elif isinstance(stmt, Assign):
+                reg = self.compile_expr(stmt.expr)
+                self.code.append((STORE_GLOBAL, 0, reg, self.global_slot(stmt.name)))
+                self.release(reg)
+            else:
+                self.release(self.compile_expr(stmt))
+            self.release_cached()
+        if not function:
+            self.code.append((RET, 0, -1, 0))
+        base = len(params) + len(self.const_values)
+        code = [self.relocate(ins, base) for ins in self.code]
+        template = [None] * len(params) + self.const_values + [None] * self.ntemps
+        return RegCode(name, code, template, len(params))
+
+    # registers during compilation: ('p', i) parameter, ('c', i) constant,
+    # ('t', i) temporary; relocate turns them into register numbers
+
+    def relocate(self, ins, base):
+        def reg(r):
+            kind, i = r
+            if kind == 'p':
+                return i
+            if kind == 'c':
+                return len(self.params) + i
+            return base + i
+        op, d, a, b = ins
+        if op == CALL:
+            return (op, reg(d), a, tuple(reg(r) for r in b))
+        if op == LOAD_GLOBAL:
+            return (op, reg(d), a, 0)
+        if op == STORE_GLOBAL:
+            return (op, 0, reg(a), b)
+        if op == RET:
+            return (op, 0, reg(a) if a != -1 else -1, 0)
+        return (op, reg(d), reg(a), reg(b))
+
+    def global_slot(self, name):
+        if name not in self.gindex:
+            self.gindex[name] = len(self.gindex)
+        return self.gindex[name]
+
+    def alloc(self):
+        if self.free:
+            return self.free.pop()
+        self.ntemps += 1
+        return ('t', self.ntemps - 1)
+
+    def release(self, reg):
+        if reg[0] == 't' and reg not in self.cached.values():
+            self.free.append(reg)
+
+    def release_cached(self):
+        for reg in self.cached.values():
+            self.free.append(reg)
+        self.cached = {}
+
+    def const(self, value):
+        # keyed on type and repr so 0, 0.0 and -0.0 stay apart
+        key = (type(value), repr(value))
+        if key not in self.consts:
+            self.consts[key] = len(self.const_values)
+            self.const_values.append(value)
+        return ('c', self.consts[key])
+
+    def compile_expr(self, expr):
+        if isinstance(expr, Number):
+            return self.const(expr.value)
+        if isinstance(expr, Var):
+            if expr.name in self.params:
+                return ('p', self.params[expr.name])
+            reg = self.cached.get(expr.name)
+            if reg is None:
+                reg = self.alloc()
+                self.code.append((LOAD_GLOBAL, reg, self.global_slot(expr.name), 0))
+                self.cached[expr.name] = reg
+            return reg
+        if isinstance(expr, BinaryOp):
+            if expr.op not in BINARY_OPS:
+                raise Exception('Unknown op '+expr.op)
+            a = self.compile_expr(expr.left)
+            b = self.compile_expr(expr.right)
+            self.release(b)
+            self.release(a)
+            d = self.alloc()
+            self.code.append((BINARY_OPS[expr.op], d, a, b))
+            return d
+        if isinstance(expr, Call):
+            fname = expr.name if isinstance(expr.name, str) else (expr.name.name if isinstance(expr.name, Var) else None)
+            if fname is None:
+                raise Exception('Unsupported call target')
+            if fname not in self.findex:
+                raise Exception(f'Call to undefined function {fname}')
+            if len(expr.args) != self.arity[fname]:
+                raise Exception(f'Function {fname} expects {self.arity[fname]} args, got {len(expr.args)}')
+            args = [self.compile_expr(a) for a in expr.args]
+            for r in reversed(args):
+                self.release(r)
+            d = self.alloc()
+            self.code.append((CALL, d, self.findex[fname], tuple(args)))
+            return d
+        raise Exception('Unsupported expr in codegen: '+str(type(expr)))
+
+
+def disassemble(co):
+    lines = [f'{co.name}: {co.nparams} params, {co.nregs} registers']
+    for i, (op, d, a, b) in enumerate(co.code):
+        name = OPNAMES[op]
+        if op == CALL:
+            operands = f'r{d}, fn{a}, ({", ".join(f"r{r}" for r in b)})'
+        elif op == LOAD_GLOBAL:
+            operands = f'r{d}, g{a}'
+        elif op == STORE_GLOBAL:
+            operands = f'r{a}, g{b}'
+        elif op == RET:
+            operands = f'r{a}' if a >= 0 else ''
+        else:
+            operands = f'r{d}, r{a}, r{b}'
+        lines.append(f'  {i:4} {name:12} {operands}'.rstrip())
+    return '\n'.join(lines)
+
+
+_UNSET = object()
+
+
+class RegisterVM:
+    def __init__(self, program):
+        self.program = program
+        self.globals = {}
+        self.slots = None
+
+    def run(self):
+        names = self.program.global_names
+        self.slots = [self.globals.get(name, _UNSET) for name in names]
+        try:
+            main = self.program.main
+            return self.execute(main, list(main.template))
+        finally:
+            for name, val in zip(names, self.slots):
+                if val is not _UNSET:
+                    self.globals[name] = val
+
+    def execute(self, co, regs):
+        slots = self.slots
+        funcs = self.program.functions
+        for op, d, a, b in co.code:
+            if op == 2:  # MUL
+                regs[d] = regs[a] * regs[b]
+            elif op == 0:  # ADD
+                regs[d] = regs[a] + regs[b]
+            elif op == 1:  # SUB
+                regs[d] = regs[a] - regs[b]
+            elif op == 3:  # DIV
+                regs[d] = regs[a] / regs[b]
+            elif op == 7:  # CALL
+                fco = funcs[a]
+                fregs = list(fco.template)
+                fregs[:len(b)] = [regs[r] for r in b]
+                regs[d] = self.execute(fco, fregs)
+            elif op == 5:  # LOAD_GLOBAL
+                val = slots[a]
+                if val is _UNSET:
+                    raise VMError(f'Undefined variable {self.program.global_names[a]}')
+                regs[d] = val
+            elif op == 4:  # POW
+                regs[d] = math.pow(regs[a], regs[b])
+            elif op == 6:  # STORE_GLOBAL
+                slots[b] = regs[a]
+            elif op == 8:  # RET
+                return regs[a] if a >= 0 else None
+            else:
+                raise VMError(f'Unknown opcode {op}')
+        return None
+
+
+def count_instructions(program):
+    # instructions one run executes (no branches, so known statically);
+    # compare server.count_instructions for the stack format
+    costs = {}
+
+    def cost(co):
+        total = len(co.code)
+        for op, d, a, b in co.code:
+            if op == CALL:
+                if a not in costs:
+                    costs[a] = math.inf
+                    costs[a] = cost(program.functions[a])
+                total += costs[a]
+        return total
+
+    return cost(program.main)
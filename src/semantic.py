@@ -3,10 +3,26 @@ from .ast import *
 class SemanticError(Exception):
     pass
 
+class AssignedBefore:
+    # globals visible from the statement at position: those a top-level
+    # assignment before it creates
+    def __init__(self, first_assign, position):
+        self.first_assign = first_assign
+        self.position = position
+
+    def __contains__(self, name):
+        return self.first_assign.get(name, self.position) < self.position
+
 class SemanticAnalyzer:
-    def __init__(self):
+    def __init__(self, lazy_functions=False):
         self.functions = {}
         self.globals = {}
+        # with lazy_functions, function bodies are only checked on request
+        # (check_function), e.g. when a lazily compiled function is first
+        # called; they see the globals assigned before their definition
+        self.lazy_functions = lazy_functions
+        self.deferred = {}
+        self.first_assign = {}
 
     def analyze(self, program: Program):
         # First pass: collect function signatures
@@ -16,10 +32,27 @@ class SemanticAnalyzer:
                     raise SemanticError(f"Function {stmt.name} already defined")
                 self.functions[stmt.name] = len(stmt.params)
         # Second pass: validate bodies
-        for stmt in program.statements:
+        for i, stmt in enumerate(program.statements):
+            if self.lazy_functions and isinstance(stmt, FunctionDef):
+                self.deferred[stmt.name] = (stmt, i)
+                continue
             self.check_statement(stmt, local_params=None)
+            if isinstance(stmt, Assign) and stmt.name not in self.first_assign:
+                self.first_assign[stmt.name] = i
         return True
 
+    def check_function(self, name):
+        if name not in self.deferred:
+            return
+        stmt, position = self.deferred[name]
+        saved = self.globals
+        self.globals = AssignedBefore(self.first_assign, position)
+        try:
+            self.check_expression(stmt.body, local_params=stmt.params)
+        finally:
+            self.globals = saved
+        del self.deferred[name]
+
     def check_statement(self, stmt, local_params):
         if isinstance(stmt, FunctionDef):
             self.check_expression(stmt.body, local_params=stmt.params)
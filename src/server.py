@@ -0,0 +1,376 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from .sweep import compile_sweep
+from .vm import VM
+
+# Local evaluation service speaking newline-delimited JSON over TCP or a
+# Unix socket. One request per line, one response per line, matched by id:
+#
+#   {"id": 1, "source": "r = a * 2\n", "inputs": {"a": 3}, "outputs": ["r"]}
+#   {"id": 2, "program": "<id from an earlier response>", "inputs": {"a": 4}}
+#   {"id": 3, "op": "compile", "source": "...", "inputs": ["a"]}
+#   {"id": 4, "op": "metrics"}
+#
+# Globals named in inputs are declared to the semantic analyzer, so a
+# program may read them without assigning them first; the compiled
+# (main, functions) pair is kept in an LRU under a program id derived from
+# the source and those names. Requests for the same program that arrive
+# within batch_window seconds are run together in one executor call, so
+# the event loop never runs VM code. "budget" caps the number of
+# instructions a run may execute; the language has no branches, so the
+# count is known from the code alone and an over-budget request is refused
+# without running.
+#
+# Inputs must be finite numbers: a bool, a string or a list would reach the
+# VM's arithmetic, where the budget (which counts instructions, not value
+# sizes) cannot stop "x" * 1000000000; ints are limited to 64 bits for the
+# same reason. Non-finite results (inf, nan) are sent as null, since JSON
+# has no literal for them.
+
+MAX_INT = 2 ** 63
+
+
+def count_instructions(main, functions):
+    # instructions one run of main executes; infinite if it reaches a
+    # recursive function (which can never return)
+    costs = {}
+    active = set()
+
+    def cost(co):
+        total = len(co.instructions)
+        for ins in co.instructions:
+            if ins[0] == 'CALL':
+                total += function_cost(ins[1])
+        return total
+
+    def function_cost(name):
+        if name in costs:
+            return costs[name]
+        if name in active or name not in functions:
+            return math.inf
+        active.add(name)
+        costs[name] = cost(functions[name])
+        active.discard(name)
+        return costs[name]
+
+    return cost(main)
+
+
+def program_id(source, inputs):
+    h = hashlib.sha256(source.encode('utf-8'))
+    h.update(('\0' + ','.join(sorted(inputs))).encode('utf-8'))
+    return h.hexdigest()[:24]
+
+
+def compile_program(source, inputs):
+    main, functions = compile_sweep(source, inputs)
+    return CompiledProgram(main, functions, count_instructions(main, functions))
+
+
+def run_batch(program, batch):
+    # runs in the executor: one VM per request, errors kept per request
+    results = []
+    for inputs, outputs in batch:
+        vm = VM(program.main, program.functions)
+        vm.globals.update(inputs)
+        try:
+            vm.run()
+        except Exception as e:
+            results.append((None, e))
+            continue
+        if outputs is None:
+            results.append((dict(vm.globals), None))
+        else:
+            results.append(({name: vm.globals[name] for name in outputs if name in vm.globals}, None))
+    return results
+
+
+class RequestError(Exception):
+    pass
+
+
+def check_names(names, field):
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise RequestError(f'{field} must be a list of names')
+    return names
+
+
+def check_inputs(inputs):
+    # inputs of a run: an object of finite numbers
+    if not isinstance(inputs, dict):
+        raise RequestError('inputs must be an object of numbers')
+    for name, value in inputs.items():
+        if value.__class__ is int:
+            if not -MAX_INT <= value < MAX_INT:
+                raise RequestError(f'input {name} is out of range')
+        elif value.__class__ is not float or not math.isfinite(value):
+            raise RequestError(f'input {name} must be a finite number, got {json.dumps(value)[:40]}')
+    return inputs
+
+
+def json_value(value):
+    if value.__class__ is float and not math.isfinite(value):
+        return None
+    return value
+
+
+class CompiledProgram:
+    def __init__(self, main, functions, cost):
+        self.main = main
+        self.functions = functions
+        self.cost = cost
+
+
+class ProgramCache:
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pid):
+        program = self.entries.get(pid)
+        if program is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(pid)
+        return program
+
+    def put(self, pid, program):
+        self.entries[pid] = program
+        self.entries.move_to_end(pid)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+class Metrics:
+    def __init__(self, window=10000):
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.latencies = deque(maxlen=window)
+
+    def record(self, seconds, ok):
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.latencies.append(seconds)
+
+    def snapshot(self, cache):
+        ordered = sorted(self.latencies)
+
+        def pct(p):
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'batches': self.batches,
+            'mean_batch': self.batched_requests / self.batches if self.batches else 0.0,
+            'cache_hits': cache.hits,
+            'cache_misses': cache.misses,
+            'cached_programs': len(cache.entries),
+            'latency_ms': {'p50': pct(0.50), 'p95': pct(0.95), 'p99': pct(0.99), 'max': pct(1.0)},
+        }
+
+
+class EvalServer:
+    def __init__(self, cache_size=128, batch_window=0.002, max_batch=64, executor=None):
+        self.cache = ProgramCache(cache_size)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.executor = executor or ThreadPoolExecutor(max_workers=4)
+        self.metrics = Metrics()
+        self.queues = {}
+        self.compiling = {}
+        self.connections = {}
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def start_unix(self, path):
+        self.server = await asyncio.start_unix_server(self.handle, path)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+        # closing a transport ends its handler's read loop
+        for writer in list(self.connections.values()):
+            writer.close()
+        if self.connections:
+            await asyncio.gather(*self.connections, return_exceptions=True)
+        if self.server is not None:
+            await self.server.wait_closed()
+        self.executor.shutdown()
+
+    async def handle(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+        self.connections[asyncio.current_task()] = writer
+
+        async def respond(line):
+            response = await self.process(line)
+            try:
+                data = json.dumps(response, allow_nan=False)
+            except ValueError as e:
+                # e.g. an int result too long to print
+                data = json.dumps({'id': response.get('id'), 'error': {'type': 'ValueError', 'message': str(e)}})
+            async with lock:
+                writer.write(data.encode('utf-8') + b'\n')
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                # requests on one connection are served concurrently
+                task = asyncio.ensure_future(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            del self.connections[asyncio.current_task()]
+            writer.close()
+
+    async def process(self, line):
+        start = time.perf_counter()
+        rid = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RequestError('request must be a JSON object')
+            rid = request.get('id')
+            op = request.get('op', 'run')
+            if op == 'metrics':
+                return {'id': rid, 'metrics': self.metrics.snapshot(self.cache)}
+            if op not in ('run', 'compile'):
+                raise RequestError(f'unknown op {op!r}')
+            inputs = request.get('inputs') or {}
+            if op == 'compile' and isinstance(inputs, list):
+                names = check_names(inputs, 'inputs')
+            else:
+                names = list(check_inputs(inputs))
+            pid, program = await self.program(request, names)
+            if op == 'compile':
+                response = {'id': rid, 'program': pid, 'instructions': cost_json(program.cost)}
+            else:
+                outputs = request.get('outputs')
+                if outputs is not None:
+                    check_names(outputs, 'outputs')
+                budget = request.get('budget')
+                if budget is not None and (budget.__class__ not in (int, float) or budget != budget):
+                    raise RequestError('budget must be a number')
+                if budget is not None and program.cost > budget:
+                    raise RequestError(f'instruction budget exceeded: needs {cost_json(program.cost)}, budget {budget}')
+                values = await self.submit(pid, program, inputs, outputs)
+                response = {'id': rid, 'program': pid, 'globals': {name: json_value(v) for name, v in values.items()}}
+        except Exception as e:
+            self.metrics.record(time.perf_counter() - start, False)
+            return {'id': rid, 'error': {'type': type(e).__name__, 'message': str(e)}}
+        self.metrics.record(time.perf_counter() - start, True)
+        return response
+
+    async def program(self, request, names):
+        if 'program' in request:
+            program = self.cache.get(request['program'])
+            if program is None:
+                raise RequestError(f'unknown program {request["program"]}')
+            return request['program'], program
+        source = request.get('source')
+        if not isinstance(source, str):
+            raise RequestError('request needs a source or a program id')
+        pid = program_id(source, names)
+        # concurrent requests for the same new source share one compile
+        pending = self.compiling.get(pid)
+        if pending is None:
+            program = self.cache.get(pid)
+            if program is not None:
+                return pid, program
+            loop = asyncio.get_running_loop()
+            pending = self.compiling[pid] = loop.run_in_executor(self.executor, compile_program, source, names)
+            try:
+                program = await pending
+                self.cache.put(pid, program)
+            finally:
+                del self.compiling[pid]
+            return pid, program
+        return pid, await pending
+
+    async def submit(self, pid, program, inputs, outputs):
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues.get(pid)
+        if queue is None:
+            queue = self.queues[pid] = []
+            asyncio.ensure_future(self.flush(pid, program))
+        queue.append((inputs, outputs, future))
+        values, error = await future
+        if error is not None:
+            raise error
+        return values
+
+    async def flush(self, pid, program):
+        # collect the micro-batch, then run it off the event loop
+        await asyncio.sleep(self.batch_window)
+        queue = self.queues.pop(pid)
+        loop = asyncio.get_running_loop()
+        for i in range(0, len(queue), self.max_batch):
+            chunk = queue[i:i + self.max_batch]
+            self.metrics.batches += 1
+            self.metrics.batched_requests += len(chunk)
+            try:
+                results = await loop.run_in_executor(self.executor, run_batch, program, [(inp, out) for inp, out, _ in chunk])
+            except Exception as e:
+                results = [(None, e)] * len(chunk)
+            for (_, _, future), result in zip(chunk, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+def cost_json(cost):
+    return None if cost == math.inf else cost
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog='python -m src.server', description='NDJSON evaluation server.')
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--unix', help='listen on a Unix socket instead of TCP')
+    ap.add_argument('--cache-size', type=int, default=128)
+    ap.add_argument('--batch-window', type=float, default=0.002, help='seconds to wait for more requests per batch')
+    args = ap.parse_args(argv)
+
+    async def serve():
+        server = EvalServer(cache_size=args.cache_size, batch_window=args.batch_window)
+        if args.unix:
+            srv = await server.start_unix(args.unix)
+        else:
+            srv = await server.start(args.host, args.port)
+        print('listening on', ', '.join(str(s.getsockname()) for s in srv.sockets))
+        async with srv:
+            await srv.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from .parser import Parser
+from .semantic import SemanticAnalyzer
+from .codegen import Compiler
+from .bytecache import dump_code, load_code
+from .vm import VM
+
+# Parameter sweeps: one compiled program run against many initial global
+# bindings. The code objects are serialized once and handed to every worker
+# through the pool initializer; after that only chunks of environments
+# travel to the workers and only the selected globals come back. Each
+# environment seeds VM.globals before VM.run. A failing run is captured in
+# its result and does not stop the sweep. With workers=0 the executor runs
+# the chunks itself from a program it keeps on the instance; the module
+# global only ever holds the program of a pool worker process.
+#
+#   with SweepExecutor(*compile_sweep(source, inputs=['a', 'b']), outputs=['r']) as ex:
+#       for res in ex.map({'a': a, 'b': 2} for a in range(1000)):
+#           ...
+
+_program = None
+
+
+def compile_sweep(source, inputs=()):
+    # compile source whose globals in inputs are provided by each environment
+    program = Parser(source).parse()
+    analyzer = SemanticAnalyzer()
+    for name in inputs:
+        analyzer.globals[name] = True
+    analyzer.analyze(program)
+    return Compiler().compile(program)
+
+
+class SweepResult:
+    __slots__ = ('index', 'values', 'error')
+
+    def __init__(self, index, values=None, error=None):
+        self.index = index
+        self.values = values
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.error is not None:
+            return f'SweepResult({self.index}, error={self.error})'
+        return f'SweepResult({self.index}, {self.values})'
+
+
+def load_program(data, outputs):
+    main, functions = load_code(data)
+    return (main, functions, outputs)
+
+
+def _init(data, outputs):
+    global _program
+    _program = load_program(data, outputs)
+
+
+def _run_chunk(chunk):
+    return run_chunk(_program, chunk)
+
+
+def run_chunk(program, chunk):
+    main, functions, outputs = program
+    results = []
+    for index, env in chunk:
+        vm = VM(main, functions)
+        vm.globals.update(env)
+        try:
+            vm.run()
+        except Exception as e:
+            results.append((index, None, (type(e).__name__, str(e))))
+            continue
+        if outputs is None:
+            values = dict(vm.globals)
+        else:
+            values = {name: vm.globals[name] for name in outputs if name in vm.globals}
+        results.append((index, values, None))
+    return results
+
+
+class SweepExecutor:
+    def __init__(self, main, functions, outputs=None, workers=None, chunk_size=64):
+        self.outputs = list(outputs) if outputs is not None else None
+        self.chunk_size = chunk_size
+        self.workers = workers
+        data = dump_code(main, functions)
+        self.program = None
+        if workers == 0:
+            # in-process, from the same serialized code as the workers
+            self.program = load_program(data, self.outputs)
+            self.pool = None
+        else:
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init, initargs=(data, self.outputs))
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def chunks(self, envs):
+        it = enumerate(envs)
+        while True:
+            chunk = list(itertools.islice(it, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def map(self, envs, ordered=True):
+        # envs is any iterable of dicts, consumed lazily; results come back
+        # in input order, or as soon as their chunk finishes
+        if self.pool is None:
+            for chunk in self.chunks(envs):
+                yield from self.results(run_chunk(self.program, chunk))
+            return
+        # bounded number of chunks in flight keeps memory flat on huge sweeps
+        limit = 2 * (self.workers or os.cpu_count() or 1)
+        chunks = self.chunks(envs)
+        first = {}
+        pending = set()
+        done_early = {}
+        next_index = 0
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) + len(done_early) < limit:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                future = self.pool.submit(_run_chunk, chunk)
+                first[future] = chunk[0][0]
+                pending.add(future)
+            if not pending:
+                return
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if not ordered:
+                for future in finished:
+                    del first[future]
+                    yield from self.results(future.result())
+                continue
+            for future in finished:
+                done_early[first.pop(future)] = future.result()
+            while next_index in done_early:
+                batch = done_early.pop(next_index)
+                yield from self.results(batch)
+                next_index = batch[-1][0] + 1
+
+    def results(self, batch):
+        for index, values, error in batch:
+            if error is not None:
+                self.failed += 1
+            yield SweepResult(index, values, error)
+
+    def run(self, envs, ordered=True):
+        return list(self.map(envs, ordered))
@@ -0,0 +1,204 @@
+import math
+from .ast import *
+from .vm import VMError
+
+# Python transpiler: a whole Program becomes Python source that is passed
+# through compile(). Each FunctionDef turns into a real def named f_<name>
+# with parameters v_<name>; top-level statements run inside _main() and
+# assign into the globals mapping G. '^' calls math.pow like the VM and the
+# remaining operators are Python's own, so int/float promotion is unchanged.
+#
+# Expressions nested deeper than MAX_DEPTH are split into temporaries in
+# evaluation order so compile() never sees a deeply nested expression.
+
+MAX_DEPTH = 40
+PRECEDENCE = {'+': 1, '-': 1, '*': 2, '/': 2}
+ATOM = 3
+
+
+class Globals(dict):
+    def __missing__(self, name):
+        raise VMError(f'Undefined variable {name}')
+
+
+def _undefined(name, *args):
+    raise VMError(f'Call to undefined function {name}')
+
+
+def _bad_arity(name, expected, *args):
+    raise VMError(f'Function {name} expects {expected} args, got {len(args)}')
+
+
+class PythonProgram:
+    def __init__(self, source, code):
+        self.source = source
+        self.code = code
+        self._globals = Globals()
+        self.namespace = {
+            'G': self._globals,
+            '_pow': math.pow,
+            '_undefined': _undefined,
+            '_bad_arity': _bad_arity,
+        }
+        exec(code, self.namespace)
+        self.globals = self._globals
+        self.functions = {}
+        for name, pyname in self.namespace['_FUNCTIONS'].items():
+            self.functions[name] = self.namespace[pyname]
+
+    def run(self):
+        g = self._globals
+        if self.globals is g:
+            return self.namespace['_main']()
+        g.clear()
+        g.update(self.globals)
+        try:
+            return self.namespace['_main']()
+        finally:
+            self.globals.update(g)
+
+
+class Transpiler:
+    def __init__(self):
+        self.lines = []
+        self.functions = {}
+        self.params = None
+        self.pre = None
+        self.ntemps = 0
+        self.temps = set()
+
+    def transpile(self, program: Program):
+        source = self.emit_source(program)
+        code = compile(source, '<agllmv>', 'exec')
+        return PythonProgram(source, code)
+
+    def emit_source(self, program: Program):
+        self.lines = []
+        for stmt in program.statements:
+            if isinstance(stmt, FunctionDef):
+                self.functions[stmt.name] = len(stmt.params)
+        for stmt in program.statements:
+            if isinstance(stmt, FunctionDef):
+                self.emit_function(stmt)
+        body = []
+        self.ntemps = 0
+        for stmt in program.statements:
+            if isinstance(stmt, FunctionDef):
+                continue
+            self.params = None
+            self.pre = []
+            if isinstance(stmt, Assign):
+                text, _ = self.emit_expression(stmt.expr)
+                body += self.pre + [f'G[{stmt.name!r}] = {text}']
+            else:
+                text, _ = self.emit_expression(stmt)
+                body += self.pre + [text]
+        self.lines.append('def _main():')
+        for line in body or ['pass']:
+            self.lines.append('    ' + line)
+        self.lines.append('')
+        table = ', '.join(f'{name!r}: {self.pyname(name)!r}' for name in self.functions)
+        self.lines.append('_FUNCTIONS = {' + table + '}')
+        return '\n'.join(self.lines) + '\n'
+
+    def emit_function(self, fdef: FunctionDef):
+        self.params = list(fdef.params)
+        self.pre = []
+        self.ntemps = 0
+        text, _ = self.emit_expression(fdef.body)
+        params = ', '.join('v_' + p for p in fdef.params)
+        self.lines.append(f'def {self.pyname(fdef.name)}({params}):')
+        for line in self.pre:
+            self.lines.append('    ' + line)
+        self.lines.append(f'    return {text}')
+        self.lines.append('')
+
+    def pyname(self, fname):
+        return 'f_' + fname
+
+    def hoist(self, text, at=None):
+        name = f'_t{self.ntemps}'
+        self.ntemps += 1
+        self.temps.add(name)
+        line = f'{name} = {text}'
+        if at is None:
+            self.pre.append(line)
+        else:
+            self.pre.insert(at, line)
+        return name
+
+    # returns (python source, precedence); nesting depth is tracked so
+    # that deep trees are broken up via hoist()
+    def emit_expression(self, expr):
+        text, prec, depth = self.emit(expr)
+        return text, prec
+
+    def emit(self, expr):
+        if isinstance(expr, Number):
+            v = expr.value
+            if isinstance(v, float) and not math.isfinite(v):
+                return f'float({repr(v)!r})', ATOM, 1
+            if repr(v).startswith('-'):
+                return f'({v!r})', ATOM, 1
+            return repr(v), ATOM, 1
+        if isinstance(expr, Var):
+            if self.params and expr.name in self.params:
+                return 'v_' + expr.name, ATOM, 1
+            return f'G[{expr.name!r}]', ATOM, 1
+        if isinstance(expr, BinaryOp):
+            left, lprec, ldepth = self.emit(expr.left)
+            mark = len(self.pre)
+            right, rprec, rdepth = self.emit(expr.right)
+            if len(self.pre) > mark and not self.atomic(expr.left, left):
+                # the right operand hoisted statements: evaluate the left
+                # operand before them to keep the VM's evaluation order
+                left, lprec, ldepth = self.hoist(left, mark), ATOM, 1
+            op = expr.op
+            if op == '^':
+                text, prec = f'_pow({left}, {right})', ATOM
+            elif op in PRECEDENCE:
+                prec = PRECEDENCE[op]
+                if lprec < prec:
+                    left = f'({left})'
+                if rprec <= prec:
+                    right = f'({right})'
+                text = f'{left} {op} {right}'
+            else:
+                raise Exception('Unknown op '+op)
+            depth = max(ldepth, rdepth) + 1
+            if depth > MAX_DEPTH:
+                return self.hoist(text), ATOM, 1
+            return text, prec, depth
+        if isinstance(expr, Call):
+            fname = expr.name if isinstance(expr.name, str) else (expr.name.name if isinstance(expr.name, Var) else None)
+            if fname is None:
+                raise Exception('Unsupported call target')
+            args = []
+            depth = 0
+            for a in expr.args:
+                mark = len(self.pre)
+                text, _, adepth = self.emit(a)
+                if len(self.pre) > mark:
+                    for i, prev in enumerate(expr.args[:len(args)]):
+                        if not self.atomic(prev, args[i]):
+                            args[i] = self.hoist(args[i], mark)
+                            mark += 1
+                args.append(text)
+                depth = max(depth, adepth)
+            if fname not in self.functions:
+                text = f'_undefined({", ".join([repr(fname)] + args)})'
+            elif len(args) != self.functions[fname]:
+                text = f'_bad_arity({", ".join([repr(fname), str(self.functions[fname])] + args)})'
+            else:
+                text = f'{self.pyname(fname)}({", ".join(args)})'
+            depth += 1
+            if depth > MAX_DEPTH:
+                return self.hoist(text), ATOM, 1
+            return text, ATOM, depth
+        raise Exception('Unsupported expr in transpiler: '+str(type(expr)))
+
+    def atomic(self, expr, text):
+        # operands whose evaluation cannot fail or observe anything
+        if text in self.temps or isinstance(expr, Number):
+            return True
+        return isinstance(expr, Var) and bool(self.params) and expr.name in self.params
@@ -1,4 +1,7 @@
 import math
+from .memo import MISSING, read_sets, arg_key
+from .codegen import materialize_all, call_table
+from .peephole import BINARY, FUSED
 
 class Frame:
     def __init__(self, codeobj, globals_, functions):
@@ -6,6 +9,7 @@ class Frame:
         self.ip = 0
         self.stack = []
         self.locals = {}
+        self.temps = [None] * codeobj.ntemps
         self.globals = globals_
         self.functions = functions
 
@@ -13,14 +17,47 @@ class VMError(Exception):
     pass
 
 class VM:
-    def __init__(self, main_code, functions):
+    def __init__(self, main_code, functions, memo=None):
         self.main = main_code
         self.functions = functions
         self.globals = {}
+        # opt-in function-result cache (memo.ResultCache)
+        self.memo = memo
+        if memo is not None:
+            # read sets need every body, so lazy stubs are compiled up front
+            materialize_all(functions)
+        self.versions = {}
+        self.reads = read_sets(functions) if memo is not None else {}
+        self.seen = {}
+        self.calls = call_table(functions)
 
     def run(self):
+        if self.memo is not None:
+            self.sync_versions()
         frame = Frame(self.main, self.globals, self.functions)
-        return self.run_frame(frame)
+        try:
+            if self.memo is not None:
+                return self.run_memo_frame(frame)
+            return self.run_frame(frame)
+        finally:
+            if self.memo is not None:
+                self.seen = dict(self.globals)
+
+    def run_code(self, code):
+        # run another main chunk against the same globals and functions
+        self.main = code
+        return self.run()
+
+    def sync_versions(self):
+        # globals changed from outside since the last run (seeded or edited
+        # by the caller) invalidate cached results that read them
+        for name in set(self.seen) | set(self.globals):
+            if self.globals.get(name, MISSING) is not self.seen.get(name, MISSING):
+                self.versions[name] = self.memo.tick()
+
+    def memo_key(self, fname, co, args):
+        versions = self.versions
+        return (co, arg_key(args), tuple(versions.get(n, 0) for n in self.reads.get(fname, ())))
 
     def run_frame(self, frame: Frame):
         instrs = frame.code.instructions
@@ -66,9 +103,9 @@ class VM:
             elif op == 'CALL':
                 fname = ins[1]; argc = ins[2]
                 args = [stack.pop() for _ in range(argc)][::-1]
-                if fname not in self.functions:
+                if fname not in self.calls:
                     raise VMError(f'Call to undefined function {fname}')
-                co = self.functions[fname]
+                co = self.calls[fname]
                 # create new frame for function
                 fframe = Frame(co, frame.globals, self.functions)
                 # bind params by name if available
@@ -83,9 +120,378 @@ class VM:
                 # But our Compiler currently doesn't store param names in CodeObject; to keep simple, assume function bodies use arg0..argN
                 res = self.run_frame(fframe)
                 stack.append(res)
+            elif op == 'DUP':
+                stack.append(stack[-1])
+            elif op == 'STORE_TEMP':
+                frame.temps[ins[1]] = stack.pop()
+            elif op == 'LOAD_TEMP':
+                stack.append(frame.temps[ins[1]])
             elif op == 'RET':
                 # return top of stack or None
                 return stack.pop() if stack else None
+            elif op in FUSED:
+                # peephole code: the rest of this frame, and every call after
+                # it, runs in the loop that knows superinstructions, so code
+                # without them pays nothing
+                self.run_frame = self.run_fused_frame
+                frame.ip -= 1
+                return self.run_fused_frame(frame)
+            else:
+                raise VMError('Unknown instruction '+op)
+        return None
+
+    def run_fused_frame(self, frame: Frame):
+        # run_frame plus the superinstructions of peephole.py, tested first
+        # as they are most of what runs in fused function bodies
+        instrs = frame.code.instructions
+        consts = frame.code.consts
+        stack = frame.stack
+        locals_ = frame.locals
+        while frame.ip < len(instrs):
+            ins = instrs[frame.ip]
+            frame.ip += 1
+            op = ins[0]
+            if op == 'PUSH_CONST':
+                stack.append(consts[ins[1]])
+            elif op == 'LOAD_LOCAL':
+                name = ins[1]
+                if name in locals_:
+                    stack.append(locals_[name])
+                else:
+                    raise VMError(f'Undefined local {name}')
+            elif op == 'LOCAL_LOCAL_BINOP':
+                try:
+                    a = locals_[ins[2]]; b = locals_[ins[3]]
+                except KeyError as e:
+                    raise VMError(f'Undefined local {e.args[0]}') from None
+                stack.append(BINARY[ins[1]](a, b))
+            elif op == 'LOCAL_BINOP':
+                try:
+                    b = locals_[ins[2]]
+                except KeyError:
+                    raise VMError(f'Undefined local {ins[2]}') from None
+                stack[-1] = BINARY[ins[1]](stack[-1], b)
+            elif op == 'BINOP_CONST':
+                stack[-1] = BINARY[ins[1]](stack[-1], ins[2])
+            elif op == 'LOCAL_CONST_BINOP':
+                try:
+                    a = locals_[ins[2]]
+                except KeyError:
+                    raise VMError(f'Undefined local {ins[2]}') from None
+                stack.append(BINARY[ins[1]](a, ins[3]))
+            elif op == 'ADD':
+                b = stack.pop(); a = stack.pop(); stack.append(a+b)
+            elif op == 'MUL':
+                b = stack.pop(); a = stack.pop(); stack.append(a*b)
+            elif op == 'CALL':
+                fname = ins[1]; argc = ins[2]
+                args = [stack.pop() for _ in range(argc)][::-1]
+                if fname not in self.calls:
+                    raise VMError(f'Call to undefined function {fname}')
+                co = self.calls[fname]
+                fframe = Frame(co, frame.globals, self.functions)
+                for i, a in enumerate(args):
+                    if i < len(co.params):
+                        fframe.locals[co.params[i]] = a
+                    else:
+                        fframe.locals[f'arg{i}'] = a
+                stack.append(self.run_fused_frame(fframe))
+            elif op == 'LOAD_VAR':
+                name = ins[1]
+                if name in locals_:
+                    stack.append(locals_[name])
+                elif name in frame.globals:
+                    stack.append(frame.globals[name])
+                else:
+                    raise VMError(f'Undefined variable {name}')
+            elif op == 'STORE_VAR':
+                frame.globals[ins[1]] = stack.pop()
+            elif op == 'STORE_LOAD_VAR':
+                frame.globals[ins[1]] = stack[-1]
+            elif op == 'POP':
+                stack.pop()
+            elif op == 'SUB':
+                b = stack.pop(); a = stack.pop(); stack.append(a-b)
+            elif op == 'DIV':
+                b = stack.pop(); a = stack.pop(); stack.append(a/b)
+            elif op == 'POW':
+                b = stack.pop(); a = stack.pop(); stack.append(math.pow(a,b))
+            elif op == 'DUP':
+                stack.append(stack[-1])
+            elif op == 'STORE_TEMP':
+                frame.temps[ins[1]] = stack.pop()
+            elif op == 'LOAD_TEMP':
+                stack.append(frame.temps[ins[1]])
+            elif op == 'RET':
+                return stack.pop() if stack else None
+            else:
+                raise VMError('Unknown instruction '+op)
+        return None
+
+    def run_memo_frame(self, frame: Frame):
+        # run_frame with the result cache: every store bumps the global's
+        # version and calls go through memo. A separate loop, so VMs
+        # without a cache don't test for one on every store and call.
+        # Stubs were materialized in __init__.
+        memo = self.memo
+        versions = self.versions
+        instrs = frame.code.instructions
+        consts = frame.code.consts
+        stack = frame.stack
+        while frame.ip < len(instrs):
+            ins = instrs[frame.ip]
+            frame.ip += 1
+            op = ins[0]
+            if op == 'PUSH_CONST':
+                stack.append(consts[ins[1]])
+            elif op == 'LOAD_VAR':
+                name = ins[1]
+                if name in frame.locals:
+                    stack.append(frame.locals[name])
+                elif name in frame.globals:
+                    stack.append(frame.globals[name])
+                else:
+                    raise VMError(f'Undefined variable {name}')
+            elif op == 'STORE_VAR':
+                name = ins[1]
+                frame.globals[name] = stack.pop()
+                versions[name] = memo.tick()
+            elif op == 'LOAD_LOCAL':
+                name = ins[1]
+                if name in frame.locals:
+                    stack.append(frame.locals[name])
+                else:
+                    raise VMError(f'Undefined local {name}')
+            elif op == 'POP':
+                stack.pop()
+            elif op == 'ADD':
+                b = stack.pop(); a = stack.pop(); stack.append(a+b)
+            elif op == 'SUB':
+                b = stack.pop(); a = stack.pop(); stack.append(a-b)
+            elif op == 'MUL':
+                b = stack.pop(); a = stack.pop(); stack.append(a*b)
+            elif op == 'DIV':
+                b = stack.pop(); a = stack.pop(); stack.append(a/b)
+            elif op == 'POW':
+                b = stack.pop(); a = stack.pop(); stack.append(math.pow(a,b))
+            elif op == 'CALL':
+                fname = ins[1]; argc = ins[2]
+                args = [stack.pop() for _ in range(argc)][::-1]
+                if fname not in self.calls:
+                    raise VMError(f'Call to undefined function {fname}')
+                co = self.calls[fname]
+                key = self.memo_key(fname, co, args)
+                res = memo.get(key)
+                if res is MISSING:
+                    fframe = Frame(co, frame.globals, self.functions)
+                    for i, a in enumerate(args):
+                        if i < len(co.params):
+                            fframe.locals[co.params[i]] = a
+                        else:
+                            fframe.locals[f'arg{i}'] = a
+                    res = self.run_memo_frame(fframe)
+                    memo.put(key, res)
+                stack.append(res)
+            elif op == 'DUP':
+                stack.append(stack[-1])
+            elif op == 'STORE_TEMP':
+                frame.temps[ins[1]] = stack.pop()
+            elif op == 'LOAD_TEMP':
+                stack.append(frame.temps[ins[1]])
+            elif op == 'RET':
+                return stack.pop() if stack else None
+            elif op == 'LOCAL_LOCAL_BINOP':
+                try:
+                    a = frame.locals[ins[2]]; b = frame.locals[ins[3]]
+                except KeyError as e:
+                    raise VMError(f'Undefined local {e.args[0]}') from None
+                stack.append(BINARY[ins[1]](a, b))
+            elif op == 'LOCAL_CONST_BINOP':
+                try:
+                    a = frame.locals[ins[2]]
+                except KeyError:
+                    raise VMError(f'Undefined local {ins[2]}') from None
+                stack.append(BINARY[ins[1]](a, ins[3]))
+            elif op == 'BINOP_CONST':
+                stack[-1] = BINARY[ins[1]](stack[-1], ins[2])
+            elif op == 'LOCAL_BINOP':
+                try:
+                    b = frame.locals[ins[2]]
+                except KeyError:
+                    raise VMError(f'Undefined local {ins[2]}') from None
+                stack[-1] = BINARY[ins[1]](stack[-1], b)
+            elif op == 'STORE_LOAD_VAR':
+                frame.globals[ins[1]] = stack[-1]
+                versions[ins[1]] = memo.tick()
             else:
                 raise VMError('Unknown instruction '+op)
         return None
+
+
+_UNSET = object()
+
+class SlotVM:
+    # Executes a SlotProgram (see codegen.lower). Dispatch compares the
+    # opcode against literal ints ordered by how often they run; this beat
+    # a table of handler functions, which pays a Python call per instruction.
+    def __init__(self, program):
+        self.program = program
+        self.globals = {}
+        self.slots = None
+
+    def run(self):
+        names = self.program.global_names
+        self.slots = [self.globals.get(name, _UNSET) for name in names]
+        try:
+            return self.execute(self.program.main, [None] * self.program.main.nlocals)
+        finally:
+            for name, val in zip(names, self.slots):
+                if val is not _UNSET:
+                    self.globals[name] = val
+
+    def execute(self, co, locals_):
+        code = co.code
+        consts = co.consts
+        slots = self.slots
+        funcs = self.program.functions
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        ip = 0
+        while True:
+            op = code[ip]
+            arg = code[ip+1]
+            ip += 2
+            if op == 1:  # LOAD_LOCAL
+                push(locals_[arg])
+            elif op == 0:  # PUSH_CONST
+                push(consts[arg])
+            elif op == 4:  # ADD
+                b = pop(); stack[-1] = stack[-1] + b
+            elif op == 6:  # MUL
+                b = pop(); stack[-1] = stack[-1] * b
+            elif op == 5:  # SUB
+                b = pop(); stack[-1] = stack[-1] - b
+            elif op == 7:  # DIV
+                b = pop(); stack[-1] = stack[-1] / b
+            elif op == 2:  # LOAD_VAR
+                val = slots[arg]
+                if val is _UNSET:
+                    raise VMError(f'Undefined variable {self.program.global_names[arg]}')
+                push(val)
+            elif op == 9:  # CALL
+                fco = funcs[arg]
+                n = fco.nparams
+                if n:
+                    args = stack[-n:]
+                    del stack[-n:]
+                else:
+                    args = []
+                if fco.nlocals > n:
+                    args.extend([None] * (fco.nlocals - n))
+                push(self.execute(fco, args))
+            elif op == 8:  # POW
+                b = pop(); stack[-1] = math.pow(stack[-1], b)
+            elif op == 3:  # STORE_VAR
+                slots[arg] = pop()
+            elif op == 10:  # POP
+                pop()
+            elif op == 11:  # RET
+                return pop() if stack else None
+            elif op == 12:  # DUP
+                push(stack[-1])
+            elif op == 13:  # STORE_LOCAL
+                locals_[arg] = pop()
+            else:
+                raise VMError(f'Unknown opcode {op}')
+
+
+class SlotFrame:
+    __slots__ = ('code', 'consts', 'ip', 'base')
+
+class FrameStackVM(SlotVM):
+    # Runs a SlotProgram in one dispatch loop with an explicit frame stack,
+    # so language-level calls never recurse in Python. Arguments stay on
+    # the shared operand stack and the callee addresses them from its base;
+    # RET truncates the stack back to that base. Frames are recycled.
+    def __init__(self, program, max_depth=200000):
+        super().__init__(program)
+        self.max_depth = max_depth
+        self.pool = []
+
+    def execute(self, co, locals_):
+        slots = self.slots
+        funcs = self.program.functions
+        pool = self.pool
+        max_depth = self.max_depth
+        frames = []
+        stack = list(locals_)
+        nmain = len(stack)
+        push = stack.append
+        pop = stack.pop
+        code = co.code
+        consts = co.consts
+        base = 0
+        ip = 0
+        while True:
+            op = code[ip]
+            arg = code[ip+1]
+            ip += 2
+            if op == 1:  # LOAD_LOCAL
+                push(stack[base + arg])
+            elif op == 0:  # PUSH_CONST
+                push(consts[arg])
+            elif op == 4:  # ADD
+                b = pop(); stack[-1] = stack[-1] + b
+            elif op == 6:  # MUL
+                b = pop(); stack[-1] = stack[-1] * b
+            elif op == 5:  # SUB
+                b = pop(); stack[-1] = stack[-1] - b
+            elif op == 7:  # DIV
+                b = pop(); stack[-1] = stack[-1] / b
+            elif op == 2:  # LOAD_VAR
+                val = slots[arg]
+                if val is _UNSET:
+                    raise VMError(f'Undefined variable {self.program.global_names[arg]}')
+                push(val)
+            elif op == 9:  # CALL
+                if len(frames) >= max_depth:
+                    raise VMError('Maximum call depth exceeded')
+                frame = pool.pop() if pool else SlotFrame()
+                frame.code = code
+                frame.consts = consts
+                frame.ip = ip
+                frame.base = base
+                frames.append(frame)
+                co = funcs[arg]
+                code = co.code
+                consts = co.consts
+                base = len(stack) - co.nparams
+                if co.nlocals > co.nparams:
+                    stack.extend([None] * (co.nlocals - co.nparams))
+                ip = 0
+            elif op == 11:  # RET
+                if not frames:
+                    # main's temp slots sit below anything it pushed
+                    return pop() if len(stack) > nmain else None
+                result = pop()
+                del stack[base:]
+                push(result)
+                frame = frames.pop()
+                code = frame.code
+                consts = frame.consts
+                ip = frame.ip
+                base = frame.base
+                pool.append(frame)
+            elif op == 8:  # POW
+                b = pop(); stack[-1] = math.pow(stack[-1], b)
+            elif op == 3:  # STORE_VAR
+                slots[arg] = pop()
+            elif op == 10:  # POP
+                pop()
+            elif op == 12:  # DUP
+                push(stack[-1])
+            elif op == 13:  # STORE_LOCAL
+                stack[base + arg] = pop()
+            else:
+                raise VMError(f'Unknown opcode {op}')
@@ -0,0 +1,643 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+# Ensure imports work regardless of current working directory or machine.
+PROJECT_ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from src.parser import Parser
+from src.semantic import SemanticAnalyzer, SemanticError
+from src.codegen import Compiler, CodeObject, never_compiled
+from src.ast import Number, FunctionDef, Program
+from src.vm import VM, VMError, SlotVM, FrameStackVM
+from src.closures import ClosureVM
+from src.transpiler import Transpiler
+from src.optimizer import Optimizer, call_names
+from src.memo import ResultCache
+from src.batch import BatchEvaluator, numpy
+from src.bytecache import BytecodeCache, compile_cached, dump_code, load_code
+from src.sweep import SweepExecutor, compile_sweep
+from src.server import EvalServer, count_instructions
+from src.profiler import ProfilingVM
+from src.peephole import fuse_program, expand, pair_frequencies, before_after
+from src.regvm import RegisterVM, count_instructions as count_register_instructions, disassemble
+
+print('=== Backend Tests ===')
+
+with open(PROJECT_ROOT / 'examples' / 'example.pcg', 'r', encoding='utf-8') as f:
+    example = f.read()
+
+programs = [
+    example,
+    "result = 1.5 + 2.25 * 2\n",
+    "result = 5 / 2\n",
+    "result = 2 ^ 3\n",
+    "result = 9 ^ 0.5\n",
+    "result = 1 + 2 * 3.0\n",
+    "a = 7\nb = a * a - 3\na = b / 2\nc = a ^ 2\n",
+    "k = 10\nfunction f(x, y) = x * y + k\nr = f(2, 3)\nk = 0.5\ns = f(2, 3)\n",
+    "function g() = 42\nfunction h(a) = g() + a\nr = h(1) - g()\n",
+    "function f(a, b, c) = (a - b) * c ^ 2 / (a + 1)\nr = f(3, 1, 2) + f(1.5, 2, 0.5)\n",
+    "r = 10 / 0\n",
+    "x = 1\nx + 2\ny = x\n",
+    "function sq(x) = x * x\nr = sq(sq(sq(sq(2))))\n",
+    "function f(a, b) = a - (b - (a - (b - 1)))\nr = f(2, 0.5) * f(1, 3) / 4\n",
+    "function f(x) = x + 1\nr = " + ' + '.join(f'f({i}) * {i}' for i in range(300)) + "\n",
+    "k = 2 * 3\nfunction f(x) = x * k + 0 * 1\nr = f(2) + k ^ 1 - (k - 0) / 1\n",
+    "z = (0 - 1) * 0.0\nfunction f(x) = (x / 1) + 0 - 0.0\nr = f(z) * 1\ns = z + 0\nt = f(3) ^ 1\n",
+    "r = 1 / 0 * 1\n",
+    "a = 1\nb = 1.0\nc = 0.0 - 0\nd = 0 - 0.0 * 1\n",
+    "r = (0 - 8) ^ 0.5\n",
+    "y = f(1)\nk = 2\nfunction f(x) = x + k\n",
+    "k = 1\nk = 2\nfunction f(x) = x * k\nr = f(k + 0)\n",
+    "n = 5\nfunction sq(x) = x * x\nfunction a(x) = sq(x) + 1\nfunction b(x, y) = a(x) * y\nr = b(3, n) + b(n, 2.5) + sq(n + 1)\n",
+    "k = 1\nfunction g(x) = x + k\nfunction f(k) = g(k) * k\nr = f(2)\n",
+    "a = 2\nb = 3.5\nfunction f(x) = x / 2\nr = (a + b) * (a + b) + f(a + b)\ns = f(a + b) - f(a + b) * (a + b)\n",
+    "function g(x, y) = (x * y + 1) ^ 2 - (x * y + 1) / (x * y)\nr = g(2, 3) + g(g(1, 2), g(1, 2))\n",
+    "k = 2\nfunction f(x) = x * k\nfunction g(x) = f(x) + f(x)\na = g(1) + g(1.0)\nk = 0.5\nb = g(1) + g(0 - 0.0)\nc = g(0.0)\n",
+    "r = " + '(' * 120 + '1' + ' - 2)' * 120 + "\n",
+    "function f(x) = x\nr = f(" + '(' * 60 + '2' + ' ^ 0.5)' * 60 + ") + f(" + '(1 + ' * 60 + '1' + ')' * 60 + ")\n",
+]
+
+
+def compile_source(src):
+    prog = Parser(src).parse()
+    SemanticAnalyzer().analyze(prog)
+    return prog
+
+
+def outcome(run):
+    # the value run() returned and the globals with their types, or the
+    # exception raised
+    try:
+        result, g = run()
+        return ('ok', repr(result), [(k, type(v).__name__, repr(v)) for k, v in g.items()])
+    except Exception as e:
+        return ('error', type(e).__name__, str(e))
+
+
+def run_vm(prog):
+    main, functions = Compiler().compile(prog)
+    vm = VM(main, functions)
+    return vm.run(), vm.globals
+
+
+def run_slot_vm(prog):
+    vm = SlotVM(Compiler().compile_slots(prog))
+    return vm.run(), vm.globals
+
+
+def run_frame_stack_vm(prog):
+    vm = FrameStackVM(Compiler().compile_slots(prog))
+    return vm.run(), vm.globals
+
+
+def run_closure_vm(prog):
+    main, functions = Compiler().compile(prog)
+    vm = ClosureVM(main, functions)
+    return vm.run(), vm.globals
+
+
+def run_closure_vm_ast(prog):
+    vm = ClosureVM.from_program(prog)
+    return vm.run(), vm.globals
+
+
+def run_transpiled(prog):
+    py = Transpiler().transpile(prog)
+    return py.run(), py.globals
+
+
+def run_optimized(prog):
+    main, functions = Compiler().compile(Optimizer().optimize(prog))
+    vm = VM(main, functions)
+    return vm.run(), vm.globals
+
+
+def run_cse(vm_class, lowered=False):
+    def run(prog):
+        compiler = Compiler(cse=True)
+        vm = vm_class(compiler.compile_slots(prog)) if lowered else vm_class(*compiler.compile(prog))
+        return vm.run(), vm.globals
+    return run
+
+
+def run_memo(prog):
+    vm = VM(*Compiler().compile(prog), memo=ResultCache(maxsize=4))
+    return vm.run(), vm.globals
+
+
+def run_serialized(prog):
+    main, functions = load_code(dump_code(*Compiler(cse=True).compile(prog)))
+    vm = VM(main, functions)
+    return vm.run(), vm.globals
+
+
+def run_lazy(prog):
+    analyzer = SemanticAnalyzer(lazy_functions=True)
+    analyzer.analyze(prog)
+    vm = VM(*Compiler(lazy=True, analyzer=analyzer).compile(prog))
+    return vm.run(), vm.globals
+
+
+def run_peephole(vm_class):
+    def run(prog):
+        vm = vm_class(*Compiler(peephole=True, cse=True).compile(prog))
+        return vm.run(), vm.globals
+    return run
+
+
+def run_register_vm(prog):
+    vm = RegisterVM(Compiler().compile_registers(prog))
+    return vm.run(), vm.globals
+
+
+def run_profiled(prog):
+    vm = ProfilingVM(*Compiler().compile(prog), memo=ResultCache(maxsize=4))
+    return vm.run(), vm.globals
+
+
+backends = [
+    ('SlotVM', run_slot_vm),
+    ('FrameStackVM', run_frame_stack_vm),
+    ('ClosureVM', run_closure_vm),
+    ('ClosureVM(ast)', run_closure_vm_ast),
+    ('Transpiler', run_transpiled),
+    ('Optimizer+VM', run_optimized),
+    ('VM(cse)', run_cse(VM)),
+    ('SlotVM(cse)', run_cse(SlotVM, lowered=True)),
+    ('FrameStackVM(cse)', run_cse(FrameStackVM, lowered=True)),
+    ('ClosureVM(cse)', run_cse(ClosureVM)),
+    ('VM(memo)', run_memo),
+    ('VM(serialized)', run_serialized),
+    ('VM(lazy)', run_lazy),
+    ('ProfilingVM', run_profiled),
+    ('VM(peephole)', run_peephole(VM)),
+    ('ProfilingVM(peephole)', run_peephole(ProfilingVM)),
+    ('ClosureVM(peephole)', run_peephole(ClosureVM)),
+    ('RegisterVM', run_register_vm),
+]
+
+for i, src in enumerate(programs, 1):
+    prog = compile_source(src)
+    expected = outcome(lambda: run_vm(prog))
+    for name, run in backends:
+        got = outcome(lambda: run(prog))
+        if got == expected:
+            print(f'  PASS {name} program {i}')
+        else:
+            print(f'  FAIL {name} program {i}: got {got}, expected {expected}')
+
+print('\n--- Optimizer report ---')
+opt = Optimizer(inline_budget=0)
+folded = opt.optimize(compile_source("k = 2 * 3\nfunction f(x) = x * k * 1 + 2 ^ 2\nr = f(k) + 0\n"))
+print(' ', opt.report())
+body = folded.statements[1].body
+if opt.eliminated == 6 and isinstance(body.left.right, Number) and body.right.value == 4.0:
+    print('  PASS constants folded and propagated')
+else:
+    print('  FAIL unexpected optimizer output:', opt.report())
+layered = compile_source(
+    "n = 5\nfunction sq(x) = x * x\nfunction a(x) = sq(x) + 1\nfunction b(x) = a(x) * 2\n"
+    "function rec(x) = rec(x) + 1\nr = b(3) + b(n) + sq(n + 1)\n")
+opt = Optimizer()
+inlined = opt.optimize(layered)
+print(' ', opt.report())
+calls = call_names(inlined.statements[3].body, set()) | call_names(inlined.statements[5].expr, set())
+if calls == {'sq'} and call_names(inlined.statements[4].body, set()) == {'rec'} and opt.stats['inlined'] == 4:
+    print('  PASS layered wrappers inlined, recursion and duplicated args kept as calls')
+else:
+    print('  FAIL inliner output:', calls, opt.report())
+off = Optimizer(enabled=False)
+if off.optimize(prog) is prog and off.eliminated == 0:
+    print('  PASS optimizer switch off')
+else:
+    print('  FAIL optimizer switch off')
+
+print('\n--- Common subexpressions ---')
+compiler = Compiler(cse=True)
+main, functions = compiler.compile(compile_source("a = 1\nb = 2\nfunction f(x) = x\nr = (a + b) * (a + b) + f(a + b)\n"))
+ops = [ins[0] for ins in main.instructions]
+if compiler.cse_removed == 2 and ops.count('ADD') == 2 and ops.count('LOAD_TEMP') == 2:
+    print('  PASS a+b computed once, evaluations removed:', compiler.cse_removed)
+else:
+    print('  FAIL cse output:', compiler.cse_removed, ops)
+
+print('\n--- Result cache ---')
+prog_memo = compile_source("k = 0\nfunction sq(x) = x * x + k\nfunction h(x) = sq(x) + sq(x) + sq(x + 1)\nr = h(2) + h(2)\n")
+# k is seeded by the caller instead of assigned by the program
+del prog_memo.statements[0]
+main, functions = Compiler().compile(prog_memo)
+cache = ResultCache(maxsize=8)
+vm = VM(main, functions, memo=cache)
+vm.globals['k'] = 3
+vm.run()
+first = dict(cache.stats())
+vm.globals['k'] = 10
+vm.run()
+if first['hits'] == 2 and first['misses'] == 3 and vm.globals['r'] == 2 * (14 + 14 + 19):
+    print('  PASS hits/misses and invalidation on changed global:', cache.stats())
+else:
+    print('  FAIL result cache:', vm.globals, first, cache.stats())
+small = ResultCache(maxsize=1)
+vm = VM(main, functions, memo=small)
+vm.globals['k'] = 3
+vm.run()
+if vm.globals['r'] == 52 and len(small.entries) == 1 and small.evictions == 2:
+    print('  PASS LRU bound respected:', small.stats())
+else:
+    print('  FAIL LRU bound:', vm.globals, small.stats())
+
+print('\n--- Batch evaluation ---')
+batch_src = ("k = 3\nfunction sq(x) = x * x\n"
+             "function f(x, y) = sq(x) * k - y / 2 + (x + y) ^ 0.5 + sq(x) * sq(k)\n"
+             "function g(x) = x * 1024 + k\nfunction h(x) = 1 / x\n")
+batch_prog = compile_source(batch_src)
+columns = [[i for i in range(50)] + [0.5 * i for i in range(50)] + [2 ** 52, 7],
+           [3 for _ in range(50)] + [1.25 * i for i in range(50)] + [1, 2.5]]
+modes = [('python', False)] + ([('numpy', True)] if numpy is not None else [])
+for cse in (False, True):
+    main, functions = Compiler(cse=cse).compile(batch_prog)
+    vm = VM(main, functions)
+    vm.run()
+    for fname, cols in (('f', columns), ('g', columns[:1])):
+        expected = []
+        for row in zip(*cols):
+            call = VM(main, functions)
+            call.globals = dict(vm.globals)
+            frame_main = Compiler().compile(compile_source(batch_src + f"r = {fname}({', '.join(repr(v) for v in row)})\n"))[0]
+            call.main = frame_main
+            call.run()
+            expected.append(call.globals['r'])
+        for mode, use_numpy in modes:
+            got = BatchEvaluator(functions, dict(vm.globals), use_numpy=use_numpy).evaluate(fname, cols, chunk_size=16)
+            same = [(type(a), repr(a)) for a in got] == [(type(b), repr(b)) for b in expected]
+            print(f'  {"PASS" if same else "FAIL"} batch {fname} {mode} cse={cse}')
+if numpy is None:
+    print('  SKIP numpy path (numpy not installed)')
+try:
+    BatchEvaluator(functions, dict(vm.globals), use_numpy=False).evaluate('h', [[1, 0]])
+    print('  FAIL batch should raise for a zero divisor')
+except ZeroDivisionError as e:
+    print('  PASS batch raised ZeroDivisionError like VM')
+try:
+    BatchEvaluator(functions, {}, use_numpy=False).evaluate('g', [[1, 2]])
+    print('  FAIL batch should raise for a missing global')
+except Exception as e:
+    print('  PASS batch raised', type(e).__name__, e)
+
+print('\n--- Bytecode cache ---')
+def code_key(code):
+    main, functions = code
+    def key(co):
+        return (co.instructions, [(type(c), repr(c)) for c in co.consts], co.params, co.ntemps)
+    return key(main), [(name, key(co)) for name, co in functions.items()]
+
+
+with tempfile.TemporaryDirectory() as cache_dir:
+    cache = BytecodeCache(cache_dir)
+    src = programs[8]
+    cold = compile_cached(src, cache, optimize=True)
+    # a warm start must not need the front end at all
+    bytecache = sys.modules['src.bytecache']
+    real_parser = bytecache.Parser
+    bytecache.Parser = None
+    try:
+        warm = compile_cached(src, cache, optimize=True)
+    finally:
+        bytecache.Parser = real_parser
+    same = code_key(warm) == code_key(cold)
+    if same and cache.stats()['hits'] == 1 and cache.stats()['writes'] == 1:
+        print('  PASS warm start loaded without parsing:', cache.stats())
+    else:
+        print('  FAIL warm start', cache.stats())
+    compile_cached(src, cache, optimize=False)
+    if cache.stats()['writes'] == 2:
+        print('  PASS compile options are part of the key')
+    else:
+        print('  FAIL options key', cache.stats())
+    with open(cache.path(cache.key(src, ('optimize', True, 'cse', False))), 'wb') as f:
+        f.write(b'\x00garbage')
+    again = compile_cached(src, cache, optimize=True)
+    if cache.corrupt == 1 and code_key(again) == code_key(cold):
+        print('  PASS corrupted entry treated as a miss and rewritten')
+    else:
+        print('  FAIL corrupted entry', cache.stats())
+    # a second worker sharing the directory sees the entries
+    other = BytecodeCache(cache_dir)
+    if other.get(src, ('optimize', True, 'cse', False)) is not None and not [n for n in os.listdir(cache_dir) if n.endswith('.tmp')]:
+        print('  PASS cache shared between workers, no temporary files left')
+    else:
+        print('  FAIL shared cache', os.listdir(cache_dir))
+    entry_size = os.path.getsize(cache.path(cache.key(src, ('optimize', True, 'cse', False))))
+    small = BytecodeCache(cache_dir, max_bytes=entry_size * 3)
+    for i in range(8):
+        compile_cached(f'r{i} = {i} * 2\n' + src, small)
+    total = sum(os.path.getsize(os.path.join(cache_dir, n)) for n in os.listdir(cache_dir))
+    if total <= small.max_bytes and small.evictions > 0:
+        print('  PASS size bound respected:', small.stats())
+    else:
+        print('  FAIL size bound', total, small.stats())
+    # the directory is only scanned once the size estimate crosses the limit
+    roomy = BytecodeCache(cache_dir)
+    scans = []
+    real_evict = roomy.evict
+    roomy.evict = lambda: (scans.append(1), real_evict())
+    for i in range(5):
+        compile_cached(f'q{i} = {i}\n', roomy)
+    if len(scans) == 1:
+        print('  PASS one directory scan for five writes under the limit')
+    else:
+        print('  FAIL eviction scans', len(scans))
+    # marshal data from another Python version is never looked up
+    real_version = sys.version_info
+    key_here = cache.key(src)
+    try:
+        sys.version_info = (real_version[0], real_version[1] + 1)
+        key_other = cache.key(src)
+    finally:
+        sys.version_info = real_version
+    if key_here != key_other:
+        print('  PASS Python version is part of the key')
+    else:
+        print('  FAIL key ignores the Python version')
+
+print('\n--- Lazy compilation ---')
+library = ''.join(f'function lib{i}(x) = x * {i} + k\n' for i in range(1000))
+lazy_src = 'k = 2\n' + library + 'function bad(x) = x + later\nlater = 1\nr = lib3(1) + lib7(lib3(2))\n'
+lazy_prog = Parser(lazy_src).parse()
+analyzer = SemanticAnalyzer(lazy_functions=True)
+analyzer.analyze(lazy_prog)
+compiler = Compiler(lazy=True, analyzer=analyzer)
+main, functions = compiler.compile(lazy_prog)
+vm = VM(main, functions)
+vm.run()
+if vm.globals['r'] == 5 + (8 * 7 + 2) and compiler.compiled_lazily == 2 and len(never_compiled(functions)) == 999:
+    print('  PASS only called functions compiled, never compiled:', len(never_compiled(functions)))
+else:
+    print('  FAIL lazy compilation', vm.globals, compiler.compiled_lazily, len(never_compiled(functions)))
+# bad() reads a global assigned only after its definition: the deferred
+# check reports it on the first call, as the eager analyzer would up front
+vm.main = Compiler().compile(Parser('s = 1\n').parse())[0]
+vm.main.instructions[0:0] = [('PUSH_CONST', 0), ('CALL', 'bad', 1), ('POP',)]
+try:
+    vm.run()
+    print('  FAIL deferred semantic check not run')
+except SemanticError as e:
+    print('  PASS deferred semantic check on first call:', e)
+
+print('\n--- Profiler ---')
+prof_src = "function sq(x) = x * x\nfunction norm(x, y) = (sq(x) + sq(y)) ^ 0.5\nr = norm(3, 4) + sq(2)\ns = norm(r, 1)\n"
+prof_code = Compiler().compile(compile_source(prof_src))
+vm = ProfilingVM(*prof_code)
+vm.run()
+prof = vm.profile
+calls = {name: stats.calls for name, stats in prof.functions.items()}
+stacks = dict(line.rsplit(' ', 1) for line in prof.collapsed().splitlines())
+if prof.instructions() == count_instructions(*prof_code) and calls == {'<main>': 1, 'norm': 2, 'sq': 5}:
+    print('  PASS', prof.instructions(), 'instructions, calls', calls)
+else:
+    print('  FAIL profile counts', prof.opcodes, calls)
+if set(stacks) == {'<main>', '<main>;norm', '<main>;norm;sq', '<main>;sq'} and all(v.isdigit() for v in stacks.values()):
+    print('  PASS collapsed stacks', sorted(stacks))
+else:
+    print('  FAIL collapsed stacks', stacks)
+norm = prof.functions['norm']
+if norm.inclusive >= norm.exclusive and prof.functions['<main>'].inclusive >= norm.inclusive and 'norm' in prof.report():
+    print('  PASS inclusive covers exclusive')
+else:
+    print('  FAIL inclusive/exclusive', norm.inclusive, norm.exclusive)
+# a user function called main is not the top level
+vm = ProfilingVM(*Compiler().compile(compile_source("function main(x) = x + 1\nr = main(1) + main(2)\n")))
+vm.run()
+stacks = dict(line.rsplit(' ', 1) for line in vm.profile.collapsed().splitlines())
+if vm.profile.functions['main'].calls == 2 and vm.profile.functions['<main>'].calls == 1 and set(stacks) == {'<main>', '<main>;main'}:
+    print('  PASS user function named main profiled on its own')
+else:
+    print('  FAIL function named main', {n: s.calls for n, s in vm.profile.functions.items()}, stacks)
+
+print('\n--- Peephole ---')
+roundtrip = True
+fused_total = plain_total = 0
+for src in programs:
+    main_co, funcs = Compiler(cse=True).compile(compile_source(src))
+    fused_main, fused_funcs = fuse_program(main_co, funcs)
+    for co, fco in [(main_co, fused_main)] + [(funcs[n], fused_funcs[n]) for n in funcs]:
+        roundtrip = roundtrip and expand(fco).instructions == co.instructions
+    plain_total += count_instructions(main_co, funcs)
+    fused_total += count_instructions(fused_main, fused_funcs)
+if roundtrip and fused_total < plain_total:
+    print(f'  PASS expand(fuse(code)) == code, executed instructions {plain_total} -> {fused_total}')
+else:
+    print('  FAIL peephole round trip', roundtrip, plain_total, fused_total)
+pp_src = "function f(x) = x * 2 + 1\nfunction g(a, b) = a - b\nr = f(3)\ns = r + 1\n"
+main_co, funcs = Compiler().compile(compile_source(pp_src))
+fused_main, fused_funcs = fuse_program(main_co, funcs)
+if [ins[0] for ins in fused_funcs['f'].instructions] == ['LOCAL_CONST_BINOP', 'BINOP_CONST', 'RET'] \
+        and fused_funcs['g'].instructions[0] == ('LOCAL_LOCAL_BINOP', 'SUB', 'a', 'b') \
+        and ('STORE_LOAD_VAR', 'r') in fused_main.instructions:
+    print('  PASS superinstructions formed')
+else:
+    print('  FAIL superinstructions', fused_funcs['f'].instructions, fused_main.instructions)
+listing = before_after(funcs['f'], fused_funcs['f'], 'f')
+pairs = pair_frequencies(main_co, funcs)
+if 'LOCAL_CONST_BINOP' in listing and 'LOAD_LOCAL' in listing and pairs[('LOAD_LOCAL', 'PUSH_CONST')] == 1:
+    print('  PASS disassembler and pair frequencies')
+else:
+    print('  FAIL disassembler', listing, pairs)
+# superinstructions reading a local the frame does not have
+broken = {
+    'll': CodeObject([('LOCAL_LOCAL_BINOP', 'SUB', 'a', 'b'), ('RET',)], [], params=['a']),
+    'lc': CodeObject([('LOCAL_CONST_BINOP', 'MUL', 'b', 2, 0), ('RET',)], [2], params=['a']),
+    'lb': CodeObject([('LOAD_LOCAL', 'a'), ('LOCAL_BINOP', 'ADD', 'b'), ('RET',)], [], params=['a']),
+}
+errors = []
+for name in broken:
+    call = CodeObject([('PUSH_CONST', 0), ('CALL', name, 1), ('RET',)], [1])
+    for vm in (VM(call, broken), VM(call, broken, memo=ResultCache()), ProfilingVM(call, broken)):
+        try:
+            vm.run()
+            errors.append(None)
+        except VMError as e:
+            errors.append(str(e))
+if errors == ['Undefined local b'] * 9:
+    print('  PASS superinstructions raise VMError for an undefined local')
+else:
+    print('  FAIL undefined local in superinstructions', errors)
+
+print('\n--- Register VM ---')
+# the same functions called with ints, floats, mixed and special values, one
+# statement at a time so errors (math.pow domain and range errors) are
+# compared too
+specials = ['0', '1', '2', '0.0', '(0 - 0.0)', '0.5', '2.5', '(0 - 2.5)', '1e308', '(1e308 * 10)', '((1e308 * 10) - (1e308 * 10))']
+specials = [v.replace('1e308', '1' + '0' * 308 + '.0') for v in specials]
+calls = ''.join(f'r{i}_{j} = f({a}, {b})\n' for i, a in enumerate(specials) for j, b in enumerate(specials))
+special_src = 'function f(x, y) = x + y - x * y / (y + 1) + (x - y) * x\nfunction p(x, y) = x ^ y\n' + calls
+special_src += ''.join(f'p{i}_{j} = p({a}, {b})\n' for i, a in enumerate(specials) for j, b in enumerate(specials))
+special_prog = compile_source(special_src)
+defs = [s for s in special_prog.statements if isinstance(s, FunctionDef)]
+per_stmt = [Program(defs + [s]) for s in special_prog.statements if not isinstance(s, FunctionDef)]
+mismatches = 0
+for one in per_stmt:
+    ref = outcome(lambda: run_vm(one))
+    if outcome(lambda: run_register_vm(one)) != ref:
+        mismatches += 1
+print(f'  {"PASS" if mismatches == 0 else "FAIL"} {len(per_stmt)} special-value statements, {mismatches} mismatches')
+stack_total = reg_total = 0
+for src in programs:
+    prog = compile_source(src)
+    stack_total += count_instructions(*Compiler().compile(prog))
+    reg_total += count_register_instructions(Compiler().compile_registers(prog))
+reg_prog = Compiler().compile_registers(compile_source("function f(x, y) = x * 2 + y\nk = 3\nr = f(k, k) + k * k\n"))
+listing = disassemble(reg_prog.main)
+seeded = RegisterVM(reg_prog)
+seeded.globals['k'] = 10
+seeded.run()
+if reg_total < stack_total and listing.count('LOAD_GLOBAL') == 1 and disassemble(reg_prog.functions[0]).count('\n') == 3:
+    print(f'  PASS executed instructions stack {stack_total} -> register {reg_total}')
+else:
+    print('  FAIL register instruction counts', stack_total, reg_total, listing)
+if seeded.globals == {'k': 3, 'r': 18}:
+    print('  PASS globals stored by the program win over seeded ones')
+else:
+    print('  FAIL seeded globals', seeded.globals)
+rejected = []
+for options in ({'cse': True}, {'lazy': True}, {'peephole': True}, {'cse': True, 'peephole': True}):
+    try:
+        Compiler(**options).compile_registers(compile_source("r = 1\n"))
+    except Exception as e:
+        rejected.append(str(e))
+if rejected == ['compile_registers does not support cse', 'compile_registers does not support lazy',
+                'compile_registers does not support peephole', 'compile_registers does not support cse, peephole']:
+    print('  PASS stack-code options rejected by compile_registers')
+else:
+    print('  FAIL compile_registers options', rejected)
+
+print('\n--- Parameter sweep ---')
+if __name__ == '__main__':
+    sweep_src = "function f(x, y) = (x * y + k) ^ 0.5 / x\nr = f(a, b) + f(b, a)\ns = r * k\n"
+    sweep_code = compile_sweep(sweep_src, inputs=['a', 'b', 'k'])
+    envs = [{'a': a, 'b': b, 'k': k} for a in range(6) for b in (1, 2.5, 7) for k in (2, 0.5)]
+    expected = []
+    for env in envs:
+        vm = VM(*sweep_code)
+        vm.globals.update(env)
+        expected.append(outcome(lambda: (vm.run(), {'r': vm.globals['r']})))
+    for workers, ordered in ((0, True), (2, True), (2, False)):
+        with SweepExecutor(*sweep_code, outputs=['r'], workers=workers, chunk_size=5) as ex:
+            results = ex.run(iter(envs), ordered=ordered)
+        got = [None] * len(envs)
+        for res in results:
+            # the sweep program's main returns nothing
+            got[res.index] = ('ok', 'None', [(k, type(v).__name__, repr(v)) for k, v in res.values.items()]) if res.ok else ('error',) + res.error
+        in_order = [res.index for res in results] == list(range(len(envs)))
+        if got == expected and (in_order or not ordered) and ex.failed == 6:
+            print(f'  PASS sweep workers={workers} ordered={ordered}, errors captured: {ex.failed}')
+        else:
+            print(f'  FAIL sweep workers={workers} ordered={ordered}', ex.failed)
+    # two in-process executors interleaved keep their own programs
+    double = SweepExecutor(*compile_sweep('r = a * 2\n', inputs=['a']), outputs=['r'], workers=0)
+    triple = SweepExecutor(*compile_sweep('r = a * 3\n', inputs=['a']), outputs=['r'], workers=0)
+    pairs = list(zip(double.map({'a': a} for a in range(3)), triple.map({'a': a} for a in range(3))))
+    if [(x.values['r'], y.values['r']) for x, y in pairs] == [(0, 0), (2, 3), (4, 6)]:
+        print('  PASS in-process executors do not share a program')
+    else:
+        print('  FAIL interleaved executors', pairs)
+
+print('\n--- Evaluation server ---')
+if __name__ == '__main__':
+    import asyncio
+    import json
+
+    async def serve_and_query(start):
+        server = EvalServer(batch_window=0.01)
+        reader, writer = await start(server)
+        async def query(*requests):
+            for r in requests:
+                writer.write(json.dumps(r).encode() + b'\n')
+            await writer.drain()
+            replies = [json.loads(await reader.readline()) for _ in requests]
+            return sorted(replies, key=lambda r: r['id'])
+        try:
+            # one pipelined burst: compiled once, run in a few batches
+            runs = await query(*[{'id': i, 'source': sweep_src, 'inputs': env, 'outputs': ['r']}
+                                 for i, env in enumerate(envs)])
+            pid = next(r['program'] for r in runs if 'program' in r)
+            again = await query({'id': 0, 'program': pid, 'inputs': envs[7]})
+            budget = await query({'id': 0, 'program': pid, 'inputs': envs[7], 'budget': 5},
+                                 {'id': 1, 'op': 'compile', 'source': 'function f(x) = f(x)\nr = f(1)\n'},
+                                 {'id': 2, 'program': 'nope'},
+                                 {'id': 3, 'source': 'r = a +\n'})
+            metrics = (await query({'id': 0, 'op': 'metrics'}))[0]['metrics']
+            scale = 'r = a * 1000000000\n'
+            hostile = await query({'id': 0, 'source': scale, 'inputs': {'a': 'x'}},
+                                  {'id': 1, 'source': scale, 'inputs': {'a': True}},
+                                  {'id': 2, 'source': scale, 'inputs': {'a': [1, 2]}},
+                                  {'id': 3, 'source': scale, 'inputs': {'a': 10 ** 30}},
+                                  {'id': 4, 'source': scale, 'inputs': {'a': 2}, 'outputs': 'r'},
+                                  {'id': 5, 'source': scale, 'inputs': ['a']},
+                                  {'id': 6, 'source': 'r = a * a\n', 'inputs': {'a': 1e300}},
+                                  {'id': 7, 'op': 'compile', 'source': scale, 'inputs': ['a']},
+                                  {'id': 8, 'source': scale, 'inputs': {'a': 2}, 'budget': 'lots'})
+        finally:
+            writer.close()
+            await server.close()
+        return runs, again, budget, metrics, hostile
+
+    async def tcp(server):
+        srv = await server.start('127.0.0.1', 0)
+        return await asyncio.open_connection(*srv.sockets[0].getsockname()[:2])
+
+    async def unix(server):
+        path = os.path.join(tempfile.mkdtemp(), 'eval.sock')
+        await server.start_unix(path)
+        return await asyncio.open_unix_connection(path)
+
+    def reply_outcome(reply):
+        if 'error' in reply:
+            return ('error', reply['error']['type'], reply['error']['message'])
+        return ('ok', 'None', [(k, type(v).__name__, repr(v)) for k, v in reply['globals'].items()])
+
+    for name, start in (('tcp', tcp), ('unix', unix)):
+        runs, again, budget, metrics, hostile = asyncio.run(serve_and_query(start))
+        got = [reply_outcome(r) for r in runs]
+        full = VM(*sweep_code)
+        full.globals.update(envs[7])
+        full.run()
+        if got == expected and again[0]['globals'] == json.loads(json.dumps(full.globals)):
+            print(f'  PASS server ({name}) results match the VM')
+        else:
+            print(f'  FAIL server ({name}) results')
+        if metrics['batches'] < len(envs) and metrics['cache_misses'] == 4 and metrics['cache_hits'] == 2 and metrics['requests'] == len(envs) + 5:
+            print(f'  PASS {len(envs)} requests in {metrics["batches"]} batches, p95 {metrics["latency_ms"]["p95"]:.2f}ms')
+        else:
+            print('  FAIL batching / metrics', metrics)
+        errors = [r.get('error', {}).get('type') for r in budget]
+        if errors == ['RequestError', None, 'RequestError', 'SyntaxError'] and budget[1]['instructions'] is None:
+            print('  PASS budget, recursion and bad requests reported per request')
+        else:
+            print('  FAIL request errors', budget)
+        errors = [r.get('error', {}).get('type') for r in hostile]
+        if errors == ['RequestError'] * 6 + [None, None, 'RequestError'] and hostile[6]['globals'] == {'a': 1e300, 'r': None}:
+            print('  PASS non-numeric inputs rejected, infinite result sent as null')
+        else:
+            print('  FAIL input checks', hostile)
+    main_co, funcs = sweep_code
+    if count_instructions(main_co, funcs) == len(main_co.instructions) + 2 * len(funcs['f'].instructions):
+        print('  PASS static instruction count')
+    else:
+        print('  FAIL static instruction count', count_instructions(main_co, funcs))
+
+# call chains far deeper than the Python recursion limit
+print('\n--- Deep call chain ---')
+depth = 5000
+chain = ''.join(f'function f{i}(x) = f{i + 1}(x + 1)\n' for i in range(depth))
+chain += f'function f{depth}(x) = x\nr = f0(0)\n'
+vm = FrameStackVM(Compiler().compile_slots(compile_source(chain)))
+vm.run()
+if vm.globals.get('r') == depth:
+    print('  PASS FrameStackVM depth', depth)
+else:
+    print('  FAIL FrameStackVM depth', depth, '->', vm.globals.get('r'))
+
+print('\n=== Backend Tests Completed ===')
@@ -0,0 +1,426 @@
+import sys
+import os
+import random
+import tempfile
+import tracemalloc
+from pathlib import Path
+# Ensure imports work regardless of current working directory or machine.
+PROJECT_ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from src.lexer import tokenize, tokenize_compact, tokenize_file, MappedSource
+from src.parser import Parser, PrattParser
+from src.semantic import SemanticAnalyzer
+from src.codegen import Compiler
+from src.vm import VM
+from src.pipeline import StreamingPipeline, run_stream
+from src.incremental import IncrementalSession
+from src.build import build, load_output, output_name
+from src.ast import *
+from src.arena import ArenaProgram
+
+print('=== Front-end Tests ===')
+
+with open(PROJECT_ROOT / 'examples' / 'example.pcg', 'r', encoding='utf-8') as f:
+    example = f.read()
+
+programs = [
+    example,
+    "a = 7\nb = a * a - 3\na = b / 2\nc = a ^ 2\n",
+    "k = 10\nfunction f(x, y) = x * y + k\nr = f(2, 3)\nk = 0.5\ns = f(2, 3)\n",
+    "function g() = 42\nfunction h(a) = g() + a\nr = h(1) - g()\n",
+    "y = f(1)\nk = 2\nfunction f(x) = x + k\n",
+    "r = h(2)\nfunction h(x) = g(x) * 2\nfunction g(x) = x - 0.5\ns = r\n",
+    "x = 1\nx + 2\ny = x\n\n\nz = x ^ 2",
+    "function f(a, b) = a - (b - (a - (b - 1)))\nr = f(2, 0.5) * f(1, 3) / 4\n",
+    "r = 1 + undefined_name\n",
+    "function f(x) = x\nfunction f(y) = y\n",
+    "r = f(1, 2)\nfunction f(x) = x\n",
+    "r = 10 / 0\n",
+]
+
+
+def dump(node):
+    if isinstance(node, list):
+        return [dump(n) for n in node]
+    if isinstance(node, Number):
+        return (type(node.value).__name__, repr(node.value))
+    if isinstance(node, Var):
+        return ('var', node.name)
+    if isinstance(node, BinaryOp):
+        return (node.op, dump(node.left), dump(node.right))
+    if isinstance(node, Call):
+        return ('call', node.name if isinstance(node.name, str) else dump(node.name), dump(node.args))
+    if isinstance(node, Assign):
+        return ('assign', node.name, dump(node.expr))
+    if isinstance(node, FunctionDef):
+        return ('def', node.name, tuple(node.params), dump(node.body))
+    raise TypeError(node)
+
+
+def outcome(run):
+    try:
+        g = run()
+        return ('ok', sorted((k, type(v).__name__, repr(v)) for k, v in g.items()))
+    except Exception as e:
+        return ('error', type(e).__name__, str(e))
+
+
+def batch(src):
+    prog = Parser(src).parse() if isinstance(src, str) else src
+    SemanticAnalyzer().analyze(prog)
+    main, functions = Compiler().compile(prog)
+    vm = VM(main, functions)
+    vm.run()
+    return vm.globals
+
+
+print('\n--- Streaming parser ---')
+for i, src in enumerate(programs):
+    eager = dump(Parser(src).parse().statements)
+    streamed = dump(list(Parser(src, streaming=True).parse_iter()))
+    tokens = dump(Parser(tokenize(src), streaming=True).parse().statements)
+    if eager == streamed == tokens:
+        print(f'  PASS program {i}')
+    else:
+        print(f'  FAIL program {i}: {streamed} != {eager}')
+
+pulled = []
+def counting(src):
+    for tok in tokenize(src):
+        pulled.append(tok)
+        yield tok
+
+big = ''.join(f'x{i} = {i} * 2\n' for i in range(1000))
+first = next(Parser(counting(big), streaming=True).parse_iter())
+if first.name == 'x0' and len(pulled) <= 8:
+    print('  PASS first statement parsed after', len(pulled), 'tokens')
+else:
+    print('  FAIL streaming parser pulled', len(pulled), 'tokens')
+
+print('\n--- Compact tokens ---')
+for i, src in enumerate(programs):
+    plain = [(t.type, type(t.value).__name__, t.value, t.pos) for t in tokenize(src)]
+    compact = [(t.type, type(t.value).__name__, t.value, t.pos) for t in tokenize_compact(src)]
+    same_ast = dump(Parser(tokenize_compact(src)).parse().statements) == dump(Parser(src).parse().statements)
+    if plain == compact and same_ast:
+        print(f'  PASS program {i}')
+    else:
+        print(f'  FAIL program {i}')
+
+for src, expected in [
+    ("a = 1\nb = (2 +\n", 'line 2:9'),
+    ("a = 1\n\nb = 2 $ 3\n", 'line 3:7'),
+    ("x = 1\nf(1, 2", 'line 2:7'),
+]:
+    messages = []
+    for make in (lambda: src, lambda: tokenize_compact(src)):
+        try:
+            Parser(make()).parse()
+        except SyntaxError as e:
+            messages.append(str(e))
+    if len(messages) == 2 and all(expected in m for m in messages):
+        print('  PASS error position', expected)
+    else:
+        print('  FAIL error position', expected, messages)
+
+
+def allocated(make):
+    tracemalloc.start()
+    result = make()  # keep it alive while measuring
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+sizes = (allocated(lambda: list(tokenize(big))), allocated(lambda: tokenize_compact(big)))
+if sizes[1] * 2 < sizes[0]:
+    print('  PASS compact tokens use %.1fx less memory' % (sizes[0] / sizes[1]))
+else:
+    print('  FAIL compact tokens', sizes)
+
+print('\n--- Arena AST ---')
+for i, src in enumerate(programs):
+    arena = ArenaProgram.build(Parser(src, streaming=True).parse_iter())
+    same_ast = dump(list(arena.statements)) == dump(Parser(src).parse().statements)
+    got = outcome(lambda: batch(arena))
+    if same_ast and got == outcome(lambda: batch(src)):
+        print(f'  PASS program {i}')
+    else:
+        print(f'  FAIL program {i}: {got}')
+
+library = 'function f(a, b) = a * b + 1\nx0 = 1\n' + ''.join(f'x{i} = f(x{i-1} + {i % 10}, 2.5) - {i % 3} * x{i-1}\n' for i in range(1, 2000))
+sizes = (allocated(lambda: Parser(library).parse()),
+         allocated(lambda: ArenaProgram.build(Parser(library, streaming=True).parse_iter())))
+if sizes[1] * 2 < sizes[0]:
+    print('  PASS arena uses %.1fx less memory' % (sizes[0] / sizes[1]))
+else:
+    print('  FAIL arena', sizes)
+
+deep = ArenaProgram.build(Parser('r = ' + ' - '.join(str(i % 7) for i in range(50000)) + '\n', streaming=True).parse_iter())
+root = deep.statements[0]
+if len(deep.arena) == 100000 and isinstance(root.expr, BinaryOp) and root.expr.right.value == 49999 % 7:
+    print('  PASS 50000-term expression stored and materialized without recursion')
+else:
+    print('  FAIL deep arena expression')
+
+print('\n--- Pratt parser ---')
+def parsed(parser_class, src):
+    try:
+        return dump(parser_class(src).parse().statements)
+    except SyntaxError as e:
+        return ('SyntaxError', str(e))
+
+
+def random_expression(rng, depth):
+    if depth <= 0 or rng.random() < 0.25:
+        return rng.choice(['1', '2.5', 'x', 'y', 'f()', '(x)'])
+    pick = rng.random()
+    if pick < 0.55:
+        op = rng.choice(['+', '-', '*', '/', '^'])
+        return random_expression(rng, depth-1) + f' {op} ' + random_expression(rng, depth-1)
+    if pick < 0.75:
+        return '(' + random_expression(rng, depth-1) + ')'
+    args = ', '.join(random_expression(rng, depth-2) for _ in range(rng.randint(0, 3)))
+    return rng.choice(['f', 'g', '(h)', 'f(1)']) + '(' + args + ')'
+
+
+rng = random.Random(1234)
+sources = list(programs)
+for _ in range(400):
+    sources.append(f'r = {random_expression(rng, 6)}\n')
+# broken input must fail the same way
+tokens = ['1', 'x', '+', '*', '^', '(', ')', ',', 'f', '=', '\n']
+for _ in range(400):
+    sources.append(' '.join(rng.choice(tokens) for _ in range(rng.randint(1, 10))))
+mismatches = [src for src in sources if parsed(PrattParser, src) != parsed(Parser, src)]
+if not mismatches:
+    print(f'  PASS {len(sources)} sources parse identically (errors included)')
+else:
+    print('  FAIL Pratt parser differs on', mismatches[:3])
+
+nested = 'r = ' + '(' * 20000 + 'x' + ' + 1)' * 20000 + '\n'
+node = PrattParser(nested).parse().statements[0].expr
+depth = 0
+while isinstance(node, BinaryOp):
+    node = node.left
+    depth += 1
+if depth == 20000 and isinstance(node, Var):
+    print('  PASS 20000 nested parentheses')
+else:
+    print('  FAIL nested parentheses', depth)
+
+print('\n--- Statement pipeline ---')
+for i, src in enumerate(programs):
+    got = outcome(lambda: run_stream(src))
+    expected = outcome(lambda: batch(src))
+    if got == expected:
+        print(f'  PASS program {i}')
+    else:
+        print(f'  FAIL program {i}: got {got}, expected {expected}')
+
+pipeline = StreamingPipeline()
+pipeline.feed(Parser("a = 3\n").parse().statements[0])
+ran_early = pipeline.globals.get('a') == 3
+pipeline.feed(Parser("b = f(a)\n").parse().statements[0])
+waiting = 'b' not in pipeline.globals
+pipeline.feed(Parser("function f(x) = x * x\n").parse().statements[0])
+pipeline.finish()
+if ran_early and waiting and pipeline.globals.get('b') == 9:
+    print('  PASS statements run as soon as their callees are compiled')
+else:
+    print('  FAIL pipeline order:', ran_early, waiting, pipeline.globals)
+
+# a long queue waiting on a late definition: each statement's names are
+# collected once, not on every feed
+import src.pipeline as pipeline_module
+collected = []
+original_free_names = pipeline_module.free_names
+pipeline_module.free_names = lambda stmt: (collected.append(stmt), original_free_names(stmt))[1]
+try:
+    waiting_src = 'a = 1\n' + ''.join(f'r{i} = g(a, {i})\n' for i in range(2000)) + 'function g(x, y) = h(x) + y\nfunction h(x) = x * 2\n'
+    pipeline = StreamingPipeline()
+    pipeline.feed_all(Parser(waiting_src).parse_iter())
+finally:
+    pipeline_module.free_names = original_free_names
+if len(collected) == 2003 and pipeline.globals.get('r1999') == 2001:
+    print('  PASS free names collected once per statement:', len(collected))
+else:
+    print('  FAIL free names collected', len(collected), 'times')
+
+pipeline = StreamingPipeline(max_waiting=10)
+if outcome(lambda: pipeline.feed_all(Parser(waiting_src).parse_iter()))[1] == 'SemanticError':
+    print('  PASS max_waiting bounds the unchecked queue')
+else:
+    print('  FAIL max_waiting', len(pipeline.unchecked))
+
+print('\n--- Incremental session ---')
+def run_session(session):
+    vm = VM(*session.compile())
+    vm.run()
+    return vm.globals
+
+
+rng = random.Random(99)
+slots = [
+    ['k = 2', 'k = 0.5', 'k = 2 +', ''],
+    ['function f(x) = x * k', 'function f(x, y) = x - y', 'function f(x) = g(x) + 1', ''],
+    ['function g(x) = x + 1', 'function g(x) = x * kk', ''],
+    ['kk = k + 1', 'kk = 3', ''],
+    ['r = f(2) / k', 'r = f(1, 2)', 'r = g(k)', 'f(2) + 1'],
+    ['s = r + kk', 's = h()', ''],
+    ['function h() = g(2)', 'function h() = 7 ^ k', 'function g(x) = x', ''],
+]
+lines = [(i, variants[0]) for i, variants in enumerate(slots)]
+session = IncrementalSession('\n'.join(text for _, text in lines))
+mismatches = 0
+seen = set()
+for step in range(400):
+    i = rng.randrange(len(lines))
+    slot = lines[i][0]
+    if rng.random() < 0.2:
+        # filler lines shift everything after them
+        if slot is None:
+            del lines[i]
+            session.edit(i, i + 1, [])
+        else:
+            lines.insert(i, (None, 'z = k'))
+            session.edit(i, i, ['z = k'])
+    elif slot is not None:
+        text = rng.choice(slots[slot])
+        lines[i] = (slot, text)
+        session.edit_line(i + 1, text)
+    got = outcome(lambda: run_session(session))
+    expected = outcome(lambda: batch('\n'.join(text for _, text in lines) + '\n'))
+    seen.add(got[0] if got[0] == 'ok' else got[1])
+    if got != expected:
+        mismatches += 1
+if not mismatches and seen == {'ok', 'SyntaxError', 'SemanticError'}:
+    print('  PASS 400 random edits match a full recompile')
+else:
+    print('  FAIL incremental session differs after', mismatches, 'edits', seen)
+
+library = ['k = 3'] + [f'function f{i}(x, y) = x * y + k - {i}\nv{i} = f{i}({i}, k) + ' + (f'v{i-1}' if i else '1') for i in range(2000)]
+session = IncrementalSession('\n'.join(library))
+session.edit_line(2 * 500 + 3, 'v500 = f500(1, 2) * 3')
+edit_stats = dict(session.stats)
+session.edit_line(1, 'k = 4')
+if edit_stats['parsed'] == 1 and edit_stats['checked'] == 1 and session.stats['checked'] == 1:
+    print('  PASS edits re-check only what they affect')
+else:
+    print('  FAIL incremental stats', edit_stats, session.stats)
+session.edit_line(2 * 500 + 2, 'function f500(x) = x')
+if session.stats['checked'] == 2 and session.errors() == [(1003, 'Function f500 expects 1 args, got 2')]:
+    print('  PASS arity change re-checks callers:', session.errors())
+else:
+    print('  FAIL arity change', session.stats, session.errors())
+
+# typing a line one keystroke at a time: the parse cache keeps the current
+# lines plus a bounded number of texts that left the document
+session = IncrementalSession('a = 1\nb = a', keep=8)
+typed = 'c = a * 2 + b / 3 - a ^ 2'
+for n in range(1, len(typed) + 1):
+    session.edit_line(3, typed[:n])
+session.edit_line(3, typed[:-4])
+if len(session.parsed) == 3 and len(session.recent) == 7 and session.stats['parsed'] == 0 and session.errors() == []:
+    print('  PASS parse cache bounded while typing:', len(session.parsed), '+', len(session.recent))
+else:
+    print('  FAIL parse cache', len(session.parsed), len(session.recent), session.stats)
+
+print('\n--- Memory-mapped lexer ---')
+with tempfile.TemporaryDirectory() as tmp:
+    def source_file(src, name='source.pcg'):
+        path = os.path.join(tmp, name)
+        with open(path, 'wb') as f:
+            f.write(src if isinstance(src, bytes) else src.encode('utf-8'))
+        return path
+
+    for i, src in enumerate(programs + ['', 'function\tf(x)=x\n\n']):
+        path = source_file(src)
+        plain = [(t.type, type(t.value).__name__, t.value, t.pos) for t in tokenize(src)]
+        mapped = [(t.type, type(t.value).__name__, t.value, t.pos) for t in tokenize_file(path)]
+        same_ast = dump(Parser(MappedSource(path)).parse().statements) == dump(Parser(src).parse().statements)
+        if plain == mapped and same_ast:
+            print(f'  PASS program {i}')
+        else:
+            print(f'  FAIL program {i}')
+
+    for src, expected in [
+        ("a = 1\nb = (2 +\n", 'line 2:9'),
+        ("a = 1\n\nb = 2 $ 3\n", 'line 3:7'),
+        ("x = 1\nf(1, 2", 'line 2:7'),
+        ("x = 1\ny = \u00e9\n", 'line 2:5'),
+    ]:
+        messages = []
+        for make in (lambda: src, lambda: MappedSource(source_file(src))):
+            try:
+                Parser(make()).parse()
+            except SyntaxError as e:
+                messages.append(str(e))
+        if len(messages) == 2 and messages[0] == messages[1] and expected in messages[0]:
+            print('  PASS error position', expected)
+        else:
+            print('  FAIL error position', expected, messages)
+
+    # streaming from the map never holds the file as a str
+    path = source_file(big * 20, 'big.pcg')
+
+    def peak(make):
+        tracemalloc.start()
+        for _ in Parser(make(), streaming=True).parse_iter():
+            pass
+        size = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return size
+
+    def read_text():
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+
+    peaks = (peak(read_text), peak(lambda: MappedSource(path)))
+    if peaks[1] * 4 < peaks[0]:
+        print('  PASS mapped file parses with %.1fx lower peak memory' % (peaks[0] / peaks[1]))
+    else:
+        print('  FAIL mapped file peak memory', peaks)
+
+print('\n--- Parallel build ---')
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        source_dir = os.path.join(tmp, 'src')
+        out_dir = os.path.join(tmp, 'out')
+        os.makedirs(os.path.join(source_dir, 'nested'))
+        for i, src in enumerate(programs):
+            with open(os.path.join(source_dir, 'nested' if i % 2 else '', f'p{i}.pcg'), 'w', encoding='utf-8') as f:
+                f.write(src)
+        first = build(source_dir, out_dir, workers=2)
+        built_ok = True
+        for rel in first.compiled:
+            with open(os.path.join(source_dir, rel), encoding='utf-8') as f:
+                src = f.read()
+            vm = VM(*load_output(out_dir, rel))
+            if outcome(lambda: (vm.run(), vm.globals)[1]) != outcome(lambda: batch(src)):
+                built_ok = False
+        expected_failures = sum(1 for src in programs if outcome(lambda: batch(src))[1] in ('SyntaxError', 'SemanticError'))
+        if built_ok and len(first.failed) == expected_failures and len(first.compiled) + len(first.failed) == len(programs):
+            print('  PASS built', len(first.compiled), 'files, errors:', sorted(first.errors_by_type()))
+        else:
+            print('  FAIL build', first.summary())
+        with open(os.path.join(source_dir, 'p0.pcg'), 'a', encoding='utf-8') as f:
+            f.write('extra = 1\n')
+        second = build(source_dir, out_dir, workers=0)
+        if second.compiled == ['p0.pcg'] and len(second.skipped) == len(first.compiled) - 1:
+            print('  PASS only the changed file rebuilt:', second.summary().splitlines()[0])
+        else:
+            print('  FAIL incremental build', second.compiled, second.skipped)
+        # a source that stops compiling, or disappears, takes its output along
+        with open(os.path.join(source_dir, 'p0.pcg'), 'a', encoding='utf-8') as f:
+            f.write('broken = (\n')
+        deleted = os.path.join('nested', 'p1.pcg')
+        os.remove(os.path.join(source_dir, deleted))
+        third = build(source_dir, out_dir, workers=0)
+        outputs = [os.path.join(out_dir, output_name(rel)) for rel in ('p0.pcg', deleted)]
+        if not any(os.path.exists(path) for path in outputs) and third.removed == [output_name(deleted)]:
+            print('  PASS stale outputs removed:', third.summary().splitlines()[0])
+        else:
+            print('  FAIL stale outputs', [os.path.exists(path) for path in outputs], third.removed)
+
+print('\n=== Front-end Tests Completed ===')
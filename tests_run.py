@@ -10,6 +10,7 @@ from src.semantic import SemanticAnalyzer
 from src.codegen import Compiler
 from src.vm import VM
 from src.ast import *
+from src.arena import ArenaProgram
 
 print('=== Test Suite: mini-compilador ===')
 
@@ -125,4 +126,15 @@ try:
 except Exception as e:
     print('Semantic error detected as expected:', e)
 
+# Test 9: arena-backed AST walks like the object AST
+print('\n--- Arena AST test ---')
+arena_prog = ArenaProgram.build(Parser(ex, streaming=True).parse_iter())
+print('Rows:', len(arena_prog.arena), 'statements:', len(arena_prog.statements))
+same_ast = ast_to_str(arena_prog) == ast_to_str(prog)
+SemanticAnalyzer().analyze(arena_prog)
+arena_main, arena_functions = Compiler().compile(arena_prog)
+arena_vm = VM(arena_main, arena_functions)
+arena_vm.run()
+print('Same AST:', same_ast, 'same globals:', arena_vm.globals == vm.globals)
+
 print('\n=== Test Suite Completed ===')